@@ -1,12 +1,16 @@
 import asyncio
+import concurrent.futures
 import contextlib
 import functools
+import hashlib
 import io
+import itertools
 import json
 import logging
 import os
 import re
 import math
+import multiprocessing
 import shutil
 import subprocess
 import tempfile
@@ -14,10 +18,10 @@ import time
 import textwrap
 import random
 import urllib.request
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone, date
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import aiosqlite
 from aiogram import Bot, Dispatcher, F
@@ -126,6 +130,9 @@ RATE_LIMIT_WINDOW_MINUTES = int(os.getenv("RATE_LIMIT_WINDOW_MINUTES", "30"))
 ACTIVITY_SMOOTH_SIGMA = float(os.getenv("ACTIVITY_SMOOTH_SIGMA", "0.6"))
 ACTIVITY_AMPLIFY = float(os.getenv("ACTIVITY_AMPLIFY", "1.2"))
 DB_PATH = os.getenv("DB_PATH", os.path.join("data", "bot.db"))
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join("data", "cache", "media"))
+MEDIA_CACHE_MAX_MB = float(os.getenv("MEDIA_CACHE_MAX_MB", "2048"))        # дисковый кеш скачанных из Telegram файлов, 0 — выключен
+MEDIA_CACHE_MAX_FILE_MB = float(os.getenv("MEDIA_CACHE_MAX_FILE_MB", "64"))  # файлы крупнее в кеш не кладём
 TZ = timezone(timedelta(hours=TZ_OFFSET_HOURS))
 
 # переменные для Мнемосины. настроить если есть проблемы, но дефолты в целом норм
@@ -144,13 +151,27 @@ DUPLICATE_SIZE_TOLERANCE_BYTES_SLOW = int(os.getenv("DUPLICATE_SIZE_TOLERANCE_BY
 DUPLICATE_SIZE_CANDIDATE_LIMIT      = int(os.getenv("DUPLICATE_SIZE_CANDIDATE_LIMIT", "500"))
 DUPLICATE_SIZE_CANDIDATE_LIMIT_SLOW = int(os.getenv("DUPLICATE_SIZE_CANDIDATE_LIMIT_SLOW", "5000"))
 DUPLICATE_SYNC_TIMEOUT_SECONDS      = float(os.getenv("DUPLICATE_SYNC_TIMEOUT_SECONDS", "2"))
+DUPLICATE_STAGE_HASH_SECONDS        = float(os.getenv("DUPLICATE_STAGE_HASH_SECONDS", "60"))    # бюджет сверки хешей картинок с архивом (отпечатки снимаются вне его), 0 = без лимита
+DUPLICATE_STAGE_VIDEO_SECONDS       = float(os.getenv("DUPLICATE_STAGE_VIDEO_SECONDS", "120"))  # бюджет выравнивания видео (отпечатки снимаются вне его)
+DUPLICATE_STAGE_ASIFT_SECONDS       = float(os.getenv("DUPLICATE_STAGE_ASIFT_SECONDS", "8"))    # бюджет ASIFT; у SIFT — DUPLICATE_GEOMETRY_TIMEOUT_SECONDS
+DUPLICATE_STAGE_ORB_SECONDS         = float(os.getenv("DUPLICATE_STAGE_ORB_SECONDS", "8"))      # бюджет ORB для того, что не подтвердили SIFT/ASIFT; ORB выключается DUPLICATE_ORB_TOPK=0
+DUPLICATE_RESULT_CACHE_TTL_SECONDS  = float(os.getenv("DUPLICATE_RESULT_CACHE_TTL_SECONDS", "900"))  # повторная отправка тех же файлов берёт готовый результат, 0 = без кеша
+DUPLICATE_RESULT_CACHE_SIZE         = int(os.getenv("DUPLICATE_RESULT_CACHE_SIZE", "256"))
 DUPLICATE_BACKFILL_MAX_POSTS        = int(os.getenv("DUPLICATE_BACKFILL_MAX_POSTS", "50000"))
 DUPLICATE_SINGLE_HASH_THRESHOLD     = int(os.getenv("DUPLICATE_SINGLE_HASH_THRESHOLD", "4"))
-DUPLICATE_FULLSCAN_LIMIT            = int(os.getenv("DUPLICATE_FULLSCAN_LIMIT", "50000"))      ## типа лимит по постам дальше которого не сканит
+DUPLICATE_FULLSCAN_LIMIT            = int(os.getenv("DUPLICATE_FULLSCAN_LIMIT", "50000"))      ## типа лимит по постам дальше которого не сканит (только без индекса, 0 = фуллскан выключен)
+DUPLICATE_MIH_CHUNKS                = int(os.getenv("DUPLICATE_MIH_CHUNKS", "4"))               # на сколько кусков резать 64-битный хеш для multi-index hashing
+DUPLICATE_MIH_MAX_PROBES            = int(os.getenv("DUPLICATE_MIH_MAX_PROBES", "2048"))        # если проб больше, дешевле линейный проход по индексу
+DUPLICATE_MIH_RECALL_SAMPLE_RATE    = float(os.getenv("DUPLICATE_MIH_RECALL_SAMPLE_RATE", "0.02"))
+DUPLICATE_WORKER_PROCESSES          = int(os.getenv("DUPLICATE_WORKER_PROCESSES", str(min(4, os.cpu_count() or 1))))  # процессы под хеши/SIFT/ffmpeg, 0 = потоки в том же процессе
+DUPLICATE_WORKER_QUEUE_LIMIT        = int(os.getenv("DUPLICATE_WORKER_QUEUE_LIMIT", "16"))      # сколько задач одновременно в пуле, остальные ждут (backpressure)
+DUPLICATE_HASH_PHOTO_SIDE           = int(os.getenv("DUPLICATE_HASH_PHOTO_SIDE", "320"))        # хеши считаем с самого маленького PhotoSize с длинной стороной не меньше этой, оригинал только для SIFT (0 = всегда оригинал)
+DUPLICATE_HASH_DECODE_DIM           = int(os.getenv("DUPLICATE_HASH_DECODE_DIM", "256"))        # уровень пирамиды для хешей (длинная сторона), 0 = хешировать с оригинала
 DUPLICATE_GAUSSIAN_BLUR_RADIUS      = float(os.getenv("DUPLICATE_GAUSSIAN_BLUR_RADIUS", "0.25"))
 DUPLICATE_IMAGE_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("DUPLICATE_IMAGE_DOWNLOAD_TIMEOUT_SECONDS", "15"))
 DUPLICATE_IMAGE_DOWNLOAD_RETRIES    = int(os.getenv("DUPLICATE_IMAGE_DOWNLOAD_RETRIES", "3"))
 DUPLICATE_IMAGE_DOWNLOAD_RETRY_DELAY_SECONDS = float(os.getenv("DUPLICATE_IMAGE_DOWNLOAD_RETRY_DELAY_SECONDS", "0.7"))
+DUPLICATE_ITEM_CONCURRENCY          = int(os.getenv("DUPLICATE_ITEM_CONCURRENCY", "4"))         # сколько элементов альбома качаем и хешируем одновременно
 DUPLICATE_ORB_TOPK                  = int(os.getenv("DUPLICATE_ORB_TOPK", "80"))
 DUPLICATE_ORB_MAX_FEATURES          = int(os.getenv("DUPLICATE_ORB_MAX_FEATURES", "1000"))
 DUPLICATE_ORB_MIN_MATCHES           = int(os.getenv("DUPLICATE_ORB_MIN_MATCHES", "10"))
@@ -160,25 +181,29 @@ DUPLICATE_ORB_RATIO                 = float(os.getenv("DUPLICATE_ORB_RATIO", "0.
 DUPLICATE_ORB_MAX_DIM               = int(os.getenv("DUPLICATE_ORB_MAX_DIM", "1024"))
 DUPLICATE_ORB_TOPK_SIZE             = int(os.getenv("DUPLICATE_ORB_TOPK_SIZE", "60"))
 DUPLICATE_ORB_RANSAC_REPROJ         = float(os.getenv("DUPLICATE_ORB_RANSAC_REPROJ", "5.0"))
-DUPLICATE_ORB_RANSAC_MIN_INLIERS    = int(os.getenv("DUPLICATE_ORB_RANSAC_MIN_INLIERS", "6"))
-DUPLICATE_ORB_RANSAC_MIN_RATIO      = float(os.getenv("DUPLICATE_ORB_RANSAC_MIN_RATIO", "0.25"))
-DUPLICATE_ORB_RANSAC_MIN_INLIERS_LOOSE = int(os.getenv("DUPLICATE_ORB_RANSAC_MIN_INLIERS_LOOSE", "4"))
-DUPLICATE_ORB_RANSAC_MIN_RATIO_LOOSE   = float(os.getenv("DUPLICATE_ORB_RANSAC_MIN_RATIO_LOOSE", "0.6"))
+DUPLICATE_ORB_RANSAC_MIN_INLIERS    = int(os.getenv("DUPLICATE_ORB_RANSAC_MIN_INLIERS", "40"))     # у несвязанных картинок RANSAC набирает до ~25 точек при доле до 0.4
+DUPLICATE_ORB_RANSAC_MIN_RATIO      = float(os.getenv("DUPLICATE_ORB_RANSAC_MIN_RATIO", "0.5"))
+DUPLICATE_ORB_RANSAC_MIN_INLIERS_LOOSE = int(os.getenv("DUPLICATE_ORB_RANSAC_MIN_INLIERS_LOOSE", "25"))
+DUPLICATE_ORB_RANSAC_MIN_RATIO_LOOSE   = float(os.getenv("DUPLICATE_ORB_RANSAC_MIN_RATIO_LOOSE", "0.7"))
 DUPLICATE_ORB_MIN_RATIO_LOOSE       = float(os.getenv("DUPLICATE_ORB_MIN_RATIO_LOOSE", "0.08"))
 DUPLICATE_ORB_ROTATION_DEGREES      = _parse_float_list(os.getenv("DUPLICATE_ORB_ROTATION_DEGREES", "0,7,-7"))
 DUPLICATE_ORB_CROP_SCALES           = _parse_float_list(os.getenv("DUPLICATE_ORB_CROP_SCALES", "1.0,0.85"))
 DUPLICATE_ORB_VARIANT_LIMIT         = int(os.getenv("DUPLICATE_ORB_VARIANT_LIMIT", "6"))
 DUPLICATE_ORB_SIZE_AREA_WEIGHT      = float(os.getenv("DUPLICATE_ORB_SIZE_AREA_WEIGHT", "0.4"))
+DUPLICATE_ORB_FEATURE_VERSION       = int(os.getenv("DUPLICATE_ORB_FEATURE_VERSION", "1"))
 DUPLICATE_GEOMETRY_ENABLED          = os.getenv("DUPLICATE_GEOMETRY_ENABLED", "true").lower() in {"1", "true", "yes", "on"}
 DUPLICATE_GEOMETRY_TIMEOUT_SECONDS  = float(os.getenv("DUPLICATE_GEOMETRY_TIMEOUT_SECONDS", "12"))
 DUPLICATE_GEOMETRY_MAX_MATCHES_PER_ITEM = int(os.getenv("DUPLICATE_GEOMETRY_MAX_MATCHES_PER_ITEM", "4"))
+DUPLICATE_GEOMETRY_CONCURRENCY      = int(os.getenv("DUPLICATE_GEOMETRY_CONCURRENCY", "4"))     # столько кандидатов геометрии готовим одновременно, сверяем потом одной пачкой
 DUPLICATE_SIFT_FEATURE_VERSION      = int(os.getenv("DUPLICATE_SIFT_FEATURE_VERSION", "1"))
+DUPLICATE_FEATURE_CACHE_MB          = float(os.getenv("DUPLICATE_FEATURE_CACHE_MB", "128"))   # память под разобранные SIFT/ASIFT/ORB архива, общая для всех проверок; 0 — без кеша
 DUPLICATE_SIFT_TOPK                 = int(os.getenv("DUPLICATE_SIFT_TOPK", "12"))
 DUPLICATE_SIFT_TOPK_SIZE            = int(os.getenv("DUPLICATE_SIFT_TOPK_SIZE", "4"))
 DUPLICATE_SIFT_MAX_DIM              = int(os.getenv("DUPLICATE_SIFT_MAX_DIM", "900"))
 DUPLICATE_SIFT_NFEATURES            = int(os.getenv("DUPLICATE_SIFT_NFEATURES", "1200"))
 DUPLICATE_SIFT_CONTRAST_THRESHOLD   = float(os.getenv("DUPLICATE_SIFT_CONTRAST_THRESHOLD", "0.03"))
 DUPLICATE_SIFT_RATIO                = float(os.getenv("DUPLICATE_SIFT_RATIO", "0.75"))
+DUPLICATE_SIFT_FLANN_CHECKS         = int(os.getenv("DUPLICATE_SIFT_FLANN_CHECKS", "64"))       # обход KD-дерева при пакетном сопоставлении кандидатов, 0 = точный перебор
 DUPLICATE_SIFT_MUTUAL               = os.getenv("DUPLICATE_SIFT_MUTUAL", "true").lower() in {"1", "true", "yes", "on"}
 DUPLICATE_SIFT_MIN_GOOD             = int(os.getenv("DUPLICATE_SIFT_MIN_GOOD", "18"))
 DUPLICATE_SIFT_MIN_INLIERS          = int(os.getenv("DUPLICATE_SIFT_MIN_INLIERS", "12"))
@@ -199,6 +224,11 @@ FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
 FFPROBE_PATH = os.getenv("FFPROBE_PATH", "ffprobe")
 DUPLICATE_VIDEO_FULLSCAN_LIMIT      = int(os.getenv("DUPLICATE_VIDEO_FULLSCAN_LIMIT", "20000"))
 DUPLICATE_VIDEO_TOPK                = int(os.getenv("DUPLICATE_VIDEO_TOPK", "400"))
+DUPLICATE_VIDEO_LSH_BANDS           = int(os.getenv("DUPLICATE_VIDEO_LSH_BANDS", "4"))          # полос на 64-битный хеш кадра для LSH по кадрам (4/8/16), 0 — кандидаты только по метаданным
+DUPLICATE_VIDEO_LSH_TOPK            = int(os.getenv("DUPLICATE_VIDEO_LSH_TOPK", "100"))         # сколько кандидатов по голосам LSH добавлять к топу по метаданным
+DUPLICATE_VIDEO_LSH_MIN_VOTES       = int(os.getenv("DUPLICATE_VIDEO_LSH_MIN_VOTES", "2"))      # минимум кадров запроса с общей полосой
+DUPLICATE_VIDEO_LSH_MAX_BUCKET      = int(os.getenv("DUPLICATE_VIDEO_LSH_MAX_BUCKET", "2000"))  # корзины больше (чёрные кадры и т.п.) не голосуют
+DUPLICATE_VIDEO_FRAMES_CACHE_SIZE   = int(os.getenv("DUPLICATE_VIDEO_FRAMES_CACHE_SIZE", "20000"))  # разобранных frame_hashes в памяти, по id отпечатка
 DUPLICATE_VIDEO_FRAME_EVERY_SECONDS = float(os.getenv("DUPLICATE_VIDEO_FRAME_EVERY_SECONDS", "20"))
 DUPLICATE_VIDEO_FRAME_MIN           = int(os.getenv("DUPLICATE_VIDEO_FRAME_MIN", "4"))
 DUPLICATE_VIDEO_FRAME_MAX           = int(os.getenv("DUPLICATE_VIDEO_FRAME_MAX", "16"))
@@ -209,6 +239,7 @@ DUPLICATE_VIDEO_BLACK_MEAN_MAX      = float(os.getenv("DUPLICATE_VIDEO_BLACK_MEA
 DUPLICATE_VIDEO_WHITE_MEAN_MIN      = float(os.getenv("DUPLICATE_VIDEO_WHITE_MEAN_MIN", "243"))
 DUPLICATE_VIDEO_MIN_STD             = float(os.getenv("DUPLICATE_VIDEO_MIN_STD", "6"))
 DUPLICATE_VIDEO_FRAME_SEARCH_OFFSETS = _parse_float_list(os.getenv("DUPLICATE_VIDEO_FRAME_SEARCH_OFFSETS", "0,0.5,-0.5,1,-1"))
+DUPLICATE_VIDEO_SAMPLE_DIM          = int(os.getenv("DUPLICATE_VIDEO_SAMPLE_DIM", "256"))        # длинная сторона серых кадров, которые один ffmpeg отдаёт в пайп, 0 = старый путь с ffmpeg на каждый кадр
 DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS = float(os.getenv("DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS", "0.8"))
 DUPLICATE_VIDEO_MATCH_RATIO         = float(os.getenv("DUPLICATE_VIDEO_MATCH_RATIO", "0.55"))
 DUPLICATE_VIDEO_MATCH_MIN           = int(os.getenv("DUPLICATE_VIDEO_MATCH_MIN", "3"))
@@ -232,6 +263,11 @@ DUPLICATE_VIDEO_META_WEIGHT_SIZE    = float(os.getenv("DUPLICATE_VIDEO_META_WEIG
 DUPLICATE_ALBUM_FRAME_MIN           = int(os.getenv("DUPLICATE_ALBUM_FRAME_MIN", "4"))
 DUPLICATE_ALBUM_FRAME_MAX           = int(os.getenv("DUPLICATE_ALBUM_FRAME_MAX", "16"))
 DUPLICATE_VIDEO_PHOTO_DURATION_MS   = int(os.getenv("DUPLICATE_VIDEO_PHOTO_DURATION_MS", "1200"))
+DUPLICATE_AUDIO_MAX_SECONDS         = int(os.getenv("DUPLICATE_AUDIO_MAX_SECONDS", "180"))      # сколько секунд звука брать в аудио-отпечаток, 0 — без звука
+DUPLICATE_AUDIO_SAMPLE_RATE         = int(os.getenv("DUPLICATE_AUDIO_SAMPLE_RATE", "5512"))
+DUPLICATE_AUDIO_MATCH_BER           = float(os.getenv("DUPLICATE_AUDIO_MATCH_BER", "0.3"))     # доля несовпавших бит, при которой звук считаем тем же
+DUPLICATE_AUDIO_MIN_OVERLAP_SECONDS = float(os.getenv("DUPLICATE_AUDIO_MIN_OVERLAP_SECONDS", "4"))
+DUPLICATE_AUDIO_DURATION_TOLERANCE  = float(os.getenv("DUPLICATE_AUDIO_DURATION_TOLERANCE", "0.05"))
 SYSTEM_USER_TG_ID                   = int(os.getenv("SYSTEM_USER_TG_ID", "0"))
 SYSTEM_USER_NAME                    = os.getenv("SYSTEM_USER_NAME", "channel_import")
 TELETHON_API_ID                     = os.getenv("TELETHON_API_ID")
@@ -526,6 +562,10 @@ class Database:
                 dhash TEXT NOT NULL,
                 phash TEXT,
                 whash TEXT,
+                dhash_i INTEGER,
+                phash_i INTEGER,
+                whash_i INTEGER,
+                content_sha256 TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(post_id) REFERENCES posts(id) ON DELETE CASCADE
             );
@@ -542,6 +582,7 @@ class Database:
                 fps REAL,
                 frame_hashes TEXT NOT NULL,
                 audio_hash TEXT,
+                content_sha256 TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(post_id) REFERENCES posts(id) ON DELETE CASCADE
             );
@@ -584,9 +625,134 @@ class Database:
             await self.db.execute("ALTER TABLE image_fingerprints ADD COLUMN phash TEXT")
         if "whash" not in cols_fp:
             await self.db.execute("ALTER TABLE image_fingerprints ADD COLUMN whash TEXT")
+        for col in ("dhash_i", "phash_i", "whash_i"):
+            if col not in cols_fp:
+                await self.db.execute(f"ALTER TABLE image_fingerprints ADD COLUMN {col} INTEGER")
+        if "content_sha256" not in cols_fp:
+            await self.db.execute("ALTER TABLE image_fingerprints ADD COLUMN content_sha256 TEXT")
+        cols_vfp = {row["name"] for row in await (await self.db.execute("PRAGMA table_info(video_fingerprints)")).fetchall()}
+        if "content_sha256" not in cols_vfp:
+            await self.db.execute("ALTER TABLE video_fingerprints ADD COLUMN content_sha256 TEXT")
+        # индексы по новым колонкам — после миграции, на старой базе их до ALTER ещё нет
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_image_fp_sha256 ON image_fingerprints(content_sha256)")
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_video_fp_sha256 ON video_fingerprints(content_sha256)")
         await self.db.commit()
+        self._hash_migration_task = asyncio.create_task(self._migrate_hash_integers())
+
+    async def _migrate_hash_integers(self, batch_size: int = 500):
+        """Background backfill of INTEGER hash columns, packed frame hashes and binary SIFT rows, batch by batch."""
+        try:
+            last_id = 0
+            images = 0
+            while True:
+                cur = await self.db.execute(
+                    """
+                    SELECT id, dhash, phash, whash
+                    FROM image_fingerprints
+                    WHERE id > ?
+                      AND (dhash_i IS NULL
+                           OR (phash IS NOT NULL AND phash_i IS NULL)
+                           OR (whash IS NOT NULL AND whash_i IS NULL))
+                    ORDER BY id ASC
+                    LIMIT ?
+                    """,
+                    (last_id, int(batch_size)),
+                )
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                last_id = int(rows[-1]["id"])
+                updates = []
+                for row in rows:
+                    values = tuple(_hash_signed_from_hex(row[key]) for key in ("dhash", "phash", "whash"))
+                    if any(v is not None for v in values):
+                        updates.append((*values, int(row["id"])))
+                if updates:
+                    await self.db.executemany(
+                        "UPDATE image_fingerprints SET dhash_i=?, phash_i=?, whash_i=? WHERE id=?",
+                        updates,
+                    )
+                    await self.db.commit()
+                    images += len(updates)
+                await asyncio.sleep(0)
+            last_id = 0
+            videos = 0
+            while True:
+                cur = await self.db.execute(
+                    """
+                    SELECT id, frame_hashes
+                    FROM video_fingerprints
+                    WHERE id > ? AND typeof(frame_hashes) = 'text'
+                    ORDER BY id ASC
+                    LIMIT ?
+                    """,
+                    (last_id, int(batch_size)),
+                )
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                last_id = int(rows[-1]["id"])
+                updates = []
+                for row in rows:
+                    frames = _parse_video_frames(row["frame_hashes"])
+                    stored = _video_frames_for_db(frames)
+                    # кадры, которые нельзя упаковать без потерь, остаются JSON; переписываем их, только если там hex
+                    if isinstance(stored, bytes) or '"d": "' in row["frame_hashes"]:
+                        updates.append((stored, int(row["id"])))
+                if updates:
+                    await self.db.executemany("UPDATE video_fingerprints SET frame_hashes=? WHERE id=?", updates)
+                    await self.db.commit()
+                    videos += len(updates)
+                await asyncio.sleep(0)
+            last_id = 0
+            features = 0
+            while True:
+                # строки кеша SIFT тяжёлые, поэтому пачки меньше
+                cur = await self.db.execute(
+                    """
+                    SELECT id, width, height, keypoints_json, descriptors
+                    FROM image_feature_cache
+                    WHERE id > ? AND keypoints_json != ''
+                    ORDER BY id ASC
+                    LIMIT ?
+                    """,
+                    (last_id, max(1, int(batch_size) // 10)),
+                )
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                last_id = int(rows[-1]["id"])
+                updates = []
+                for row in rows:
+                    serialized = _serialize_sift_features(_deserialize_sift_features(row))
+                    if serialized:
+                        updates.append((serialized[0], serialized[1], int(row["id"])))
+                if updates:
+                    await self.db.executemany(
+                        "UPDATE image_feature_cache SET keypoints_json=?, descriptors=? WHERE id=?",
+                        updates,
+                    )
+                    await self.db.commit()
+                    features += len(updates)
+                await asyncio.sleep(0)
+            if images or videos or features:
+                logger.info(
+                    "Hash integer migration done: %s image rows, %s video rows, %s feature rows",
+                    images,
+                    videos,
+                    features,
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Hash integer migration failed: %s", e)
 
     async def close(self):
+        task = getattr(self, "_hash_migration_task", None)
+        if task and not task.done():
+            task.cancel()
+            with contextlib.suppress(BaseException):
+                await task
         if self.db:
             await self.db.close()
 
@@ -726,6 +892,8 @@ class Database:
                 str(fp["dhash"]),
                 fp.get("phash"),
                 fp.get("whash"),
+                *_fingerprint_hash_ints(fp),
+                fp.get("content_sha256"),
             )
             for fp in fingerprints
         ]
@@ -741,13 +909,18 @@ class Database:
                 height,
                 dhash,
                 phash,
-                whash
+                whash,
+                dhash_i,
+                phash_i,
+                whash_i,
+                content_sha256
             )
-            VALUES (?,?,?,?,?,?,?,?,?,?)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
             """,
             rows,
         )
         await self.db.commit()
+        await image_hash_index.refresh_post(self, post_id)
         if DUPLICATE_GEOMETRY_ENABLED:
             for fp in fingerprints:
                 try:
@@ -829,6 +1002,7 @@ class Database:
             ),
         )
         await self.db.commit()
+        feature_cache.drop((int(post_id), int(item_index), str(algo), int(version)))
 
     async def list_images_by_unique_id(self, file_unique_id: str) -> List[aiosqlite.Row]:
         cur = await self.db.execute(
@@ -843,6 +1017,27 @@ class Database:
         )
         return await cur.fetchall()
 
+    async def list_images_by_sha256(self, content_sha256: str) -> List[aiosqlite.Row]:
+        cur = await self.db.execute(
+            """
+            SELECT f.post_id, f.item_index, f.file_unique_id
+            FROM image_fingerprints f
+            JOIN posts p ON p.id = f.post_id
+            WHERE f.content_sha256=? AND p.status='published'
+            ORDER BY f.id DESC
+            """,
+            (content_sha256,),
+        )
+        return await cur.fetchall()
+
+    async def has_image_fingerprints_without_sha(self, post_id: int) -> bool:
+        # у фото хеши обычно идут с миниатюры, оригинал не качается — байтовый хеш ждём только от документов
+        cur = await self.db.execute(
+            "SELECT 1 FROM image_fingerprints WHERE post_id=? AND content_sha256 IS NULL AND kind='document' LIMIT 1",
+            (int(post_id),),
+        )
+        return await cur.fetchone() is not None
+
     async def has_image_fingerprints(self, post_id: int) -> bool:
         cur = await self.db.execute(
             "SELECT 1 FROM image_fingerprints WHERE post_id=? LIMIT 1",
@@ -864,8 +1059,9 @@ class Database:
                 fp.get("width"),
                 fp.get("height"),
                 fp.get("fps"),
-                json.dumps(fp.get("frames") or []),
+                _video_frames_for_db(fp.get("frames") or []),
                 fp.get("audio_hash"),
+                fp.get("content_sha256"),
             )
             for fp in fingerprints
         ]
@@ -882,13 +1078,15 @@ class Database:
                 height,
                 fps,
                 frame_hashes,
-                audio_hash
+                audio_hash,
+                content_sha256
             )
-            VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
             """,
             rows,
         )
         await self.db.commit()
+        await video_candidate_index.refresh_post(self, post_id)
 
     async def list_videos_by_unique_id(self, file_unique_id: str) -> List[aiosqlite.Row]:
         cur = await self.db.execute(
@@ -911,6 +1109,33 @@ class Database:
         )
         return await cur.fetchone() is not None
 
+    async def list_videos_by_sha256(self, content_sha256: str) -> List[aiosqlite.Row]:
+        cur = await self.db.execute(
+            """
+            SELECT f.post_id, f.item_index, f.file_unique_id
+            FROM video_fingerprints f
+            JOIN posts p ON p.id = f.post_id
+            WHERE f.content_sha256=? AND p.status='published'
+            ORDER BY f.id DESC
+            """,
+            (content_sha256,),
+        )
+        return await cur.fetchall()
+
+    async def has_video_fingerprints_without_sha(self, post_id: int) -> bool:
+        cur = await self.db.execute(
+            "SELECT 1 FROM video_fingerprints WHERE post_id=? AND content_sha256 IS NULL AND kind != 'album' LIMIT 1",
+            (int(post_id),),
+        )
+        return await cur.fetchone() is not None
+
+    async def has_video_fingerprints_without_audio(self, post_id: int) -> bool:
+        cur = await self.db.execute(
+            "SELECT 1 FROM video_fingerprints WHERE post_id=? AND audio_hash IS NULL AND kind != 'album' LIMIT 1",
+            (int(post_id),),
+        )
+        return await cur.fetchone() is not None
+
     async def list_channel_message_ids(self) -> List[int]:
         cur = await self.db.execute(
             "SELECT channel_message_id FROM posts WHERE channel_message_id IS NOT NULL"
@@ -921,8 +1146,7 @@ class Database:
     async def list_video_candidates(self, limit: int) -> List[aiosqlite.Row]:
         cur = await self.db.execute(
             """
-            SELECT f.post_id, f.item_index, f.kind, f.file_unique_id, f.file_size,
-                   f.duration_ms, f.width, f.height, f.fps, f.frame_hashes, f.audio_hash
+            SELECT f.id, f.post_id, f.file_size, f.duration_ms, f.width, f.height, f.fps
             FROM video_fingerprints f
             JOIN posts p ON p.id = f.post_id
             WHERE p.status='published'
@@ -933,6 +1157,43 @@ class Database:
         )
         return await cur.fetchall()
 
+    async def list_video_meta_rows(self, post_id: Optional[int] = None) -> List[aiosqlite.Row]:
+        where = "WHERE p.status='published'"
+        params: List[Any] = []
+        if post_id is not None:
+            where += " AND f.post_id=?"
+            params.append(int(post_id))
+        cur = await self.db.execute(
+            f"""
+            SELECT f.id, f.post_id, f.file_size, f.duration_ms, f.width, f.height, f.fps, f.frame_hashes
+            FROM video_fingerprints f
+            JOIN posts p ON p.id = f.post_id
+            {where}
+            ORDER BY f.id ASC
+            """,
+            params,
+        )
+        return await cur.fetchall()
+
+    async def list_video_fingerprints_by_ids(self, ids: List[int]) -> List[aiosqlite.Row]:
+        rows: List[aiosqlite.Row] = []
+        ids = [int(x) for x in ids]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cur = await self.db.execute(
+                f"""
+                SELECT f.id, f.post_id, f.item_index, f.kind, f.file_unique_id, f.file_size,
+                       f.duration_ms, f.width, f.height, f.fps, f.frame_hashes, f.audio_hash
+                FROM video_fingerprints f
+                JOIN posts p ON p.id = f.post_id
+                WHERE p.status='published' AND f.id IN ({placeholders})
+                """,
+                chunk,
+            )
+            rows.extend(await cur.fetchall())
+        return rows
+
     async def list_image_candidates_by_size(
         self,
         target_size: int,
@@ -942,7 +1203,8 @@ class Database:
     ) -> List[aiosqlite.Row]:
         cur = await self.db.execute(
             """
-            SELECT f.post_id, f.item_index, f.kind, f.file_unique_id, f.file_size, f.dhash, f.phash, f.whash
+            SELECT f.id, f.post_id, f.item_index, f.kind, f.file_unique_id, f.file_size,
+                   f.dhash, f.phash, f.whash, f.dhash_i, f.phash_i, f.whash_i
             FROM image_fingerprints f
             JOIN posts p ON p.id = f.post_id
             WHERE p.status='published' AND f.file_size BETWEEN ? AND ?
@@ -956,7 +1218,8 @@ class Database:
     async def list_published_fingerprints(self, limit: int) -> List[aiosqlite.Row]:
         cur = await self.db.execute(
             """
-            SELECT f.post_id, f.item_index, f.kind, f.file_unique_id, f.file_size, f.width, f.height, f.dhash, f.phash, f.whash
+            SELECT f.id, f.post_id, f.item_index, f.kind, f.file_unique_id, f.file_size, f.width, f.height,
+                   f.dhash, f.phash, f.whash, f.dhash_i, f.phash_i, f.whash_i
             FROM image_fingerprints f
             JOIN posts p ON p.id = f.post_id
             WHERE p.status='published'
@@ -967,6 +1230,25 @@ class Database:
         )
         return await cur.fetchall()
 
+    async def list_image_hash_index_rows(self, post_id: Optional[int] = None) -> List[aiosqlite.Row]:
+        where = "WHERE p.status='published'"
+        params: List[Any] = []
+        if post_id is not None:
+            where += " AND f.post_id=?"
+            params.append(int(post_id))
+        cur = await self.db.execute(
+            f"""
+            SELECT f.id, f.post_id, f.item_index, f.file_size, f.width, f.height,
+                   f.dhash, f.phash, f.whash, f.dhash_i, f.phash_i, f.whash_i
+            FROM image_fingerprints f
+            JOIN posts p ON p.id = f.post_id
+            {where}
+            ORDER BY f.id ASC
+            """,
+            params,
+        )
+        return await cur.fetchall()
+
     async def list_recent_posts_without_fingerprints(self, limit: int) -> List[aiosqlite.Row]:
         cur = await self.db.execute(
             """
@@ -1037,14 +1319,25 @@ class Database:
         await self.db.execute("DELETE FROM image_fingerprints WHERE post_id=?", (post_id,))
         await self.db.execute("DELETE FROM image_feature_cache WHERE post_id=?", (post_id,))
         await self.db.commit()
+        image_hash_index.drop_post(post_id)
+        feature_cache.drop_post(post_id)
 
-    async def delete_image_feature_cache(self, post_id: int):
-        await self.db.execute("DELETE FROM image_feature_cache WHERE post_id=?", (post_id,))
+    async def delete_image_feature_cache(self, post_id: int, algos: Optional[List[str]] = None):
+        if algos:
+            placeholders = ",".join("?" * len(algos))
+            await self.db.execute(
+                f"DELETE FROM image_feature_cache WHERE post_id=? AND algo IN ({placeholders})",
+                (post_id, *algos),
+            )
+        else:
+            await self.db.execute("DELETE FROM image_feature_cache WHERE post_id=?", (post_id,))
         await self.db.commit()
+        feature_cache.drop_post(post_id)
 
     async def delete_video_fingerprints(self, post_id: int):
         await self.db.execute("DELETE FROM video_fingerprints WHERE post_id=?", (post_id,))
         await self.db.commit()
+        video_candidate_index.drop_post(post_id)
 
     async def update_post_admin_messages(self, post_id: int, message_id: int, message_ids: List[int]):
         await self.db.execute(
@@ -1168,6 +1461,8 @@ class Database:
         args.append(post_id)
         await self.db.execute(f"UPDATE posts SET {', '.join(fields)} WHERE id=?", tuple(args))
         await self.db.commit()
+        await image_hash_index.refresh_post(self, post_id)
+        await video_candidate_index.refresh_post(self, post_id)
 
     async def set_notified_status(self, post_id: int, status: str):
         await self.db.execute("UPDATE posts SET notified_status=? WHERE id=?", (status, post_id))
@@ -2077,6 +2372,15 @@ def build_publish_caption(caption_base: str, hashtag: str, *, is_media: bool) ->
             high = mid - 1
     return render(best)
 
+def _hash_photo_size(sizes: List[Any]) -> Any:
+    # PhotoSize идут по возрастанию; для 9x8/32x32 хешей хватает ~320px: расхождение с хешами оригинала
+    # держится в быстрых порогах (tests/test_hash_sources.py), поэтому архив не перехешируем
+    if DUPLICATE_HASH_PHOTO_SIDE > 0:
+        for size in sizes:
+            if max(size.width or 0, size.height or 0) >= DUPLICATE_HASH_PHOTO_SIDE:
+                return size
+    return sizes[-1]
+
 def normalize_message_content(message: Message, album: Optional[List[Message]] = None) -> Optional[DraftContent]:
     if album:
         album = sorted(album, key=lambda msg: msg.message_id)
@@ -2086,12 +2390,15 @@ def normalize_message_content(message: Message, album: Optional[List[Message]] =
             if msg.photo:
                 sizes = msg.photo
                 ph_send = sizes[-1]
-                ph_hash = sizes[0]
+                ph_hash = _hash_photo_size(sizes)
                 items.append(
                     {
                         "type": "photo",
                         "file_id": ph_send.file_id,
                         "hash_file_id": ph_hash.file_id,
+                        "hash_file_unique_id": ph_hash.file_unique_id,
+                        "hash_width": ph_hash.width,
+                        "hash_height": ph_hash.height,
                         "file_unique_id": ph_send.file_unique_id,
                         "file_size": ph_send.file_size,
                         "width": ph_send.width,
@@ -2131,7 +2438,7 @@ def normalize_message_content(message: Message, album: Optional[List[Message]] =
     if message.photo:
         sizes = message.photo
         ph_send = sizes[-1]
-        ph_hash = sizes[0]
+        ph_hash = _hash_photo_size(sizes)
         return DraftContent(
             kind="photo",
             items=[
@@ -2139,6 +2446,9 @@ def normalize_message_content(message: Message, album: Optional[List[Message]] =
                     "type": "photo",
                     "file_id": ph_send.file_id,
                     "hash_file_id": ph_hash.file_id,
+                    "hash_file_unique_id": ph_hash.file_unique_id,
+                    "hash_width": ph_hash.width,
+                    "hash_height": ph_hash.height,
                     "file_unique_id": ph_send.file_unique_id,
                     "file_size": ph_send.file_size,
                     "width": ph_send.width,
@@ -2219,41 +2529,93 @@ def normalize_message_content(message: Message, album: Optional[List[Message]] =
         return DraftContent(kind="text", items=[], caption=message.text)
     return None
 
-def _hash_bits_to_hex(bits: List[int]) -> str:
-    value = 0
-    for b in bits:
-        value = (value << 1) | (1 if b else 0)
-    hex_len = (len(bits) + 3) // 4
-    return f"{value:0{hex_len}x}"
+def _downscale_gray(img: Image.Image, max_dim: int) -> Image.Image:
+    if max_dim > 0:
+        width, height = img.size
+        scale = max(width, height) / max_dim
+        if scale > 1.0:
+            new_w = max(1, int(round(width / scale)))
+            new_h = max(1, int(round(height / scale)))
+            resample = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
+            img = img.resize((new_w, new_h), resample=resample)
+    return img
+
+class DecodedImage:
+    """Картинка, которую все стадии Мнемосины декодируют один раз.
+
+    Серые уровни пирамиды (ключ — длинная сторона, 0 = оригинал) строятся лениво:
+    JPEG сразу декодируется в draft-режиме в 1/2..1/8, остальное — ресайз уже готового уровня.
+    В пул уходит job_view() с одним нужным уровнем (или байтами, если его ещё нет),
+    посчитанный там уровень возвращается тем же видом и подхватывается через adopt().
+    """
+
+    def __init__(self, raw: bytes) -> None:
+        self.raw = raw
+        self.size: Optional[Tuple[int, int]] = None
+        self._levels: Dict[int, Image.Image] = {}
+
+    def gray(self, max_dim: int = 0) -> Image.Image:
+        key = max(0, int(max_dim))
+        level = self._levels.get(key)
+        if level is not None:
+            return level
+        # ближайший готовый уровень покрупнее, иначе декодируем заново
+        source_key = min(
+            (k for k in self._levels if k == 0 or (key and k >= key)),
+            key=lambda k: k or 1 << 30,
+            default=None,
+        )
+        source = self._levels[source_key] if source_key is not None else self._decode(key)
+        level = _downscale_gray(source, key)
+        self._levels[key] = level
+        return level
 
-def _load_image_gray(data: bytes, blur_radius: float) -> Optional[Tuple[Image.Image, int, int]]:
-    try:
-        with Image.open(io.BytesIO(data)) as img:
-            img = ImageOps.exif_transpose(img)
+    def _decode(self, max_dim: int) -> Image.Image:
+        with Image.open(io.BytesIO(self.raw)) as img:
             width, height = img.size
-            gray = img.convert("L")
-            if blur_radius > 0:
-                gray = gray.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            return gray, width, height
-    except (UnidentifiedImageError, OSError, ValueError):
-        return None
-
-def _load_image_gray_pair(
-    data: bytes,
-    blur_radius: float,
-) -> Optional[Tuple[Image.Image, Image.Image, int, int]]:
-    try:
-        with Image.open(io.BytesIO(data)) as img:
+            if max_dim > 0:
+                scale = max(width, height) / max_dim
+                if scale > 1.0:
+                    img.draft("L", (int(math.ceil(width / scale)), int(math.ceil(height / scale))))
+            if self.size is None:
+                # exif-ориентации 5..8 меняют стороны местами
+                self.size = (height, width) if img.getexif().get(0x0112) in (5, 6, 7, 8) else (width, height)
             img = ImageOps.exif_transpose(img)
-            width, height = img.size
-            gray = img.convert("L")
-            if blur_radius > 0:
-                blurred = gray.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            else:
-                blurred = gray
-            return gray, blurred, width, height
-    except (UnidentifiedImageError, OSError, ValueError):
-        return None
+            return img.convert("L")
+
+    def blur_radius(self, radius: float, max_dim: int) -> float:
+        # радиус задан для оригинала, на уменьшенном уровне размываем пропорционально меньше
+        if radius <= 0 or not self.size:
+            return radius
+        level = self.gray(max_dim)
+        return radius * max(level.size) / max(1, max(self.size))
+
+    def job_view(self, max_dim: int, *, with_raw: bool = True) -> "DecodedImage":
+        # пиклится при каждой задаче пула: без лишних уровней, а байты — только если уровень не готов
+        key = max(0, int(max_dim))
+        view = DecodedImage(b"")
+        view.size = self.size
+        level = self._levels.get(key)
+        if level is not None:
+            view._levels[key] = level
+        elif with_raw:
+            view.raw = self.raw
+        return view
+
+    def adopt(self, other: "DecodedImage") -> None:
+        if other is self:
+            return
+        if self.size is None:
+            self.size = other.size
+        for key, level in other._levels.items():
+            self._levels.setdefault(key, level)
+
+def _hash_gray(image: DecodedImage, blur_radius: float) -> Image.Image:
+    gray = image.gray(DUPLICATE_HASH_DECODE_DIM)
+    radius = image.blur_radius(blur_radius, DUPLICATE_HASH_DECODE_DIM)
+    if radius > 0:
+        gray = gray.filter(ImageFilter.GaussianBlur(radius=radius))
+    return gray
 
 _watermark_cache: Dict[str, Any] = {"path": None, "mask": None, "size": None, "missing": False}
 
@@ -2558,7 +2920,7 @@ async def _watermark_input_for_item(item: Dict[str, Any]) -> Optional[BufferedIn
     file_id = item.get("file_id")
     if not file_id:
         return None
-    raw = await _download_image_bytes(file_id)
+    raw = await _download_image_bytes(file_id, unique_id=item.get("file_unique_id"))
     if not raw:
         return None
     try:
@@ -2595,6 +2957,108 @@ def _rotate_gray(img: Image.Image, degrees: float) -> Image.Image:
     except TypeError:
         return img.rotate(degrees, resample=resample, expand=False)
 
+class MnemosyneWorkers:
+    """Пул для CPU-работы Мнемосины (хеши, SIFT/ASIFT, ORB, кадры видео).
+
+    Задачи уходят в отдельные процессы, семафор держит ограниченную очередь:
+    когда пул занят, вызывающий ждёт слот, а event loop продолжает работать.
+    """
+
+    def __init__(self, processes: int, queue_limit: int) -> None:
+        self.processes = max(0, int(processes))
+        self.queue_limit = max(1, int(queue_limit))
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._use_processes = self.processes > 0
+        self.stats: Dict[str, Any] = {
+            "jobs": 0,
+            "waited": 0,
+            "failed": 0,
+            "restarts": 0,
+            "busy": 0,
+            "busy_max": 0,
+        }
+
+    def _get_executor(self) -> Optional[concurrent.futures.Executor]:
+        if not self._use_processes:
+            return None
+        if self._executor is None:
+            try:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            except Exception as e:
+                logger.warning("Mnemosyne process pool unavailable, falling back to threads: %s", e)
+                self._use_processes = False
+                return None
+        return self._executor
+
+    async def run(self, func: Any, *args: Any) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_limit)
+        if self._slots.locked():
+            self.stats["waited"] += 1
+        async with self._slots:
+            self.stats["jobs"] += 1
+            self.stats["busy"] += 1
+            self.stats["busy_max"] = max(self.stats["busy_max"], self.stats["busy"])
+            loop = asyncio.get_running_loop()
+            try:
+                executor = self._get_executor()
+                if executor is None:
+                    return await asyncio.to_thread(func, *args)
+                for attempt in range(2):
+                    try:
+                        return await loop.run_in_executor(executor, functools.partial(func, *args))
+                    except concurrent.futures.BrokenExecutor:
+                        # воркер умер (OOM/сигнал) — пересоздаём пул и повторяем один раз там же;
+                        # в процессе бота такую задачу не запускаем: она может уронить и его
+                        self.stats["failed"] += 1
+                        self._restart(executor)
+                        if attempt:
+                            raise
+                        executor = self._get_executor()
+                        if executor is None:
+                            raise
+            finally:
+                self.stats["busy"] -= 1
+
+    def _restart(self, executor: concurrent.futures.Executor) -> None:
+        if self._executor is not executor:
+            return
+        self.stats["restarts"] += 1
+        logger.warning("Mnemosyne worker pool broke, restarting")
+        self._executor = None
+        with contextlib.suppress(Exception):
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def warm_up(self) -> None:
+        # spawn-процессы импортируют бота несколько секунд, лучше заплатить это на старте
+        executor = self._get_executor()
+        if executor is None:
+            return
+        loop = asyncio.get_running_loop()
+        with contextlib.suppress(Exception):
+            await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(self.processes)))
+
+    def shutdown(self) -> None:
+        executor = self._executor
+        self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def format_stats(self) -> str:
+        s = self.stats
+        mode = f"процессы x{self.processes}" if self._use_processes else "потоки"
+        return (
+            f"Пул: {mode}, очередь {self.queue_limit}\n"
+            f"Задачи: {s['jobs']}, ждали слот: {s['waited']}, сейчас: {s['busy']} (макс {s['busy_max']})\n"
+            f"Сбои пула: {s['failed']}, перезапуски: {s['restarts']}"
+        )
+
+mnemosyne_workers = MnemosyneWorkers(DUPLICATE_WORKER_PROCESSES, DUPLICATE_WORKER_QUEUE_LIMIT)
+
 def _parse_fraction(value: Optional[str]) -> Optional[float]:
     if not value:
         return None
@@ -2616,33 +3080,49 @@ def _parse_fraction(value: Optional[str]) -> Optional[float]:
     except ValueError:
         return None
 
-def _ffprobe_metadata(path: str) -> Optional[Dict[str, Any]]:
-    cmd = [
+def _ffprobe_command(path: str) -> List[str]:
+    return [
         FFPROBE_PATH,
         "-v",
         "error",
-        "-select_streams",
-        "v:0",
         "-show_entries",
-        "stream=width,height,avg_frame_rate,r_frame_rate,duration",
+        "stream=codec_type,width,height,avg_frame_rate,r_frame_rate,duration",
         "-show_entries",
         "format=duration",
         "-of",
         "json",
         path,
     ]
+
+async def _ffprobe_metadata_async(path: str) -> Optional[Dict[str, Any]]:
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=20)
+        proc = await asyncio.create_subprocess_exec(
+            *_ffprobe_command(path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
     except Exception:
         return None
+    try:
+        stdout, _stderr = await asyncio.wait_for(proc.communicate(), timeout=20)
+    except asyncio.TimeoutError:
+        with contextlib.suppress(Exception):
+            proc.kill()
+        with contextlib.suppress(Exception):
+            await proc.wait()
+        return None
     if proc.returncode != 0:
         return None
+    return _parse_ffprobe_output(stdout.decode("utf-8", errors="replace"))
+
+def _parse_ffprobe_output(stdout: Optional[str]) -> Optional[Dict[str, Any]]:
     try:
-        data = json.loads(proc.stdout or "{}")
+        data = json.loads(stdout or "{}")
     except Exception:
         return None
     streams = data.get("streams") or []
-    stream = streams[0] if streams else {}
+    video_streams = [item for item in streams if item.get("codec_type") in {None, "video"}]
+    stream = video_streams[0] if video_streams else {}
     fmt = data.get("format") or {}
     width = stream.get("width")
     height = stream.get("height")
@@ -2657,6 +3137,7 @@ def _ffprobe_metadata(path: str) -> Optional[Dict[str, Any]]:
         "height": int(height) if height is not None else None,
         "fps": float(fps) if fps is not None else None,
         "duration_ms": duration_ms,
+        "has_audio": any(item.get("codec_type") == "audio" for item in streams),
     }
 
 def _ffmpeg_extract_frame_bytes(path: str, ts_seconds: float) -> Optional[bytes]:
@@ -2750,111 +3231,401 @@ def _pick_frame_from_offsets(path: str, target_s: float, duration_s: float) -> O
             best = (gray, ts, mean, std)
     return None
 
-def _collect_video_frames(path: str, duration_ms: Optional[int]) -> List[Dict[str, Any]]:
-    if not duration_ms or duration_ms <= 0:
-        return []
-    count = _video_frame_count(duration_ms)
-    targets = _video_target_timestamps(duration_ms, count)
-    if not targets:
+def _ffmpeg_audio_args(path: str) -> List[str]:
+    return ["-t", str(DUPLICATE_AUDIO_MAX_SECONDS), "-vn", "-sn", "-dn", "-i", path]
+
+def _ffmpeg_audio_output(input_idx: int, destination: str) -> List[str]:
+    return [
+        "-map", f"{input_idx}:a:0", "-ac", "1", "-ar", str(DUPLICATE_AUDIO_SAMPLE_RATE), "-f", "s16le", "-y", destination,
+    ]
+
+def _ffmpeg_audio_pcm(path: str) -> Optional[bytes]:
+    """Mono s16le PCM of the first audio stream; None if there is none or ffmpeg failed."""
+    cmd = [FFMPEG_PATH, "-v", "error", *_ffmpeg_audio_args(path), *_ffmpeg_audio_output(0, "-")]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, timeout=60)
+    except Exception:
+        return None
+    if proc.returncode != 0:
+        return None
+    return proc.stdout
+
+def _ffmpeg_gray_frames(
+    path: str,
+    stamps: List[float],
+    audio_path: Optional[str] = None,
+) -> Optional[List[Optional[Image.Image]]]:
+    """Один ffmpeg на пачку таймкодов: отдельный -ss вход на каждый, по одному маленькому серому кадру в rawvideo-пайп.
+
+    Возвращает кадр (или None, если на таймкоде кадра нет) на каждый таймкод; None — ffmpeg не справился.
+    С audio_path тот же процесс вторым выходом пишет туда PCM звука (звуковая дорожка должна быть).
+    """
+    if not stamps:
         return []
-    duration_s = duration_ms / 1000.0
-    frames: List[Dict[str, Any]] = []
-    for target in targets:
-        picked = _pick_frame_from_offsets(path, target, duration_s)
-        if not picked:
-            continue
-        gray, ts, _mean, _std = picked
-        if DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS > 0:
-            gray = gray.filter(ImageFilter.GaussianBlur(radius=DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS))
-        dhash = _dhash_hex_from_image(gray)
-        phash = _phash_hex_from_image(gray)
-        whash = _whash_hex_from_image(gray)
-        frames.append(
-            {
-                "t": int(ts * 1000),
-                "d": dhash,
-                "p": phash,
-                "w": whash,
-            }
+    dim = DUPLICATE_VIDEO_SAMPLE_DIM
+    cmd = [FFMPEG_PATH, "-hide_banner", "-nostats", "-loglevel", "info"]
+    chains: List[str] = []
+    for idx, ts in enumerate(stamps):
+        cmd += ["-ss", f"{ts:.3f}", "-t", "1", "-an", "-sn", "-dn", "-i", path]
+        chains.append(
+            f"[{idx}:v]trim=end_frame=1,"
+            f"scale=w='min({dim},iw)':h='min({dim},ih)':force_original_aspect_ratio=decrease:flags=area,"
+            f"format=gray,showinfo[f{idx}]"
         )
+    concat = "".join(f"[f{idx}]" for idx in range(len(stamps)))
+    graph = ";".join(chains) + f";{concat}concat=n={len(stamps)}:v=1:a=0[out]"
+    if audio_path:
+        cmd += _ffmpeg_audio_args(path)
+    cmd += ["-filter_complex", graph, "-map", "[out]", "-vsync", "0", "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+    if audio_path:
+        cmd += _ffmpeg_audio_output(len(stamps), audio_path)
+    try:
+        proc = subprocess.run(cmd, capture_output=True, timeout=30 + 2 * len(stamps))
+    except Exception:
+        return None
+    if proc.returncode != 0:
+        return None
+    # в каждой цепочке 4 фильтра, showinfo четвёртый: Parsed_showinfo_{4*idx+3}
+    produced: set[int] = set()
+    size: Optional[Tuple[int, int]] = None
+    for line in proc.stderr.decode("utf-8", errors="replace").splitlines():
+        match = re.search(r"Parsed_showinfo_(\d+) .*\bpts_time:.*\bs:(\d+)x(\d+)", line)
+        if not match:
+            continue
+        filter_idx = int(match.group(1))
+        if filter_idx % 4 != 3:
+            return None
+        produced.add((filter_idx - 3) // 4)
+        size = (int(match.group(2)), int(match.group(3)))
+    frames: List[Optional[Image.Image]] = [None] * len(stamps)
+    if not produced:
+        return frames
+    width, height = size or (0, 0)
+    if width <= 0 or height <= 0 or len(proc.stdout) != len(produced) * width * height:
+        return None
+    pixels = np.frombuffer(proc.stdout, dtype=np.uint8).reshape(len(produced), height, width)
+    # concat отдаёт кадры в порядке входов
+    for pos, idx in enumerate(sorted(produced)):
+        if idx >= len(stamps):
+            return None
+        frames[idx] = Image.fromarray(pixels[pos], mode="L")
     return frames
 
-def _collect_video_frames_with_count(path: str, duration_ms: Optional[int], count: int) -> List[Dict[str, Any]]:
+def _sample_video_frames_piped(
+    path: str,
+    duration_s: float,
+    targets: List[float],
+    audio_path: Optional[str] = None,
+) -> Optional[List[Optional[Tuple[Image.Image, float]]]]:
+    # смещения перебираем раундами: обычно все цели закрывает первый же вызов ffmpeg, он же снимает звук
+    offsets = DUPLICATE_VIDEO_FRAME_SEARCH_OFFSETS or [0.0]
+    picked: List[Optional[Tuple[Image.Image, float]]] = [None] * len(targets)
+    pending = list(range(len(targets)))
+    for round_idx, offset in enumerate(offsets):
+        if not pending:
+            break
+        stamps = [max(0.0, min(duration_s, targets[i] + offset)) for i in pending]
+        grays = _ffmpeg_gray_frames(path, stamps, audio_path if round_idx == 0 else None)
+        if grays is None:
+            return None
+        still: List[int] = []
+        for i, ts, gray in zip(pending, stamps, grays):
+            if gray is None:
+                still.append(i)
+                continue
+            mean, std = _frame_stats(gray)
+            if _is_bad_frame(mean, std):
+                still.append(i)
+                continue
+            picked[i] = (gray, ts)
+        pending = still
+    return picked
+
+def _sample_video_frames_by_seek(
+    path: str,
+    duration_s: float,
+    targets: List[float],
+) -> List[Optional[Tuple[Image.Image, float]]]:
+    picked: List[Optional[Tuple[Image.Image, float]]] = []
+    for target in targets:
+        frame = _pick_frame_from_offsets(path, target, duration_s)
+        picked.append((frame[0], frame[1]) if frame else None)
+    return picked
+
+def _collect_video_frames(
+    path: str,
+    duration_ms: Optional[int],
+    source_size: Optional[Tuple[Optional[int], Optional[int]]] = None,
+    has_audio: Optional[bool] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[bytes]]:
+    """Frame hashes and the packed audio fingerprint of one video file."""
     if not duration_ms or duration_ms <= 0:
-        return []
+        return [], None
+    return _collect_video_frames_with_count(
+        path,
+        duration_ms,
+        _video_frame_count(duration_ms),
+        source_size,
+        with_audio=True,
+        has_audio=has_audio,
+    )
+
+def _collect_video_frames_with_count(
+    path: str,
+    duration_ms: Optional[int],
+    count: int,
+    source_size: Optional[Tuple[Optional[int], Optional[int]]] = None,
+    *,
+    with_audio: bool = False,
+    has_audio: Optional[bool] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[bytes]]:
+    """has_audio — есть ли звуковая дорожка по ffprobe (None — неизвестно); аудио-отпечаток None, только если звук не просили."""
+    if not duration_ms or duration_ms <= 0:
+        return [], None
     if count <= 0:
-        return []
+        return [], None
     targets = _video_target_timestamps(duration_ms, count)
     if not targets:
-        return []
+        return [], None
     duration_s = duration_ms / 1000.0
-    frames: List[Dict[str, Any]] = []
-    for target in targets:
-        picked = _pick_frame_from_offsets(path, target, duration_s)
-        if not picked:
+    # без размеров оригинала не пересчитать радиус размытия, такие видео идут старым путём
+    source_long = max(source_size[0] or 0, source_size[1] or 0) if source_size else 0
+    with_audio = with_audio and DUPLICATE_AUDIO_MAX_SECONDS > 0
+    audio_hash: Optional[bytes] = None
+    if with_audio and has_audio is False:
+        audio_hash = _pack_audio_hash(None)
+    picked = None
+    if DUPLICATE_VIDEO_SAMPLE_DIM > 0 and source_long > 0:
+        audio_path = None
+        if with_audio and has_audio:
+            with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as tmp:
+                audio_path = tmp.name
+        try:
+            picked = _sample_video_frames_piped(path, duration_s, targets, audio_path)
+            if picked is not None and audio_path:
+                with open(audio_path, "rb") as handle:
+                    audio_hash = _pack_audio_hash(_audio_fingerprint(handle.read()))
+        except OSError:
+            pass
+        finally:
+            if audio_path:
+                with contextlib.suppress(OSError):
+                    os.remove(audio_path)
+    if picked is None:
+        picked = _sample_video_frames_by_seek(path, duration_s, targets)
+    if with_audio and audio_hash is None and has_audio is not False:
+        pcm = _ffmpeg_audio_pcm(path)
+        if pcm is not None:
+            audio_hash = _pack_audio_hash(_audio_fingerprint(pcm))
+    if with_audio and audio_hash is None:
+        # звук снять пытались и не смогли (дорожки нет или ffmpeg упал): пустая метка, иначе /backfilldups
+        # пересчитывал бы такое видео при каждом запуске
+        audio_hash = _pack_audio_hash(None)
+    stamps: List[int] = []
+    grays: List[Image.Image] = []
+    for frame in picked:
+        if not frame:
             continue
-        gray, ts, _mean, _std = picked
-        if DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS > 0:
-            gray = gray.filter(ImageFilter.GaussianBlur(radius=DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS))
-        dhash = _dhash_hex_from_image(gray)
-        phash = _phash_hex_from_image(gray)
-        whash = _whash_hex_from_image(gray)
-        frames.append(
-            {
-                "t": int(ts * 1000),
-                "d": dhash,
-                "p": phash,
-                "w": whash,
-            }
-        )
-    return frames
+        gray, ts = frame
+        radius = DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS
+        if source_long > 0:
+            radius *= min(1.0, max(gray.size) / source_long)
+        if radius > 0:
+            gray = gray.filter(ImageFilter.GaussianBlur(radius=radius))
+        stamps.append(int(ts * 1000))
+        grays.append(gray)
+    return [{"t": t, **hashes} for t, hashes in zip(stamps, _frame_hashes_batch(grays))], audio_hash
+
+_AUDIO_FRAME = 2048
+_AUDIO_HOP = 256
+_AUDIO_BANDS = 33
+_AUDIO_HASH_MAGIC = b"AF1\x00"
+
+@functools.lru_cache(maxsize=4)
+def _audio_band_matrix(rate: int) -> np.ndarray:
+    # 33 логарифмические полосы 300–2000 Гц, как у Haitsma–Kalker
+    freqs = np.fft.rfftfreq(_AUDIO_FRAME, 1.0 / rate)
+    edges = np.geomspace(300.0, 2000.0, _AUDIO_BANDS + 1)
+    band = np.searchsorted(edges, freqs, side="right") - 1
+    matrix = np.zeros((freqs.size, _AUDIO_BANDS), dtype=np.float32)
+    inside = np.flatnonzero((band >= 0) & (band < _AUDIO_BANDS))
+    matrix[inside, band[inside]] = 1.0
+    return matrix
+
+def _audio_fingerprint(pcm: bytes) -> np.ndarray:
+    """32-bit sub-fingerprint per hop: signs of band-energy differences across bands and time; empty for silence."""
+    samples = np.frombuffer(pcm[: len(pcm) // 2 * 2], dtype="<i2").astype(np.float32)
+    if samples.size < _AUDIO_FRAME + 2 * _AUDIO_HOP or float(np.sqrt(np.mean(samples * samples))) < 30.0:
+        return np.zeros(0, dtype=np.uint32)
+    windows = np.lib.stride_tricks.sliding_window_view(samples, _AUDIO_FRAME)[::_AUDIO_HOP]
+    spectrum = np.abs(np.fft.rfft(windows * np.hanning(_AUDIO_FRAME).astype(np.float32), axis=1)) ** 2
+    energy = spectrum.astype(np.float32) @ _audio_band_matrix(DUPLICATE_AUDIO_SAMPLE_RATE)
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    return (bits.astype(np.uint64) @ (np.uint64(1) << np.arange(32, dtype=np.uint64))).astype(np.uint32)
+
+def _pack_audio_hash(sub_fingerprints: Optional[np.ndarray]) -> bytes:
+    """audio_hash column value; an empty sequence marks a video that was checked and has no usable sound."""
+    if sub_fingerprints is None:
+        sub_fingerprints = np.zeros(0, dtype=np.uint32)
+    return _AUDIO_HASH_MAGIC + np.asarray(sub_fingerprints, dtype="<u4").tobytes()
+
+def _unpack_audio_hash(raw: Any) -> Optional[np.ndarray]:
+    """Sub-fingerprints from audio_hash; None when the fingerprint was never computed."""
+    if not isinstance(raw, (bytes, bytearray, memoryview)):
+        return None
+    raw = bytes(raw)
+    if not raw.startswith(_AUDIO_HASH_MAGIC) or (len(raw) - len(_AUDIO_HASH_MAGIC)) % 4:
+        return None
+    return np.frombuffer(raw[len(_AUDIO_HASH_MAGIC):], dtype="<u4")
+
+def _audio_sort(a: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(a, kind="stable")
+    return order, a[order]
+
+def _audio_match(
+    a: np.ndarray,
+    b: np.ndarray,
+    min_overlap: int,
+    a_sorted: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Optional[Tuple[float, int, int]]:
+    """Best alignment of two audio fingerprints as (bit error rate, offset of b against a, overlap).
+
+    a_sorted is _audio_sort(a), for callers that match one query against many candidates.
+    """
+    if not a.size or not b.size:
+        return None
+    # смещения-кандидаты: точные совпадения суботпечатков, частые в b значения (тишина, гул) не голосуют;
+    # ищем отсортированные значения b в отсортированном a — так searchsorted в разы быстрее
+    a_order, sorted_a = a_sorted if a_sorted is not None else _audio_sort(a)
+    b_order, sorted_b = _audio_sort(b)
+    lo = np.searchsorted(sorted_a, sorted_b, side="left")
+    hits = np.searchsorted(sorted_a, sorted_b, side="right") - lo
+    offsets = [0]
+    if hits.any():
+        repeats = np.searchsorted(sorted_b, sorted_b, side="right") - np.searchsorted(sorted_b, sorted_b, side="left")
+        hits[repeats > 16] = 0
+    if hits.any():
+        b_pos = np.repeat(b_order, hits)
+        starts = np.repeat(lo - np.cumsum(hits) + hits, hits)
+        a_pos = a_order[starts + np.arange(b_pos.size)]
+        values, votes = np.unique(b_pos - a_pos, return_counts=True)
+        top = np.argsort(-votes, kind="stable")[:3]
+        offsets.extend(int(values[i]) for i in top.tolist() if votes[i] >= 2)
+    best = None
+    for offset in dict.fromkeys(offsets):
+        start = max(0, -offset)
+        end = min(a.size, b.size - offset)
+        overlap = end - start
+        if overlap < max(1, min_overlap):
+            continue
+        errors = int(_popcount64((a[start:end] ^ b[start + offset:end + offset]).astype(np.uint64)).sum())
+        ber = errors / (32.0 * overlap)
+        if best is None or ber < best[0]:
+            best = (ber, offset, overlap)
+    return best
+
+def _video_audio_same_clip(
+    query: Optional[np.ndarray],
+    row_raw: Any,
+    duration_fp: Optional[int],
+    duration_row: Optional[int],
+    query_sorted: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Optional[float]:
+    """BER when both videos carry the same soundtrack over (almost) their whole length, otherwise None."""
+    if query is None or not query.size or not duration_fp or not duration_row:
+        return None
+    if abs(duration_fp - duration_row) > DUPLICATE_AUDIO_DURATION_TOLERANCE * max(duration_fp, duration_row):
+        return None
+    cand = _unpack_audio_hash(row_raw)
+    if cand is None or not cand.size:
+        return None
+    min_overlap = int(math.ceil(DUPLICATE_AUDIO_MIN_OVERLAP_SECONDS * DUPLICATE_AUDIO_SAMPLE_RATE / _AUDIO_HOP))
+    found = _audio_match(query, cand, min_overlap, query_sorted)
+    if found is None:
+        return None
+    ber, _, overlap = found
+    # общий трек на части ролика (модный звук) — не тот же клип
+    if ber > DUPLICATE_AUDIO_MATCH_BER or overlap < 0.8 * min(query.size, cand.size):
+        return None
+    return ber
 
 def _hash_frame_from_image_bytes(raw: bytes) -> Optional[Dict[str, Any]]:
-    img_info = _load_image_gray(raw, DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS)
-    if not img_info:
+    try:
+        gray = _hash_gray(DecodedImage(raw), DUPLICATE_VIDEO_GAUSSIAN_BLUR_RADIUS)
+    except (UnidentifiedImageError, OSError, ValueError):
         return None
-    gray, _w, _h = img_info
     mean, std = _frame_stats(gray)
     if _is_bad_frame(mean, std):
         return None
+    return _frame_hashes_batch([gray])[0]
+
+def _frame_hashes_batch(grays: List[Image.Image]) -> List[Dict[str, Optional[int]]]:
+    return [
+        {"d": _hash_signed(d), "p": _hash_signed(p), "w": _hash_signed(w)}
+        for d, p, w in _perceptual_hashes_batch(grays)
+    ]
+
+def _image_hashes(image: DecodedImage) -> Optional[Dict[str, Any]]:
+    # выполняется в пуле Мнемосины; уровень для хешей возвращаем вместе с ними, чтобы не декодировать его снова
+    try:
+        blur_gray = _hash_gray(image, DUPLICATE_GAUSSIAN_BLUR_RADIUS)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    width, height = image.size or blur_gray.size
+    dhash, phash, whash = _perceptual_hashes_batch(
+        [blur_gray],
+        hash_size=DUPLICATE_IMAGE_HASH_SIZE,
+        highfreq_size=DUPLICATE_PHASH_HIGHFREQ_SIZE,
+        image_size=DUPLICATE_WHASH_IMAGE_SIZE,
+    )[0]
+    bit_count = DUPLICATE_IMAGE_HASH_SIZE * DUPLICATE_IMAGE_HASH_SIZE
     return {
-        "d": _dhash_hex_from_image(gray),
-        "p": _phash_hex_from_image(gray),
-        "w": _whash_hex_from_image(gray),
+        "width": width,
+        "height": height,
+        "dhash": _hash_hex(dhash, bit_count),
+        "phash": _hash_hex(phash, bit_count),
+        "whash": _hash_hex(whash, bit_count),
+        "image": image.job_view(DUPLICATE_HASH_DECODE_DIM, with_raw=False),
     }
 
-def _image_fingerprint_from_bytes(raw: bytes, *, kind: str = "photo") -> Optional[Dict[str, Any]]:
-    img_pair = _load_image_gray_pair(raw, DUPLICATE_GAUSSIAN_BLUR_RADIUS)
-    if not img_pair:
+def _sha256_hex(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+def _sha256_file(path: str) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+async def _image_fingerprint_from_bytes(raw: bytes, *, kind: str = "photo") -> Optional[Dict[str, Any]]:
+    hashed = await mnemosyne_workers.run(_image_hashes, DecodedImage(raw))
+    if not hashed:
         return None
-    _raw_gray, blur_gray, width, height = img_pair
     return {
+        "content_sha256": await asyncio.to_thread(_sha256_hex, raw),
         "item_index": 0,
         "kind": kind,
         "file_unique_id": None,
         "file_size": len(raw),
-        "width": width,
-        "height": height,
-        "dhash": _dhash_hex_from_image(blur_gray, hash_size=DUPLICATE_IMAGE_HASH_SIZE),
-        "phash": _phash_hex_from_image(
-            blur_gray,
-            hash_size=DUPLICATE_IMAGE_HASH_SIZE,
-            highfreq_size=DUPLICATE_PHASH_HIGHFREQ_SIZE,
-        ),
-        "whash": _whash_hex_from_image(
-            blur_gray,
-            hash_size=DUPLICATE_IMAGE_HASH_SIZE,
-            image_size=DUPLICATE_WHASH_IMAGE_SIZE,
-        ),
+        "width": hashed["width"],
+        "height": hashed["height"],
+        "dhash": hashed["dhash"],
+        "phash": hashed["phash"],
+        "whash": hashed["whash"],
     }
 
-def _video_fingerprint_from_path(
+async def _video_fingerprint_from_path(
     path: str,
     *,
     kind: str = "video",
     file_size: Optional[int] = None,
 ) -> Optional[Dict[str, Any]]:
-    meta = _ffprobe_metadata(path) or {}
+    meta = await _ffprobe_metadata_async(path) or {}
     duration_ms = meta.get("duration_ms")
     if duration_ms is None or duration_ms <= 0:
         return None
@@ -2864,10 +3635,13 @@ def _video_fingerprint_from_path(
     if file_size is None:
         with contextlib.suppress(Exception):
             file_size = os.path.getsize(path)
-    frames = _collect_video_frames(path, duration_ms)
+    frames, audio_hash = await mnemosyne_workers.run(
+        _collect_video_frames, path, duration_ms, (width, height), meta.get("has_audio")
+    )
     if not frames:
         return None
     return {
+        "content_sha256": await asyncio.to_thread(_sha256_file, path),
         "item_index": 0,
         "kind": kind,
         "file_unique_id": None,
@@ -2877,24 +3651,224 @@ def _video_fingerprint_from_path(
         "height": height,
         "fps": fps,
         "frames": frames,
-        "audio_hash": None,
+        "audio_hash": audio_hash,
     }
 
-async def _download_to_tempfile(file_id: str, suffix: str = ".mp4") -> Optional[str]:
+def _link_or_copy(src: str, dst: str) -> None:
+    # жёсткая ссылка почти бесплатна; через tmp + replace, чтобы dst никогда не был наполовину записан
+    tmp = f"{dst}.{os.getpid()}.{random.getrandbits(32):08x}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def _write_file_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.{random.getrandbits(32):08x}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class MediaCache:
+    """On-disk cache of files fetched from Telegram, keyed by file_unique_id, LRU-evicted by total size.
+
+    Files live under sha1(key) and are written to a temp name and renamed, so a crash never leaves a partial
+    entry. The LRU order is kept in memory and mirrored into mtimes, so it survives restarts. Consumers get
+    hard links or copies and may delete them freely, but must not modify them in place.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_file_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.bytes = 0
+        self.loaded = False
+        self._items: "OrderedDict[str, int]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def load(self) -> None:
+        """Index existing entries (oldest mtime first) and sweep temp files left by interrupted writes."""
+        entries: List[Tuple[float, str, int]] = []
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".tmp"):
+                        with contextlib.suppress(OSError):
+                            os.remove(entry.path)
+                        continue
+                    with contextlib.suppress(OSError):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, entry.name, int(st.st_size)))
+        entries.sort()
+        self._items = OrderedDict((name, size) for _, name, size in entries)
+        self.bytes = sum(self._items.values())
+        self.loaded = True
+        self._evict()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        if not self.loaded:
+            self.load()
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        if digest not in self._items:
+            self.stats["misses"] += 1
+            return None
+        self._items.move_to_end(digest)
+        self.stats["hits"] += 1
+        path = self._path(digest)
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return path
+
+    def _forget(self, digest: str) -> None:
+        size = self._items.pop(digest, None)
+        if size is not None:
+            self.bytes -= size
+            with contextlib.suppress(OSError):
+                os.remove(self._path(digest))
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._items:
+            self._forget(next(iter(self._items)))
+            self.stats["evicted"] += 1
+
+    async def fetch(self, key: Optional[str], destination: Union[io.BytesIO, str]) -> bool:
+        """Fill destination (buffer or file path) from the cache; False on a miss."""
+        if not key or not self.enabled:
+            return False
+        path = self._lookup(key)
+        if path is None:
+            return False
+        try:
+            if isinstance(destination, str):
+                await asyncio.to_thread(_link_or_copy, path, destination)
+            else:
+                destination.write(await asyncio.to_thread(_read_file_bytes, path))
+                destination.seek(0)
+        except OSError:
+            # запись вытеснили между поиском и чтением
+            self._forget(hashlib.sha1(key.encode("utf-8")).hexdigest())
+            self.stats["hits"] -= 1
+            self.stats["misses"] += 1
+            return False
+        return True
+
+    async def store(self, key: Optional[str], source: Union[bytes, io.BytesIO, str]) -> None:
+        if not key or not self.enabled:
+            return
+        if not self.loaded:
+            self.load()
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        if digest in self._items:
+            return
+        path = self._path(digest)
+        try:
+            if isinstance(source, str):
+                size = os.path.getsize(source)
+                if not size or size > self.max_file_bytes:
+                    return
+                await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+                await asyncio.to_thread(_link_or_copy, source, path)
+            else:
+                data = source.getvalue() if isinstance(source, io.BytesIO) else source
+                size = len(data)
+                if not size or size > self.max_file_bytes:
+                    return
+                await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+                await asyncio.to_thread(_write_file_atomic, path, data)
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.debug("Media cache write failed for %s: %s", key, e)
+            return
+        if digest in self._items:
+            return
+        self._items[digest] = size
+        self.bytes += size
+        self.stats["stored"] += 1
+        self._evict()
+
+    def format_stats(self) -> str:
+        if not self.enabled:
+            return "Кеш медиа выключен (MEDIA_CACHE_MAX_MB=0)."
+        hits = self.stats["hits"]
+        lookups = hits + self.stats["misses"]
+        rate = f"{hits / lookups:.2f}" if lookups else "n/a"
+        return (
+            f"Кеш медиа: {len(self._items)} файлов, {self.bytes / 1048576:.1f}/{self.max_bytes / 1048576:.0f} МБ\n"
+            f"Попаданий {hits}/{lookups} ({rate}), сохранено {self.stats['stored']}, "
+            f"вытеснено {self.stats['evicted']}, ошибок записи {self.stats['errors']}"
+        )
+
+media_cache = MediaCache(
+    MEDIA_CACHE_DIR,
+    int(MEDIA_CACHE_MAX_MB * 1048576),
+    int(MEDIA_CACHE_MAX_FILE_MB * 1048576),
+)
+
+async def _bot_download_cached(
+    file_id: str,
+    destination: Union[io.BytesIO, str],
+    unique_id: Optional[str] = None,
+) -> None:
+    """bot.download through media_cache; raises like bot.download when Telegram fails.
+
+    With a known unique_id a hit costs no Telegram call at all; otherwise the key comes from the getFile
+    call that bot.download would make anyway.
+    """
+    if await media_cache.fetch(unique_id, destination):
+        return
+    file = await bot.get_file(file_id)
+    key = unique_id or file.file_unique_id
+    if key != unique_id and await media_cache.fetch(key, destination):
+        return
+    await bot.download_file(file.file_path, destination=destination)
+    await media_cache.store(key, destination)
+
+def _item_unique_id(item: Dict[str, Any], file_id: Optional[str]) -> Optional[str]:
+    # у фото file_id может указывать на уменьшенную копию для хешей, у неё свой unique id
+    if file_id and file_id == item.get("hash_file_id") and file_id != item.get("file_id"):
+        return item.get("hash_file_unique_id")
+    return item.get("file_unique_id")
+
+async def _download_to_tempfile(
+    file_id: str,
+    suffix: str = ".mp4",
+    unique_id: Optional[str] = None,
+) -> Optional[str]:
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
     path = tmp.name
+    tmp.close()
     try:
-        await bot.download(file_id, destination=tmp)
+        await _bot_download_cached(file_id, path, unique_id)
     except Exception:
-        with contextlib.suppress(Exception):
-            tmp.close()
         with contextlib.suppress(Exception):
             os.remove(path)
         return None
-    tmp.close()
     return path
 
-async def _telethon_download_bytes(client: Any, message: Any) -> Optional[bytes]:
+def _telethon_media_key(message: Any) -> Optional[str]:
+    # у Telethon нет file_unique_id, но id фото/документа так же постоянен для файла
+    photo = getattr(message, "photo", None)
+    if photo is not None and getattr(photo, "id", None):
+        return f"tl-photo-{photo.id}"
+    document = getattr(message, "document", None)
+    if document is not None and getattr(document, "id", None):
+        return f"tl-doc-{document.id}"
+    return None
+
+async def _telethon_download_bytes(client: Any, message: Any) -> Optional[bytes]:
+    key = _telethon_media_key(message)
+    buf = io.BytesIO()
+    if await media_cache.fetch(key, buf):
+        return buf.getvalue()
     try:
         raw = await client.download_media(message, file=bytes)
     except Exception:
@@ -2903,12 +3877,17 @@ async def _telethon_download_bytes(client: Any, message: Any) -> Optional[bytes]
         raw = bytes(raw)
     if not isinstance(raw, (bytes, bytearray)):
         return None
-    return bytes(raw)
+    raw = bytes(raw)
+    await media_cache.store(key, raw)
+    return raw
 
 async def _telethon_download_to_tempfile(client: Any, message: Any, suffix: str = ".mp4") -> Optional[str]:
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
     path = tmp.name
     tmp.close()
+    key = _telethon_media_key(message)
+    if await media_cache.fetch(key, path):
+        return path
     try:
         result = await client.download_media(message, file=path)
     except Exception:
@@ -2919,6 +3898,7 @@ async def _telethon_download_to_tempfile(client: Any, message: Any, suffix: str
         with contextlib.suppress(Exception):
             os.remove(path)
         return None
+    await media_cache.store(key, path)
     return path
 
 
@@ -2927,13 +3907,14 @@ async def _download_image_bytes(
     *,
     attempts: int = 1,
     retry_delay: float = 0.0,
+    unique_id: Optional[str] = None,
 ) -> Optional[bytes]:
     last_error: Optional[Exception] = None
     attempts = max(1, int(attempts))
     for attempt in range(1, attempts + 1):
         buf = io.BytesIO()
         try:
-            await bot.download(file_id, destination=buf)
+            await _bot_download_cached(file_id, buf, unique_id)
             raw = buf.getvalue()
             if raw:
                 return raw
@@ -2945,7 +3926,7 @@ async def _download_image_bytes(
     logger.warning("Failed to download image %s after %s attempt(s): %s", file_id, attempts, last_error)
     return None
 
-async def _download_duplicate_image_bytes(file_id: str) -> Optional[bytes]:
+async def _download_duplicate_image_bytes(file_id: str, unique_id: Optional[str] = None) -> Optional[bytes]:
     try:
         if DUPLICATE_IMAGE_DOWNLOAD_TIMEOUT_SECONDS > 0:
             return await asyncio.wait_for(
@@ -2953,6 +3934,7 @@ async def _download_duplicate_image_bytes(file_id: str) -> Optional[bytes]:
                     file_id,
                     attempts=DUPLICATE_IMAGE_DOWNLOAD_RETRIES,
                     retry_delay=DUPLICATE_IMAGE_DOWNLOAD_RETRY_DELAY_SECONDS,
+                    unique_id=unique_id,
                 ),
                 timeout=DUPLICATE_IMAGE_DOWNLOAD_TIMEOUT_SECONDS,
             )
@@ -2960,15 +3942,20 @@ async def _download_duplicate_image_bytes(file_id: str) -> Optional[bytes]:
             file_id,
             attempts=DUPLICATE_IMAGE_DOWNLOAD_RETRIES,
             retry_delay=DUPLICATE_IMAGE_DOWNLOAD_RETRY_DELAY_SECONDS,
+            unique_id=unique_id,
         )
     except asyncio.TimeoutError:
         logger.warning("Timed out downloading duplicate image %s", file_id)
         return None
 
 
-async def _download_video_frame_image(file_id: str, frame_index: int = 1) -> Optional[Image.Image]:
+async def _download_video_frame_image(
+    file_id: str,
+    frame_index: int = 1,
+    unique_id: Optional[str] = None,
+) -> Optional[Image.Image]:
     """Download video and return selected frame as PIL image (default: 2nd frame)."""
-    path = await _download_to_tempfile(str(file_id), suffix=".mp4")
+    path = await _download_to_tempfile(str(file_id), suffix=".mp4", unique_id=unique_id)
     if not path:
         return None
     try:
@@ -3296,9 +4283,11 @@ async def process_meme_translation(channel_message_id: int, content: DraftConten
             return
         img = None
         if first.get("type") == "video" or content.kind == "video":
-            img = await _download_video_frame_image(first.get("file_id"), frame_index=1)
+            img = await _download_video_frame_image(
+                first.get("file_id"), frame_index=1, unique_id=first.get("file_unique_id")
+            )
         else:
-            raw = await _download_image_bytes(first.get("file_id"))
+            raw = await _download_image_bytes(first.get("file_id"), unique_id=first.get("file_unique_id"))
             if not raw:
                 logger.warning("Failed to download image for translation.")
                 return
@@ -3344,17 +4333,32 @@ async def process_meme_translation(channel_message_id: int, content: DraftConten
         logger.exception("process_meme_translation error: %s", e)
 
 
-def _dhash_hex_from_image(img: Image.Image, *, hash_size: int = 8) -> str:
+def _resized_stack(imgs: List[Image.Image], size: Tuple[int, int], dtype: Any) -> np.ndarray:
     resample = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
-    small = img.resize((hash_size + 1, hash_size), resample=resample).convert("L")
-    pixels = np.asarray(small, dtype=np.uint8)
-    bits = []
-    for row in range(hash_size):
-        for col in range(hash_size):
-            left = pixels[row, col]
-            right = pixels[row, col + 1]
-            bits.append(1 if left > right else 0)
-    return _hash_bits_to_hex(bits)
+    return np.stack([np.asarray(img.resize(size, resample=resample).convert("L"), dtype=dtype) for img in imgs])
+
+def _hash_bits_to_ints(bits: np.ndarray) -> List[int]:
+    # (n, k) бит на кадр -> int, старший бит первый
+    bits = bits.reshape(len(bits), -1)
+    packed = np.packbits(bits, axis=1)
+    pad = packed.shape[1] * 8 - bits.shape[1]
+    if packed.shape[1] == 8:
+        return [int(v) for v in packed.view(">u8")[:, 0] >> np.uint64(pad)]
+    return [int.from_bytes(row.tobytes(), "big") >> pad for row in packed]
+
+def _hash_hex(value: int, bit_count: int) -> str:
+    return f"{value:0{(bit_count + 3) // 4}x}"
+
+def _median_threshold_bits(flat: np.ndarray) -> np.ndarray:
+    # медиана без DC-коэффициента, как в одиночной версии
+    if flat.shape[1] > 1:
+        median = np.median(flat[:, 1:], axis=1, keepdims=True)
+    else:
+        median = flat[:, :1]
+    return flat > median
+
+def _dhash_bits(pixels: np.ndarray) -> np.ndarray:
+    return pixels[:, :, :-1] > pixels[:, :, 1:]
 
 @functools.lru_cache(maxsize=4)
 def _dct_matrix(n: int) -> np.ndarray:
@@ -3368,38 +4372,46 @@ def _dct_matrix(n: int) -> np.ndarray:
             mat[k, i] = ck * math.cos((i + 0.5) * k * factor)
     return mat
 
-def _phash_hex_from_image(img: Image.Image, *, hash_size: int = 8, highfreq_size: int = 32) -> str:
-    resample = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
-    small = img.resize((highfreq_size, highfreq_size), resample=resample)
-    pixels = np.asarray(small, dtype=np.float32)
-    mat = _dct_matrix(highfreq_size)
+def _phash_bits(pixels: np.ndarray, hash_size: int) -> np.ndarray:
+    mat = _dct_matrix(pixels.shape[-1])
     dct = mat @ pixels @ mat.T
-    dct_low = dct[:hash_size, :hash_size]
-    flat = dct_low.flatten()
-    median = np.median(flat[1:]) if flat.size > 1 else flat[0]
-    bits = [1 if v > median else 0 for v in flat]
-    return _hash_bits_to_hex(bits)
+    return _median_threshold_bits(dct[:, :hash_size, :hash_size].reshape(len(pixels), -1))
 
 def _haar_step(arr: np.ndarray) -> np.ndarray:
-    rows, cols = arr.shape
+    rows, cols = arr.shape[-2:]
     temp = np.zeros_like(arr, dtype=np.float32)
-    temp[:, : cols // 2] = (arr[:, 0::2] + arr[:, 1::2]) * 0.5
-    temp[:, cols // 2 :] = (arr[:, 0::2] - arr[:, 1::2]) * 0.5
+    temp[..., : cols // 2] = (arr[..., 0::2] + arr[..., 1::2]) * 0.5
+    temp[..., cols // 2 :] = (arr[..., 0::2] - arr[..., 1::2]) * 0.5
     out = np.zeros_like(arr, dtype=np.float32)
-    out[: rows // 2, :] = (temp[0::2, :] + temp[1::2, :]) * 0.5
-    out[rows // 2 :, :] = (temp[0::2, :] - temp[1::2, :]) * 0.5
+    out[..., : rows // 2, :] = (temp[..., 0::2, :] + temp[..., 1::2, :]) * 0.5
+    out[..., rows // 2 :, :] = (temp[..., 0::2, :] - temp[..., 1::2, :]) * 0.5
     return out
 
-def _whash_hex_from_image(img: Image.Image, *, hash_size: int = 8, image_size: int = 32) -> str:
-    resample = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
-    small = img.resize((image_size, image_size), resample=resample)
-    pixels = np.asarray(small, dtype=np.float32)
+def _whash_bits(pixels: np.ndarray, hash_size: int) -> np.ndarray:
     coeffs = _haar_step(_haar_step(pixels))
-    low = coeffs[:hash_size, :hash_size]
-    flat = low.flatten()
-    median = np.median(flat[1:]) if flat.size > 1 else flat[0]
-    bits = [1 if v > median else 0 for v in flat]
-    return _hash_bits_to_hex(bits)
+    return _median_threshold_bits(coeffs[:, :hash_size, :hash_size].reshape(len(pixels), -1))
+
+def _perceptual_hashes_batch(
+    imgs: List[Image.Image],
+    *,
+    hash_size: int = 8,
+    highfreq_size: int = 32,
+    image_size: int = 32,
+) -> List[Tuple[int, int, int]]:
+    """dhash/phash/whash для пачки серых кадров: (d, p, w) на кадр, биты идут старшим вперёд."""
+    if not imgs:
+        return []
+    d_pixels = _resized_stack(imgs, (hash_size + 1, hash_size), np.uint8)
+    p_pixels = _resized_stack(imgs, (highfreq_size, highfreq_size), np.float32)
+    # при одинаковых размерах phash и whash берут один и тот же ресайз
+    w_pixels = p_pixels if image_size == highfreq_size else _resized_stack(imgs, (image_size, image_size), np.float32)
+    return list(
+        zip(
+            _hash_bits_to_ints(_dhash_bits(d_pixels)),
+            _hash_bits_to_ints(_phash_bits(p_pixels, hash_size)),
+            _hash_bits_to_ints(_whash_bits(w_pixels, hash_size)),
+        )
+    )
 
 def _hash_int(value: Optional[str]) -> Optional[int]:
     if value is None:
@@ -3409,6 +4421,64 @@ def _hash_int(value: Optional[str]) -> Optional[int]:
     except Exception:
         return None
 
+_HASH64_MASK = (1 << 64) - 1
+
+def _hash_signed_from_hex(value: Optional[str]) -> Optional[int]:
+    """64-bit hex hash as a signed SQLite INTEGER; None for any other width."""
+    if not value:
+        return None
+    raw = str(value).strip()
+    if len(raw) != 16:
+        return None
+    parsed = _hash_int(raw)
+    if parsed is None:
+        return None
+    return _hash_signed(parsed)
+
+def _hash_signed(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _hash_hex_from_signed(value: Optional[int]) -> Optional[str]:
+    if value is None:
+        return None
+    return f"{int(value) & _HASH64_MASK:016x}"
+
+def _distance64(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None or b is None:
+        return None
+    return ((int(a) ^ int(b)) & _HASH64_MASK).bit_count()
+
+def _frame_hash_int(value: Any) -> Optional[int]:
+    # кадры видео хранятся как signed int, старые строки ещё могут быть hex
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    return _hash_int(str(value))
+
+def _row_value(row: Any, key: str) -> Any:
+    try:
+        return row[key]
+    except (IndexError, KeyError):
+        return None
+
+def _fingerprint_hash_ints(fp: Dict[str, Any]) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    cached = fp.get("hash_ints")
+    if cached is None:
+        cached = tuple(_hash_signed_from_hex(fp.get(key)) for key in ("dhash", "phash", "whash"))
+        fp["hash_ints"] = cached
+    return cached
+
+def _row_hash_distances(fp: Dict[str, Any], row: Any) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    out = []
+    for key, fp_int in zip(("dhash", "phash", "whash"), _fingerprint_hash_ints(fp)):
+        row_int = _row_value(row, f"{key}_i")
+        if fp_int is not None and row_int is not None:
+            out.append(_distance64(fp_int, row_int))
+        else:
+            out.append(_hash_distance_hex(fp.get(key), row[key]))
+    return out[0], out[1], out[2]
+
 def _hash_distance_hex(a: Optional[str], b: Optional[str]) -> Optional[int]:
     if not a or not b:
         return None
@@ -3422,9 +4492,7 @@ def _hash_distance_details(
     fp: Dict[str, Any],
     row: aiosqlite.Row,
 ) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[str], Optional[int]]:
-    dist_d = _hash_distance_hex(fp.get("dhash"), row["dhash"])
-    dist_p = _hash_distance_hex(fp.get("phash"), row["phash"])
-    dist_w = _hash_distance_hex(fp.get("whash"), row["whash"])
+    dist_d, dist_p, dist_w = _row_hash_distances(fp, row)
     details_parts = []
     if dist_d is not None:
         details_parts.append(f"d={dist_d}")
@@ -3459,16 +4527,7 @@ def _size_similarity_score(fp: Dict[str, Any], row: aiosqlite.Row) -> Optional[f
     return aspect_diff + area_diff * DUPLICATE_ORB_SIZE_AREA_WEIGHT
 
 def _prepare_orb_image(img: Image.Image) -> np.ndarray:
-    max_dim = DUPLICATE_ORB_MAX_DIM
-    if max_dim > 0:
-        width, height = img.size
-        scale = max(width, height) / max_dim if max_dim else 1.0
-        if scale > 1.0:
-            new_w = max(1, int(round(width / scale)))
-            new_h = max(1, int(round(height / scale)))
-            resample = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
-            img = img.resize((new_w, new_h), resample=resample)
-    return np.asarray(img, dtype=np.uint8)
+    return np.asarray(_downscale_gray(img, DUPLICATE_ORB_MAX_DIM), dtype=np.uint8)
 
 def _orb_features_from_gray(img: Image.Image) -> Optional[Tuple[List[Any], np.ndarray]]:
     if DUPLICATE_ORB_MAX_FEATURES <= 0:
@@ -3485,6 +4544,23 @@ def _orb_features_from_gray(img: Image.Image) -> Optional[Tuple[List[Any], np.nd
         return None
     return kps, desc
 
+def _keypoint_points(kps: Any) -> np.ndarray:
+    # из пула точки приходят уже массивом (n, 2), локально — списком cv2.KeyPoint
+    if isinstance(kps, np.ndarray):
+        return kps
+    return np.float32([kp.pt for kp in kps]).reshape(-1, 2)
+
+def _orb_features_job(image: DecodedImage) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    try:
+        gray = image.gray(DUPLICATE_ORB_MAX_DIM)
+        features = _orb_features_from_gray(gray)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    if not features:
+        return None
+    kps, desc = features
+    return _keypoint_points(kps), desc, _downscale_gray(gray, DUPLICATE_ORB_MAX_DIM).size
+
 def _orb_features_variants(img: Image.Image) -> List[Tuple[List[Any], np.ndarray]]:
     variants: List[Tuple[List[Any], np.ndarray]] = []
     rotations = DUPLICATE_ORB_ROTATION_DEGREES or [0.0]
@@ -3507,13 +4583,21 @@ def _orb_features_variants(img: Image.Image) -> List[Tuple[List[Any], np.ndarray
                     return variants
     return variants
 
+def _orb_variants_job(image: DecodedImage) -> List[Tuple[np.ndarray, np.ndarray]]:
+    try:
+        gray = image.gray(DUPLICATE_ORB_MAX_DIM)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return []
+    # cv2.KeyPoint не пиклится, из пула возвращаем точки массивом
+    return [(_keypoint_points(kps), desc) for kps, desc in _orb_features_variants(gray)]
+
 def _orb_match_metrics(
     kps_a: Optional[List[Any]],
     desc_a: Optional[np.ndarray],
     kps_b: Optional[List[Any]],
     desc_b: Optional[np.ndarray],
 ) -> Optional[Tuple[int, float, int, float]]:
-    if desc_a is None or desc_b is None or not kps_a or not kps_b:
+    if desc_a is None or desc_b is None or kps_a is None or kps_b is None or not len(kps_a) or not len(kps_b):
         return None
     try:
         matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
@@ -3538,28 +4622,19 @@ def _orb_match_metrics(
     inlier_ratio = 0.0
     if DUPLICATE_ORB_RANSAC_MIN_INLIERS > 0 and good >= 4:
         try:
-            src_pts = np.float32([kps_a[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-            dst_pts = np.float32([kps_b[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+            src_pts = _keypoint_points(kps_a)[np.fromiter((m.queryIdx for m in good_matches), dtype=np.intp)].reshape(-1, 1, 2)
+            dst_pts = _keypoint_points(kps_b)[np.fromiter((m.trainIdx for m in good_matches), dtype=np.intp)].reshape(-1, 1, 2)
             _h, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, DUPLICATE_ORB_RANSAC_REPROJ)
             if mask is not None:
                 inliers = int(mask.sum())
                 inlier_ratio = inliers / max(1, good)
         except Exception:
             inliers = 0
-        inlier_ratio = 0.0
+            inlier_ratio = 0.0
     return good, good_ratio, inliers, inlier_ratio
 
 def _prepare_sift_array(img: Image.Image) -> np.ndarray:
-    max_dim = DUPLICATE_SIFT_MAX_DIM
-    if max_dim > 0:
-        width, height = img.size
-        scale = max(width, height) / max_dim if max_dim else 1.0
-        if scale > 1.0:
-            new_w = max(1, int(round(width / scale)))
-            new_h = max(1, int(round(height / scale)))
-            resample = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
-            img = img.resize((new_w, new_h), resample=resample)
-    return np.asarray(img, dtype=np.uint8)
+    return np.asarray(_downscale_gray(img, DUPLICATE_SIFT_MAX_DIM), dtype=np.uint8)
 
 def _rootsift(desc: Optional[np.ndarray]) -> Optional[np.ndarray]:
     if desc is None or len(desc) == 0:
@@ -3599,8 +4674,8 @@ def _sift_features_from_array(
         kps, desc = sift.detectAndCompute(arr, None)
     except Exception:
         return None
-    desc = _rootsift(desc)
-    if desc is None or not kps:
+    # RootSIFT считается при матчинге: сырые дескрипторы целые 0..255 и без потерь ложатся в uint8
+    if desc is None or len(desc) == 0 or not kps:
         return None
     return list(kps), desc
 
@@ -3684,63 +4759,204 @@ def _cap_feature_count(
     order = np.argsort(np.asarray([float(getattr(kp, "response", 0.0)) for kp in kps], dtype=np.float32))[::-1][:max_count]
     return [kps[int(i)] for i in order], desc[order]
 
+_SIFT_FEATURES_MAGIC = b"SF1\x00"
+_SIFT_DESCRIPTOR_SIZE = 128
+_ORB_FEATURES_MAGIC = b"OF1\x00"
+_ORB_DESCRIPTOR_SIZE = 32
+
+def _pack_point_features(magic: bytes, points: np.ndarray, desc: np.ndarray) -> bytes:
+    # magic, uint32 LE число точек, float32 (x, y) пары, затем uint8 дескрипторы
+    return b"".join(
+        (
+            magic,
+            np.uint32(len(points)).astype("<u4").tobytes(),
+            np.ascontiguousarray(points, dtype="<f4").tobytes(),
+            np.ascontiguousarray(desc, dtype=np.uint8).tobytes(),
+        )
+    )
+
+def _point_features_count(blob: bytes) -> int:
+    if len(blob) < 8 or blob[:4] not in (_SIFT_FEATURES_MAGIC, _ORB_FEATURES_MAGIC):
+        return 0
+    return int(np.frombuffer(blob, dtype="<u4", count=1, offset=4)[0])
+
+def _unpack_point_features(blob: bytes, desc_size: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Read-only views (points (n, 2), descriptors (n, desc_size)) over a packed blob."""
+    count = _point_features_count(blob)
+    offset = 8
+    if count <= 0 or len(blob) != offset + count * (8 + desc_size):
+        return None
+    points = np.frombuffer(blob, dtype="<f4", count=count * 2, offset=offset).reshape(count, 2)
+    desc = np.frombuffer(blob, dtype=np.uint8, offset=offset + count * 8).reshape(count, desc_size)
+    return points, desc
+
+def _sift_descriptors_u8(desc: np.ndarray) -> np.ndarray:
+    if desc.dtype == np.uint8:
+        return desc
+    return np.clip(np.rint(desc), 0, 255).astype(np.uint8)
+
+def _sift_descriptors_from_rootsift(desc: np.ndarray) -> np.ndarray:
+    # старый кеш хранил RootSIFT; сырой SIFT нормирован OpenCV к L2 = 512, так что квадраты восстанавливают его точно
+    squared = desc.astype(np.float64) ** 2
+    norms = np.linalg.norm(squared, axis=1, keepdims=True)
+    return _sift_descriptors_u8(squared / np.maximum(norms, 1e-12) * 512.0)
+
 def _serialize_sift_features(
-    features: Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]],
+    features: Optional[Tuple[Any, np.ndarray, Tuple[int, int]]],
 ) -> Optional[Tuple[str, bytes, int, int]]:
+    """Cache row as (keypoints_json, descriptors, width, height).
+
+    Descriptors hold a versioned binary layout: magic, little-endian uint32 point count, float32 (x, y)
+    pairs, then uint8 SIFT descriptors; keypoints_json stays empty (it only carries legacy rows).
+    """
     if not features:
         return None
     kps, desc, size = features
-    if desc is None or len(desc) == 0 or not kps:
+    if desc is None or len(desc) == 0 or kps is None or not len(kps):
+        return None
+    points = _keypoint_points(kps)
+    if len(points) != len(desc) or desc.shape[1] != _SIFT_DESCRIPTOR_SIZE:
         return None
     width, height = size
-    keypoints = [
-        [
-            float(kp.pt[0]),
-            float(kp.pt[1]),
-            float(kp.size),
-            float(kp.angle),
-            float(kp.response),
-            int(kp.octave),
-            int(kp.class_id),
-        ]
-        for kp in kps
-    ]
-    buf = io.BytesIO()
-    np.save(buf, desc.astype(np.float32, copy=False), allow_pickle=False)
-    return json.dumps(keypoints), buf.getvalue(), int(width), int(height)
+    return "", _pack_point_features(_SIFT_FEATURES_MAGIC, points, _sift_descriptors_u8(desc)), int(width), int(height)
 
 def _deserialize_sift_features(
-    row: Optional[aiosqlite.Row],
-) -> Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]]:
+    row: Optional[Any],
+) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    """(points float32 (n, 2), descriptors uint8 (n, 128), (width, height)) from a cache row.
+
+    Binary rows are read with np.frombuffer, so the arrays are read-only views of the row's blob.
+    """
     if not row:
         return None
     try:
+        raw = bytes(row["descriptors"])
+        size = (int(row["width"]), int(row["height"]))
+        if raw.startswith(_SIFT_FEATURES_MAGIC):
+            unpacked = _unpack_point_features(raw, _SIFT_DESCRIPTOR_SIZE)
+            return (*unpacked, size) if unpacked else None
         raw_kps = json.loads(row["keypoints_json"] or "[]")
-        desc = np.load(io.BytesIO(bytes(row["descriptors"])), allow_pickle=False)
+        desc = np.load(io.BytesIO(raw), allow_pickle=False)
         if desc is None or len(desc) == 0 or not isinstance(raw_kps, list):
             return None
-        kps: List[Any] = []
-        for raw in raw_kps:
-            if not isinstance(raw, list) or len(raw) < 7:
-                continue
-            kps.append(
-                cv2.KeyPoint(
-                    float(raw[0]),
-                    float(raw[1]),
-                    float(raw[2]),
-                    float(raw[3]),
-                    float(raw[4]),
-                    int(raw[5]),
-                    int(raw[6]),
-                )
-            )
-        if not kps or len(kps) != len(desc):
+        rows_ok = [item[:2] for item in raw_kps if isinstance(item, list) and len(item) >= 7]
+        if not rows_ok or len(rows_ok) != len(desc):
             return None
-        return kps, desc.astype(np.float32, copy=False), (int(row["width"]), int(row["height"]))
+        points = np.asarray(rows_ok, dtype=np.float32).reshape(-1, 2)
+        return points, _sift_descriptors_from_rootsift(desc), size
     except Exception:
         return None
 
-async def _save_sift_feature_cache_for_post(
+def _serialize_orb_features(
+    features: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]],
+) -> Optional[Tuple[str, bytes, int, int]]:
+    """ORB cache row in the same layout as SIFT, with 32-byte binary descriptors."""
+    if not features:
+        return None
+    points, desc, (width, height) = features
+    if desc is None or not len(desc) or len(points) != len(desc) or desc.shape[1] != _ORB_DESCRIPTOR_SIZE:
+        return None
+    return "", _pack_point_features(_ORB_FEATURES_MAGIC, points, desc), int(width), int(height)
+
+def _deserialize_orb_features(row: Optional[Any]) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    if not row:
+        return None
+    try:
+        raw = bytes(row["descriptors"])
+        if not raw.startswith(_ORB_FEATURES_MAGIC):
+            return None
+        unpacked = _unpack_point_features(raw, _ORB_DESCRIPTOR_SIZE)
+        return (*unpacked, (int(row["width"]), int(row["height"]))) if unpacked else None
+    except Exception:
+        return None
+
+def _feature_cache_version(algo: str) -> int:
+    return DUPLICATE_ORB_FEATURE_VERSION if algo == "orb" else DUPLICATE_SIFT_FEATURE_VERSION
+
+class FeatureCache:
+    """Deserialized SIFT/ASIFT/ORB features of archive posts, LRU bounded by array bytes and shared by all checks.
+
+    Keys are (post_id, item_index, algo, version); the DB methods that rewrite or delete cache rows drop them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items: "OrderedDict[Tuple[int, int, str, int], Tuple[Tuple[np.ndarray, np.ndarray, Tuple[int, int]], int]]" = (
+            OrderedDict()
+        )
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def get(self, key: Tuple[int, int, str, int]) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+        cached = self._items.get(key)
+        if cached is None:
+            self.stats["misses"] += 1
+            return None
+        self._items.move_to_end(key)
+        self.stats["hits"] += 1
+        return cached[0]
+
+    def put(self, key: Tuple[int, int, str, int], features: Tuple[np.ndarray, np.ndarray, Tuple[int, int]]) -> None:
+        size = int(features[0].nbytes + features[1].nbytes)
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return
+        self.drop(key)
+        self._items[key] = (features, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self.bytes -= evicted
+            self.stats["evicted"] += 1
+
+    def drop(self, key: Tuple[int, int, str, int]) -> None:
+        cached = self._items.pop(key, None)
+        if cached is not None:
+            self.bytes -= cached[1]
+
+    def drop_post(self, post_id: int) -> None:
+        for key in [key for key in self._items if key[0] == int(post_id)]:
+            self.drop(key)
+
+    def format_stats(self) -> str:
+        hits = self.stats["hits"]
+        lookups = hits + self.stats["misses"]
+        rate = f"{hits / lookups:.2f}" if lookups else "n/a"
+        return (
+            f"SIFT/ASIFT/ORB в памяти: {len(self._items)} шт., {self.bytes / 1048576:.1f}/{self.max_bytes / 1048576:.0f} МБ, "
+            f"попаданий {hits}/{lookups} ({rate}), вытеснено {self.stats['evicted']}"
+        )
+
+feature_cache = FeatureCache(int(DUPLICATE_FEATURE_CACHE_MB * 1048576))
+
+def _sift_features_job(
+    image: DecodedImage,
+    asift: bool,
+) -> Tuple[Optional[Tuple[str, bytes, int, int]], DecodedImage]:
+    # из процесса возвращаем тот же вид, что лежит в кеше БД: один компактный blob
+    try:
+        gray = image.gray(DUPLICATE_SIFT_MAX_DIM)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None, image.job_view(DUPLICATE_SIFT_MAX_DIM, with_raw=False)
+    features = _asift_features_from_gray(gray) if asift else _sift_features_from_gray(gray)
+    return _serialize_sift_features(features), image.job_view(DUPLICATE_SIFT_MAX_DIM, with_raw=False)
+
+async def _extract_sift_features(
+    image: DecodedImage,
+    *,
+    asift: bool = False,
+) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    serialized, worked = await mnemosyne_workers.run(
+        _sift_features_job, image.job_view(DUPLICATE_SIFT_MAX_DIM), asift
+    )
+    image.adopt(worked)
+    if not serialized:
+        return None
+    keypoints_json, descriptors, width, height = serialized
+    return _deserialize_sift_features(
+        {"keypoints_json": keypoints_json, "descriptors": descriptors, "width": width, "height": height}
+    )
+
+async def _save_feature_cache_for_post(
     post_id: int,
     fingerprints: List[Dict[str, Any]],
 ) -> None:
@@ -3876,15 +5092,17 @@ def _geometry_passes(metrics: Dict[str, Any]) -> bool:
     return True
 
 def _sift_match_metrics(
-    features_a: Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]],
-    features_b: Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]],
+    features_a: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]],
+    features_b: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]],
 ) -> Optional[Dict[str, Any]]:
     if not features_a or not features_b:
         return None
-    kps_a, desc_a, size_a = features_a
-    kps_b, desc_b, size_b = features_b
+    points_a, desc_a, size_a = features_a
+    points_b, desc_b, size_b = features_b
     if desc_a is None or desc_b is None or len(desc_a) < 2 or len(desc_b) < 2:
         return None
+    desc_a = _rootsift(desc_a)
+    desc_b = _rootsift(desc_b)
     try:
         matcher = cv2.BFMatcher(cv2.NORM_L2)
         pairs = matcher.knnMatch(desc_a, desc_b, k=2)
@@ -3911,12 +5129,30 @@ def _sift_match_metrics(
             good_matches = [m for m in good_matches if reverse_best.get(int(m.trainIdx)) == int(m.queryIdx)]
         except Exception:
             pass
-    if len(good_matches) < max(4, DUPLICATE_SIFT_MIN_GOOD):
+    return _sift_geometry_metrics(
+        points_a,
+        points_b,
+        np.fromiter((m.queryIdx for m in good_matches), dtype=np.intp),
+        np.fromiter((m.trainIdx for m in good_matches), dtype=np.intp),
+        size_a,
+        size_b,
+    )
+
+def _sift_geometry_metrics(
+    points_a: np.ndarray,
+    points_b: np.ndarray,
+    query_idx: np.ndarray,
+    train_idx: np.ndarray,
+    size_a: Tuple[int, int],
+    size_b: Tuple[int, int],
+) -> Optional[Dict[str, Any]]:
+    """RANSAC over already filtered descriptor matches; None unless the model passes the geometry thresholds."""
+    if len(query_idx) < max(4, DUPLICATE_SIFT_MIN_GOOD):
         return None
-    src = np.float32([kps_a[m.queryIdx].pt for m in good_matches])
-    dst = np.float32([kps_b[m.trainIdx].pt for m in good_matches])
+    src = points_a[query_idx]
+    dst = points_b[train_idx]
     best: Optional[Dict[str, Any]] = None
-    if len(good_matches) >= 4:
+    if len(query_idx) >= 4:
         method = getattr(cv2, "USAC_MAGSAC", cv2.RANSAC)
         try:
             h, mask = cv2.findHomography(
@@ -3936,7 +5172,7 @@ def _sift_match_metrics(
                 best = _geometry_metrics_from_model(src, dst, mask, projected, model="h", size_a=size_a, size_b=size_b)
             except Exception:
                 best = None
-    if len(good_matches) >= 3:
+    if len(query_idx) >= 3:
         try:
             affine, mask_aff = cv2.estimateAffinePartial2D(
                 src,
@@ -3967,6 +5203,119 @@ def _sift_match_metrics(
         return None
     return best
 
+def _sift_knn_stacked(query: np.ndarray, train: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """k nearest train rows for every query row as (indices, L2 distances); missing neighbours are -1/inf."""
+    if DUPLICATE_SIFT_FLANN_CHECKS > 0:
+        index = cv2.flann_Index(train, {"algorithm": 1, "trees": 4})
+        idx, dist = index.knnSearch(query, k, params={"checks": int(DUPLICATE_SIFT_FLANN_CHECKS)})
+        idx = idx.astype(np.intp)
+        dist = np.where(idx >= 0, np.sqrt(np.maximum(dist, 0.0)), np.inf).astype(np.float32)
+        return idx, dist
+    idx = np.full((len(query), k), -1, dtype=np.intp)
+    dist = np.full((len(query), k), np.inf, dtype=np.float32)
+    for row, pair in enumerate(cv2.BFMatcher(cv2.NORM_L2).knnMatch(query, train, k=k)):
+        for col, m in enumerate(pair):
+            idx[row, col] = m.trainIdx
+            dist[row, col] = m.distance
+    return idx, dist
+
+def _sift_metrics_key(metrics: Dict[str, Any]) -> Tuple[int, float, float, float]:
+    return (
+        int(metrics["inliers"]),
+        float(metrics["inlier_ratio"]),
+        max(float(metrics["coverage_a"]), float(metrics["coverage_b"])),
+        -float(metrics["rmse"]),
+    )
+
+def _batched_sift_metrics(
+    query_features: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]],
+    candidates: List[List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]],
+) -> List[Optional[Dict[str, Any]]]:
+    """Best geometry metrics per candidate post, matching the query once against all their features stacked.
+
+    One KD-tree over every candidate descriptor replaces a BFMatcher per feature set. Each query
+    descriptor takes k = 2 * sets neighbours, which are split by feature set; the ratio test uses the
+    set's own second neighbour, or the farthest returned one when the set has only one among them (a
+    lower bound for its second). The mutual check matches only the surviving train descriptors back.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(candidates)
+    if not query_features:
+        return results
+    points_a, desc_a, size_a = query_features
+    if desc_a is None or len(desc_a) < 2:
+        return results
+    sets = [
+        (cand_idx, features)
+        for cand_idx, cand_features in enumerate(candidates)
+        for features in cand_features
+        if features and features[1] is not None and len(features[1]) >= 2
+    ]
+    if not sets:
+        return results
+    query = _rootsift(desc_a)
+    train = _rootsift(np.vstack([features[1] for _, features in sets]))
+    offsets = np.cumsum([0] + [len(features[1]) for _, features in sets])
+    k = min(len(train), 2 * len(sets))
+    try:
+        idx, dist = _sift_knn_stacked(query, train, k)
+    except Exception:
+        return results
+
+    # соседи каждого дескриптора запроса по наборам: (запрос, набор, ранг)
+    q_flat = np.repeat(np.arange(len(query)), k)
+    t_flat = idx.ravel()
+    d_flat = dist.ravel()
+    valid = t_flat >= 0
+    q_flat, t_flat, d_flat = q_flat[valid], t_flat[valid], d_flat[valid]
+    if not len(t_flat):
+        return results
+    set_flat = np.searchsorted(offsets, t_flat, side="right") - 1
+    order = np.lexsort((d_flat, set_flat, q_flat))
+    q_flat, t_flat, d_flat, set_flat = q_flat[order], t_flat[order], d_flat[order], set_flat[order]
+    group = q_flat * len(sets) + set_flat
+    first = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    has_second = (first + 1 < len(group)) & (group[np.minimum(first + 1, len(group) - 1)] == group[first])
+    farthest = np.where(np.isfinite(dist), dist, -np.inf).max(axis=1)
+    second_dist = np.where(has_second, d_flat[np.minimum(first + 1, len(d_flat) - 1)], farthest[q_flat[first]])
+    passed = first[d_flat[first] < float(DUPLICATE_SIFT_RATIO) * second_dist]
+    good_q, good_t, good_set = q_flat[passed], t_flat[passed], set_flat[passed]
+
+    if DUPLICATE_SIFT_MUTUAL and len(good_t):
+        needed = np.unique(good_t)
+        reverse_best = np.full(len(train), -1, dtype=np.intp)
+        try:
+            ratio = float(DUPLICATE_SIFT_RATIO)
+            for pos, pair in enumerate(cv2.BFMatcher(cv2.NORM_L2).knnMatch(train[needed], query, k=2)):
+                if len(pair) < 2:
+                    continue
+                m, n = pair
+                if m.distance < ratio * n.distance:
+                    reverse_best[needed[pos]] = int(m.trainIdx)
+            keep = reverse_best[good_t] == good_q
+            good_q, good_t, good_set = good_q[keep], good_t[keep], good_set[keep]
+        except Exception:
+            pass
+
+    min_good = max(4, DUPLICATE_SIFT_MIN_GOOD)
+    counts = np.bincount(good_set, minlength=len(sets))
+    for set_idx in np.flatnonzero(counts >= min_good):
+        cand_idx, (points_b, _, size_b) = sets[int(set_idx)]
+        in_set = good_set == set_idx
+        metrics = _sift_geometry_metrics(
+            points_a,
+            points_b,
+            good_q[in_set],
+            good_t[in_set] - offsets[set_idx],
+            size_a,
+            size_b,
+        )
+        if metrics is None:
+            continue
+        best = results[cand_idx]
+        if best is None or _sift_metrics_key(metrics) > _sift_metrics_key(best):
+            results[cand_idx] = metrics
+    return results
+
 def _is_image_item(item: Dict[str, Any]) -> bool:
     item_type = item.get("type")
     if item_type == "photo":
@@ -4035,108 +5384,188 @@ async def detect_duplicate_videos_fast(content: DraftContent) -> List[Dict[str,
             )
     return matches
 
-async def compute_image_fingerprints(content: DraftContent) -> List[Dict[str, Any]]:
-    fingerprints: List[Dict[str, Any]] = []
-    for idx, item in enumerate(content.items):
-        if not _is_image_item(item):
-            continue
+async def _map_album_items(func: Any, items: List[Tuple[int, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Run func(idx, item) for album items with bounded concurrency; keeps item order, drops None results.
 
-        item_type = item.get("type")
-        file_id = item.get("file_id") or item.get("hash_file_id")
-        if not file_id:
-            continue
+    Downloads are mostly waiting on Telegram, so the album costs about its slowest item instead of the sum;
+    CPU work still queues in mnemosyne_workers. If one item raises, the rest are cancelled.
+    """
+    if len(items) <= 1 or DUPLICATE_ITEM_CONCURRENCY <= 1:
+        results = [await func(idx, item) for idx, item in items]
+        return [fp for fp in results if fp]
+    slots = asyncio.Semaphore(DUPLICATE_ITEM_CONCURRENCY)
 
-        raw = await _download_duplicate_image_bytes(str(file_id))
-        if not raw:
-            continue
+    async def run(idx: int, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        async with slots:
+            return await func(idx, item)
 
-        img_pair = _load_image_gray_pair(raw, DUPLICATE_GAUSSIAN_BLUR_RADIUS)
-        if not img_pair:
+    tasks = [asyncio.ensure_future(run(idx, item)) for idx, item in items]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [fp for fp in results if fp]
+
+async def detect_duplicate_bytes(fingerprints: List[Dict[str, Any]], *, video: bool = False) -> List[Dict[str, Any]]:
+    """Byte-identical copies by content_sha256, for files whose file_unique_id changed on re-upload."""
+    matches: List[Dict[str, Any]] = []
+    for fp in fingerprints:
+        content_sha256 = fp.get("content_sha256")
+        if not content_sha256:
             continue
-        img_raw, img_blur, width, height = img_pair
-        dhash = _dhash_hex_from_image(img_blur, hash_size=DUPLICATE_IMAGE_HASH_SIZE)
-        phash = _phash_hex_from_image(
-            img_blur,
-            hash_size=DUPLICATE_IMAGE_HASH_SIZE,
-            highfreq_size=DUPLICATE_PHASH_HIGHFREQ_SIZE,
-        )
-        whash = _whash_hex_from_image(
-            img_blur,
-            hash_size=DUPLICATE_IMAGE_HASH_SIZE,
-            image_size=DUPLICATE_WHASH_IMAGE_SIZE,
-        )
-        item_width = item.get("width") or width
-        item_height = item.get("height") or height
-        file_size_raw = item.get("file_size")
-        try:
-            file_size = int(file_size_raw) if file_size_raw is not None else len(raw)
-        except Exception:
-            file_size = len(raw)
+        if video:
+            rows = await db.list_videos_by_sha256(str(content_sha256))
+        else:
+            rows = await db.list_images_by_sha256(str(content_sha256))
+        for row in rows:
+            # тот же file_unique_id уже нашла стадия unique_id
+            if fp.get("file_unique_id") and row["file_unique_id"] == fp.get("file_unique_id"):
+                continue
+            matches.append(
+                {
+                    "item_index": fp["item_index"],
+                    "match_type": "byte_hash",
+                    "post_id": row["post_id"],
+                    "distance": 0,
+                    "details": "побайтовая копия",
+                }
+            )
+    return matches
 
-        fingerprints.append(
-            {
-                "item_index": idx,
-                "kind": item_type,
-                "file_unique_id": item.get("file_unique_id"),
-                "file_size": file_size,
-                "width": item_width,
-                "height": item_height,
-                "dhash": dhash,
-                "phash": phash,
-                "whash": whash,
-                "image_gray": img_raw,
-            }
-        )
-    return fingerprints
+async def compute_image_fingerprints(content: DraftContent) -> List[Dict[str, Any]]:
+    items = [(idx, item) for idx, item in enumerate(content.items) if _is_image_item(item)]
+    return await _map_album_items(_image_item_fingerprint, items)
+
+async def _image_item_fingerprint(idx: int, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    item_type = item.get("type")
+    file_id, is_original = _image_hash_source(item)
+    if not file_id:
+        return None
+
+    raw = await _download_duplicate_image_bytes(str(file_id), _item_unique_id(item, file_id))
+    if not raw:
+        return None
+
+    image = DecodedImage(raw)
+    hashed = await mnemosyne_workers.run(_image_hashes, image)
+    if not hashed:
+        return None
+    item_width = item.get("width") or hashed["width"]
+    item_height = item.get("height") or hashed["height"]
+    file_size_raw = item.get("file_size")
+    try:
+        file_size = int(file_size_raw) if file_size_raw is not None else len(raw)
+    except Exception:
+        file_size = len(raw)
+
+    fp = {
+        "item_index": idx,
+        "kind": item_type,
+        "file_unique_id": item.get("file_unique_id"),
+        "file_size": file_size,
+        "width": item_width,
+        "height": item_height,
+        "dhash": hashed["dhash"],
+        "phash": hashed["phash"],
+        "whash": hashed["whash"],
+    }
+    if is_original:
+        image.adopt(hashed["image"])
+        fp["image"] = image
+        fp["content_sha256"] = await asyncio.to_thread(_sha256_hex, raw)
+    else:
+        # оригинал докачает геометрия, если до неё дойдёт
+        fp["image_file_id"] = item.get("file_id")
+        fp["image_unique_id"] = item.get("file_unique_id")
+    return fp
+
+def _image_hash_source(item: Dict[str, Any]) -> Tuple[Optional[str], bool]:
+    full_id = item.get("file_id")
+    hash_id = item.get("hash_file_id")
+    hash_side = max(int(item.get("hash_width") or 0), int(item.get("hash_height") or 0))
+    # у старых постов hash_file_id — миниатюра 90px без размеров, для них качаем оригинал;
+    # вес и размеры оригинала нужны для поиска кандидатов, без них тоже берём оригинал
+    if (
+        full_id
+        and hash_id
+        and hash_id != full_id
+        and DUPLICATE_HASH_PHOTO_SIDE > 0
+        and hash_side >= DUPLICATE_HASH_PHOTO_SIDE
+        and item.get("file_size")
+        and item.get("width")
+        and item.get("height")
+    ):
+        return str(hash_id), False
+    file_id = full_id or hash_id
+    return (str(file_id) if file_id else None), True
+
+async def _fingerprint_image(fp: Dict[str, Any]) -> Optional[DecodedImage]:
+    image = fp.get("image")
+    if image is not None:
+        return image
+    file_id = fp.pop("image_file_id", None)
+    if not file_id:
+        return None
+    raw = await _download_duplicate_image_bytes(str(file_id), fp.pop("image_unique_id", None))
+    if not raw:
+        return None
+    fp["image"] = DecodedImage(raw)
+    # оригинал всё равно скачан — байтовый хеш сохранится вместе с отпечатком
+    fp["content_sha256"] = await asyncio.to_thread(_sha256_hex, raw)
+    return fp["image"]
 
 async def compute_video_fingerprints(content: DraftContent) -> List[Dict[str, Any]]:
-    fingerprints: List[Dict[str, Any]] = []
-    for idx, item in enumerate(content.items):
-        if not _is_video_item(item):
-            continue
-        file_id = item.get("file_id")
-        if not file_id:
-            continue
-        path = await _download_to_tempfile(str(file_id), suffix=".mp4")
-        if not path:
-            continue
-        try:
-            meta = _ffprobe_metadata(path) or {}
-            duration_ms = meta.get("duration_ms")
-            if duration_ms is None:
-                duration_raw = item.get("duration")
-                if duration_raw:
-                    duration_ms = int(float(duration_raw) * 1000)
-            if duration_ms is None:
-                continue
-            width = meta.get("width") or item.get("width")
-            height = meta.get("height") or item.get("height")
-            fps = meta.get("fps")
-            file_size = item.get("file_size")
-            if file_size is None:
-                with contextlib.suppress(Exception):
-                    file_size = os.path.getsize(path)
-            frames = _collect_video_frames(path, duration_ms)
-        finally:
+    items = [(idx, item) for idx, item in enumerate(content.items) if _is_video_item(item)]
+    return await _map_album_items(_video_item_fingerprint, items)
+
+async def _video_item_fingerprint(idx: int, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    file_id = item.get("file_id")
+    if not file_id:
+        return None
+    path = await _download_to_tempfile(str(file_id), suffix=".mp4", unique_id=item.get("file_unique_id"))
+    if not path:
+        return None
+    try:
+        meta = await _ffprobe_metadata_async(path) or {}
+        duration_ms = meta.get("duration_ms")
+        if duration_ms is None:
+            duration_raw = item.get("duration")
+            if duration_raw:
+                duration_ms = int(float(duration_raw) * 1000)
+        if duration_ms is None:
+            return None
+        width = meta.get("width") or item.get("width")
+        height = meta.get("height") or item.get("height")
+        fps = meta.get("fps")
+        file_size = item.get("file_size")
+        if file_size is None:
             with contextlib.suppress(Exception):
-                os.remove(path)
-        if not frames:
-            continue
-        fingerprints.append(
-            {
-                "item_index": idx,
-                "kind": item.get("type") or "video",
-                "file_unique_id": item.get("file_unique_id"),
-                "file_size": file_size,
-                "duration_ms": duration_ms,
-                "width": width,
-                "height": height,
-                "fps": fps,
-                "frames": frames,
-                "audio_hash": None,
-            }
+                file_size = os.path.getsize(path)
+        frames, audio_hash = await mnemosyne_workers.run(
+            _collect_video_frames, path, duration_ms, (width, height), meta.get("has_audio")
         )
-    return fingerprints
+        content_sha256 = await asyncio.to_thread(_sha256_file, path)
+    finally:
+        with contextlib.suppress(Exception):
+            os.remove(path)
+    if not frames:
+        return None
+    return {
+        "content_sha256": content_sha256,
+        "item_index": idx,
+        "kind": item.get("type") or "video",
+        "file_unique_id": item.get("file_unique_id"),
+        "file_size": file_size,
+        "duration_ms": duration_ms,
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "frames": frames,
+        "audio_hash": audio_hash,
+    }
 
 async def _telethon_message_fingerprints(
     client: Any,
@@ -4148,7 +5577,7 @@ async def _telethon_message_fingerprints(
     if getattr(message, "photo", None):
         raw = await _telethon_download_bytes(client, message)
         if raw:
-            fp = _image_fingerprint_from_bytes(raw, kind="photo")
+            fp = await _image_fingerprint_from_bytes(raw, kind="photo")
             if fp:
                 image_fps.append(fp)
                 media_type = "photo"
@@ -4162,7 +5591,7 @@ async def _telethon_message_fingerprints(
         path = await _telethon_download_to_tempfile(client, message, suffix=".mp4")
         if path:
             try:
-                fp = _video_fingerprint_from_path(path, kind="video")
+                fp = await _video_fingerprint_from_path(path, kind="video")
             finally:
                 with contextlib.suppress(Exception):
                     os.remove(path)
@@ -4173,7 +5602,7 @@ async def _telethon_message_fingerprints(
     if mime and mime.startswith("image/"):
         raw = await _telethon_download_bytes(client, message)
         if raw:
-            fp = _image_fingerprint_from_bytes(raw, kind="document")
+            fp = await _image_fingerprint_from_bytes(raw, kind="document")
             if fp:
                 image_fps.append(fp)
                 media_type = "document"
@@ -4208,7 +5637,7 @@ async def _telethon_album_fingerprints(
         path = await _telethon_download_to_tempfile(client, seg["message"], suffix=".mp4")
         if not path:
             continue
-        meta = _ffprobe_metadata(path) or {}
+        meta = await _ffprobe_metadata_async(path) or {}
         duration_ms = meta.get("duration_ms")
         if duration_ms is None or duration_ms <= 0:
             with contextlib.suppress(Exception):
@@ -4297,7 +5726,14 @@ async def _telethon_album_fingerprints(
                 continue
             count = alloc[seg_idx]
             if count > 0:
-                seg_frames = _collect_video_frames_with_count(meta["path"], meta["duration_ms"], count)
+                # альбомы склеены из нескольких роликов, звук у них не снимаем
+                seg_frames, _ = await mnemosyne_workers.run(
+                    _collect_video_frames_with_count,
+                    meta["path"],
+                    meta["duration_ms"],
+                    count,
+                    (meta.get("width"), meta.get("height")),
+                )
                 for frame in seg_frames:
                     frame["t"] = int(offset_ms + frame["t"])
                     frames.append(frame)
@@ -4312,7 +5748,7 @@ async def _telethon_album_fingerprints(
             if count > 0:
                 raw = await _telethon_download_bytes(client, seg["message"])
                 if raw:
-                    hashed = _hash_frame_from_image_bytes(raw)
+                    hashed = await mnemosyne_workers.run(_hash_frame_from_image_bytes, raw)
                     if hashed:
                         hashed["t"] = int(offset_ms + DUPLICATE_VIDEO_PHOTO_DURATION_MS / 2)
                         frames.append(hashed)
@@ -4383,55 +5819,638 @@ def _match_ensemble(
         return True, score, details
     return False, None, None
 
-def _video_frame_match(
-    frame_a: Dict[str, Any],
-    frame_b: Dict[str, Any],
-) -> Tuple[bool, Optional[str], Optional[int]]:
-    dist_d = _distance_or_none(_hash_int(frame_a.get("d")), _hash_int(frame_b.get("d")))
-    dist_p = _distance_or_none(_hash_int(frame_a.get("p")), _hash_int(frame_b.get("p")))
-    dist_w = _distance_or_none(_hash_int(frame_a.get("w")), _hash_int(frame_b.get("w")))
-    thresholds = {
-        "d": DUPLICATE_VIDEO_DHASH_THRESHOLD,
-        "p": DUPLICATE_VIDEO_PHASH_THRESHOLD,
-        "w": DUPLICATE_VIDEO_WHASH_THRESHOLD,
-    }
-    distances = {"d": dist_d, "p": dist_p, "w": dist_w}
-    available = [d for d in distances.values() if d is not None]
-    if not available:
-        return False, None, None
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
 
-    hits = 0
-    for key, dist in distances.items():
-        if dist is None:
+def _popcount64(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int16)
+    raw = np.ascontiguousarray(values, dtype=np.uint64)
+    bytes_view = raw.view(np.uint8).reshape(raw.shape + (8,))
+    return _POPCOUNT_TABLE[bytes_view].sum(axis=-1, dtype=np.int16)
+
+def _hash_hex_to_index_value(value: Optional[str]) -> Tuple[int, int]:
+    """Returns (uint64 value, hex length) for the index; length 0 marks a hash that never matches."""
+    if not value:
+        return 0, 0
+    raw = str(value).strip()
+    if not raw or len(raw) > 16:
+        return 0, 0
+    parsed = _hash_int(raw)
+    if parsed is None:
+        return 0, 0
+    return parsed, len(raw)
+
+_HASH_KEYS = ("d", "p", "w")
+
+@functools.lru_cache(maxsize=32)
+def _mih_probe_masks(bits: int, radius: int) -> Tuple[int, ...]:
+    masks = [0]
+    for flips in range(1, min(bits, max(0, radius)) + 1):
+        for combo in itertools.combinations(range(bits), flips):
+            mask = 0
+            for bit in combo:
+                mask |= 1 << bit
+            masks.append(mask)
+    return tuple(masks)
+
+def _hash_distances_for_columns(fp: Dict[str, Any], hashes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    out = np.full((hashes.shape[0], 3), -1, dtype=np.int16)
+    if not hashes.shape[0]:
+        return out
+    for col, key in enumerate(("dhash", "phash", "whash")):
+        value, length = _hash_hex_to_index_value(fp.get(key))
+        if not length:
             continue
-        if dist <= thresholds.get(key, 0):
-            hits += 1
-    min_dist = min(available)
-    if hits < 2 and min_dist > DUPLICATE_VIDEO_SINGLE_HASH_THRESHOLD:
-        return False, None, None
+        comparable = lengths[:, col] == length
+        if not np.any(comparable):
+            continue
+        dist = _popcount64(hashes[:, col] ^ np.uint64(value))
+        out[:, col] = np.where(comparable, dist, -1)
+    return out
 
-    avg_dist = sum(available) / len(available)
-    max_dist = max(available)
-    if avg_dist > DUPLICATE_VIDEO_FRAME_AVG_DIST_MAX:
-        return False, None, None
-    if max_dist > DUPLICATE_VIDEO_FRAME_MAX_DIST:
-        return False, None, None
+def _hash_details_from_distances(row_dist: np.ndarray) -> Optional[str]:
+    details_parts = [f"{key}={int(row_dist[col])}" for col, key in enumerate(_HASH_KEYS) if row_dist[col] >= 0]
+    return ",".join(details_parts) if details_parts else None
+
+def _hash_row_from_db(row: aiosqlite.Row) -> Tuple[int, ...]:
+    values = []
+    lengths = []
+    for key in ("dhash", "phash", "whash"):
+        signed = _row_value(row, f"{key}_i")
+        if signed is not None:
+            value, length = int(signed) & _HASH64_MASK, 16
+        else:
+            value, length = _hash_hex_to_index_value(row[key])
+        values.append(value)
+        lengths.append(length)
+    return (
+        int(row["id"]),
+        int(row["post_id"]),
+        int(row["item_index"]),
+        int(row["file_size"] or 0),
+        int(row["width"] or 0),
+        int(row["height"] or 0),
+        *values,
+        *lengths,
+    )
 
-    details_parts = []
-    if dist_d is not None:
-        details_parts.append(f"d={dist_d}")
-    if dist_p is not None:
-        details_parts.append(f"p={dist_p}")
-    if dist_w is not None:
-        details_parts.append(f"w={dist_w}")
-    details = ",".join(details_parts) if details_parts else None
-    return True, details, int(round(avg_dist))
+@dataclass
+class ImageCandidateSnapshot:
+    """Column-oriented published image fingerprints, newest first, shared by all stages of one check."""
+
+    version: int
+    ids: np.ndarray
+    post_ids: np.ndarray
+    file_sizes: np.ndarray
+    widths: np.ndarray
+    heights: np.ndarray
+    hashes: np.ndarray
+    lengths: np.ndarray
+
+    _COLUMNS = ("ids", "post_ids", "file_sizes", "widths", "heights", "hashes", "lengths")
+
+    @classmethod
+    def from_rows(cls, version: int, rows: List[aiosqlite.Row]) -> "ImageCandidateSnapshot":
+        parsed = [_hash_row_from_db(row) for row in rows]
+        return cls(
+            version=version,
+            ids=np.array([r[0] for r in parsed], dtype=np.int64),
+            post_ids=np.array([r[1] for r in parsed], dtype=np.int64),
+            file_sizes=np.array([r[3] for r in parsed], dtype=np.int64),
+            widths=np.array([r[4] for r in parsed], dtype=np.int64),
+            heights=np.array([r[5] for r in parsed], dtype=np.int64),
+            hashes=np.array([r[6:9] for r in parsed], dtype=np.uint64).reshape(len(parsed), 3),
+            lengths=np.array([r[9:12] for r in parsed], dtype=np.int8).reshape(len(parsed), 3),
+        )
+
+    def __len__(self) -> int:
+        return int(self.post_ids.size)
+
+    def without_post(self, post_id: int) -> "ImageCandidateSnapshot":
+        keep = self.post_ids != int(post_id)
+        return ImageCandidateSnapshot(self.version, *(getattr(self, name)[keep] for name in self._COLUMNS))
+
+    def holds_post(self, post_id: int, rows: List[aiosqlite.Row]) -> bool:
+        """Whether the snapshot's rows for post_id are exactly the given published fingerprint rows."""
+        fresh = ImageCandidateSnapshot.from_rows(self.version, rows)
+        held = self.post_ids == int(post_id)
+        if int(np.count_nonzero(held)) != len(fresh):
+            return False
+        mine = np.argsort(self.ids[held], kind="stable")
+        theirs = np.argsort(fresh.ids, kind="stable")
+        return all(np.array_equal(getattr(self, name)[held][mine], getattr(fresh, name)[theirs]) for name in self._COLUMNS)
+
+    def distances(self, fp: Dict[str, Any]) -> np.ndarray:
+        return _hash_distances_for_columns(fp, self.hashes, self.lengths)
+
+    def size_scores(self, fp: Dict[str, Any]) -> np.ndarray:
+        """Vectorized _size_similarity_score; NaN where either side has no dimensions."""
+        out = np.full(len(self), np.nan, dtype=np.float64)
+        try:
+            fp_w = int(fp.get("width") or 0)
+            fp_h = int(fp.get("height") or 0)
+        except Exception:
+            return out
+        if fp_w <= 0 or fp_h <= 0:
+            return out
+        valid = (self.widths > 0) & (self.heights > 0)
+        if not np.any(valid):
+            return out
+        row_w = self.widths[valid].astype(np.float64)
+        row_h = self.heights[valid].astype(np.float64)
+        aspect_diff = np.abs(fp_w / fp_h - row_w / row_h)
+        area_diff = np.abs(np.log((fp_w * fp_h) / (row_w * row_h)))
+        out[valid] = aspect_diff + area_diff * DUPLICATE_ORB_SIZE_AREA_WEIGHT
+        return out
+
+_candidate_snapshot_cache: Dict[str, Any] = {"version": None, "snapshot": None}
+
+async def get_image_candidate_snapshot() -> Optional[ImageCandidateSnapshot]:
+    """Candidate snapshot for one deep check; rebuilt only after fingerprints were committed."""
+    if DUPLICATE_FULLSCAN_LIMIT <= 0:
+        return None
+    if image_hash_index.ready:
+        return image_hash_index.snapshot()
+    version = image_hash_index.version
+    if _candidate_snapshot_cache["version"] == version and _candidate_snapshot_cache["snapshot"] is not None:
+        return _candidate_snapshot_cache["snapshot"]
+    rows = await db.list_published_fingerprints(DUPLICATE_FULLSCAN_LIMIT)
+    snapshot = ImageCandidateSnapshot.from_rows(version, rows)
+    _candidate_snapshot_cache["version"] = version
+    _candidate_snapshot_cache["snapshot"] = snapshot
+    return snapshot
+
+class ImageHashIndex:
+    """Resident columnar copy of published image hashes with multi-index hashing buckets.
+
+    Each 64-bit hash is split into DUPLICATE_MIH_CHUNKS substrings with a bucket table per
+    substring; by pigeonhole a row within radius r shares at least one substring within r // k.
+    Queries whose probe count exceeds the budget fall back to one vectorized XOR+popcount pass.
+    """
+
+    _COLUMNS = ("ids", "post_ids", "item_indexes", "file_sizes", "widths", "heights", "hashes", "lengths")
+
+    def __init__(self):
+        self.ready = False
+        self.version = 0
+        self._snapshot: Optional[ImageCandidateSnapshot] = None
+        self._loading = False
+        self._dirty_posts: set[int] = set()
+        chunks = DUPLICATE_MIH_CHUNKS if DUPLICATE_MIH_CHUNKS in {1, 2, 4, 8, 16} else 4
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        self._buckets: List[List[Dict[int, List[int]]]] = []
+        self.stats: Dict[str, float] = {
+            "queries": 0,
+            "mih_queries": 0,
+            "linear_queries": 0,
+            "probes": 0,
+            "candidates": 0,
+            "rows_scanned": 0,
+            "latency_ms_total": 0.0,
+            "latency_ms_max": 0.0,
+            "recall_checks": 0,
+            "recall_expected": 0,
+            "recall_found": 0,
+        }
+        self._set_rows([])
+
+    def _set_rows(self, rows: List[Tuple[int, ...]]):
+        self._assign(self._columns(rows))
+        self._rebuild_buckets()
+
+    @staticmethod
+    def _columns(rows: List[Tuple[int, ...]]) -> Dict[str, np.ndarray]:
+        return {
+            "ids": np.array([r[0] for r in rows], dtype=np.int64),
+            "post_ids": np.array([r[1] for r in rows], dtype=np.int64),
+            "item_indexes": np.array([r[2] for r in rows], dtype=np.int64),
+            "file_sizes": np.array([r[3] for r in rows], dtype=np.int64),
+            "widths": np.array([r[4] for r in rows], dtype=np.int64),
+            "heights": np.array([r[5] for r in rows], dtype=np.int64),
+            "hashes": np.array([r[6:9] for r in rows], dtype=np.uint64).reshape(len(rows), 3),
+            "lengths": np.array([r[9:12] for r in rows], dtype=np.int8).reshape(len(rows), 3),
+        }
+
+    def _assign(self, columns: Dict[str, np.ndarray]):
+        order = np.argsort(columns["ids"], kind="stable")
+        for name in self._COLUMNS:
+            setattr(self, name, columns[name][order])
+
+    def _chunk_values(self, hashes: np.ndarray, chunk: int) -> np.ndarray:
+        shift = np.uint64(chunk * self.chunk_bits)
+        mask = np.uint64((1 << self.chunk_bits) - 1)
+        return (hashes >> shift) & mask
+
+    def _rebuild_buckets(self):
+        self._buckets = [[{} for _ in range(self.chunks)] for _ in _HASH_KEYS]
+        self._bucket_rows(self.ids, self.hashes, self.lengths, add=True)
+
+    def _bucket_rows(self, ids: np.ndarray, hashes: np.ndarray, lengths: np.ndarray, *, add: bool):
+        for col in range(len(_HASH_KEYS)):
+            present = lengths[:, col] > 0
+            if not np.any(present):
+                continue
+            col_ids = ids[present].tolist()
+            for chunk in range(self.chunks):
+                table = self._buckets[col][chunk]
+                values = self._chunk_values(hashes[present, col], chunk).tolist()
+                for value, row_id in zip(values, col_ids):
+                    if add:
+                        table.setdefault(value, []).append(row_id)
+                        continue
+                    bucket = table.get(value)
+                    if bucket is None:
+                        continue
+                    with contextlib.suppress(ValueError):
+                        bucket.remove(row_id)
+                    if not bucket:
+                        del table[value]
+
+    def __len__(self) -> int:
+        return int(self.ids.size)
+
+    async def load(self, database: "Database"):
+        if DUPLICATE_IMAGE_HASH_SIZE * DUPLICATE_IMAGE_HASH_SIZE > 64:
+            logger.info("Image hash index disabled: hash size %s does not fit 64 bits", DUPLICATE_IMAGE_HASH_SIZE)
+            return
+        self._loading = True
+        self._dirty_posts.clear()
+        try:
+            rows = await database.list_image_hash_index_rows()
+            self._set_rows([_hash_row_from_db(row) for row in rows])
+            self.version += 1
+            self.ready = True
+            dirty = list(self._dirty_posts)
+            self._dirty_posts.clear()
+        finally:
+            self._loading = False
+        for post_id in dirty:
+            await self.refresh_post(database, post_id)
+        logger.info("Image hash index loaded: %s fingerprints, %s chunks", len(self), self.chunks)
+
+    async def refresh_post(self, database: "Database", post_id: int):
+        if self._loading:
+            self._dirty_posts.add(int(post_id))
+            return
+        rows = await database.list_image_hash_index_rows(post_id)
+        if self.ready:
+            self._replace_post(int(post_id), [_hash_row_from_db(row) for row in rows])
+            return
+        snapshot = self._cached_snapshot()
+        if snapshot is None or not snapshot.holds_post(post_id, rows):
+            self.version += 1
+        elif len(snapshot) >= DUPLICATE_FULLSCAN_LIMIT:
+            # снимок держит только последние строки архива, про более старые строки поста он не знает
+            stored = await database.list_image_fingerprints_for_post(post_id)
+            if any(int(row["id"]) < int(snapshot.ids.min()) for row in stored):
+                self.version += 1
+
+    def drop_post(self, post_id: int):
+        if self._loading:
+            self._dirty_posts.add(int(post_id))
+            return
+        if self.ready:
+            self._replace_post(int(post_id), [])
+            return
+        snapshot = self._cached_snapshot()
+        # строки уже удалены: без полного снимка не узнать, были ли среди них опубликованные
+        if snapshot is None or len(snapshot) >= DUPLICATE_FULLSCAN_LIMIT or not snapshot.holds_post(post_id, []):
+            self.version += 1
+
+    def _cached_snapshot(self) -> Optional[ImageCandidateSnapshot]:
+        # пока индекс не готов, кандидатов даёт снимок из БД, собранный на текущей версии
+        if _candidate_snapshot_cache["version"] != self.version:
+            return None
+        return _candidate_snapshot_cache["snapshot"]
+
+    def _replace_post(self, post_id: int, rows: List[Tuple[int, ...]]):
+        keep = self.post_ids != post_id
+        if bool(np.all(keep)) and not rows:
+            return
+        removed = ~keep
+        added = self._columns(rows)
+        if self._same_rows(removed, added):
+            # смена статуса перечитывает те же строки: ни индекс, ни снимок на его версии не меняются
+            return
+        self._bucket_rows(self.ids[removed], self.hashes[removed], self.lengths[removed], add=False)
+        self._bucket_rows(added["ids"], added["hashes"], added["lengths"], add=True)
+        self._assign({name: np.concatenate([getattr(self, name)[keep], added[name]]) for name in self._COLUMNS})
+        self.version += 1
+
+    def _same_rows(self, positions: np.ndarray, columns: Dict[str, np.ndarray]) -> bool:
+        if int(np.count_nonzero(positions)) != int(columns["ids"].size):
+            return False
+        order = np.argsort(columns["ids"], kind="stable")
+        return all(np.array_equal(getattr(self, name)[positions], columns[name][order]) for name in self._COLUMNS)
+
+    def distances(self, fp: Dict[str, Any], positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Hamming distances (n, 3) for d/p/w against indexed rows; -1 where the pair is not comparable."""
+        if positions is None:
+            return _hash_distances_for_columns(fp, self.hashes, self.lengths)
+        return _hash_distances_for_columns(fp, self.hashes[positions], self.lengths[positions])
+
+    def snapshot(self) -> "ImageCandidateSnapshot":
+        cached = self._snapshot
+        if cached is None or cached.version != self.version:
+            # массивы индекса при изменениях заменяются целиком, так что снимок может ссылаться на них без копии
+            cached = ImageCandidateSnapshot(
+                version=self.version,
+                ids=self.ids[::-1],
+                post_ids=self.post_ids[::-1],
+                file_sizes=self.file_sizes[::-1],
+                widths=self.widths[::-1],
+                heights=self.heights[::-1],
+                hashes=self.hashes[::-1],
+                lengths=self.lengths[::-1],
+            )
+            self._snapshot = cached
+        return cached
+
+    def _mih_candidates(self, fp: Dict[str, Any], thresholds: Dict[str, int]) -> Optional[np.ndarray]:
+        # ансамбль срабатывает только если хотя бы один хеш укладывается в max(порог, single)
+        plans = []
+        probes = 0
+        for col, key in enumerate(("dhash", "phash", "whash")):
+            value, length = _hash_hex_to_index_value(fp.get(key))
+            if not length:
+                continue
+            radius = max(int(thresholds.get(_HASH_KEYS[col], 0)), DUPLICATE_SINGLE_HASH_THRESHOLD)
+            masks = _mih_probe_masks(self.chunk_bits, radius // self.chunks)
+            probes += len(masks) * self.chunks
+            if probes > DUPLICATE_MIH_MAX_PROBES:
+                return None
+            plans.append((col, value, masks))
+        found: List[int] = []
+        for col, value, masks in plans:
+            for chunk in range(self.chunks):
+                table = self._buckets[col][chunk]
+                if not table:
+                    continue
+                chunk_value = (value >> (chunk * self.chunk_bits)) & ((1 << self.chunk_bits) - 1)
+                for mask in masks:
+                    bucket = table.get(chunk_value ^ mask)
+                    if bucket:
+                        found.extend(bucket)
+        self.stats["probes"] += probes
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.searchsorted(self.ids, np.unique(np.array(found, dtype=np.int64)))
+
+    def search(
+        self,
+        fp: Dict[str, Any],
+        thresholds: Dict[str, int],
+        cache: Optional[Dict[str, Any]] = None,
+        within: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Row positions (ascending id) passing the hash ensemble, with their distances and scores.
+
+        within (ascending positions) bounds the linear pass used when MIH needs too many probes;
+        MIH hits are not restricted by it.
+        """
+        started = time.perf_counter()
+        self.stats["queries"] += 1
+        positions = self._mih_candidates(fp, thresholds)
+        used_mih = positions is not None
+        if positions is None:
+            self.stats["linear_queries"] += 1
+            if cache is not None and "distances" in cache:
+                distances = cache["distances"] if within is None else cache["distances"][within]
+            elif within is not None:
+                distances = self.distances(fp, within)
+            else:
+                distances = self.distances(fp)
+                if cache is not None:
+                    cache["distances"] = distances
+            positions = np.arange(len(self)) if within is None else within
+            self.stats["rows_scanned"] += int(positions.size)
+        else:
+            self.stats["mih_queries"] += 1
+            self.stats["candidates"] += int(positions.size)
+            distances = self.distances(fp, positions)
+        ok, score = _match_ensemble_vectorized(distances, thresholds, DUPLICATE_SINGLE_HASH_THRESHOLD)
+        hits = positions[ok]
+        if (
+            used_mih
+            and DUPLICATE_MIH_RECALL_SAMPLE_RATE > 0
+            and random.random() < DUPLICATE_MIH_RECALL_SAMPLE_RATE
+        ):
+            exact_ok, _exact_score = _match_ensemble_vectorized(
+                self.distances(fp),
+                thresholds,
+                DUPLICATE_SINGLE_HASH_THRESHOLD,
+            )
+            self.stats["recall_checks"] += 1
+            self.stats["recall_expected"] += int(np.count_nonzero(exact_ok))
+            self.stats["recall_found"] += int(np.count_nonzero(exact_ok[hits]))
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        self.stats["latency_ms_total"] += elapsed_ms
+        self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], elapsed_ms)
+        return hits, distances[ok], score[ok]
+
+    def format_stats(self) -> str:
+        stats = self.stats
+        queries = max(1, int(stats["queries"]))
+        recall = (
+            f"{stats['recall_found'] / stats['recall_expected']:.3f}"
+            if stats["recall_expected"]
+            else "n/a"
+        )
+        return (
+            f"индекс хешей: {len(self)} отпечатков, готов={self.ready}, чанков={self.chunks}\n"
+            f"запросов: {int(stats['queries'])} (mih {int(stats['mih_queries'])}, линейно {int(stats['linear_queries'])})\n"
+            f"пробы: {int(stats['probes'])}, кандидаты: {int(stats['candidates'])}, строк просканено: {int(stats['rows_scanned'])}\n"
+            f"латентность: avg {stats['latency_ms_total'] / queries:.2f} ms, max {stats['latency_ms_max']:.2f} ms\n"
+            f"recall: {recall} ({int(stats['recall_checks'])} проверок)"
+        )
+
+image_hash_index = ImageHashIndex()
+
+def _match_ensemble_vectorized(
+    distances: np.ndarray,
+    thresholds: Dict[str, int],
+    single_threshold: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    limits = np.array([thresholds.get(key, 0) for key in _HASH_KEYS], dtype=np.int16)
+    available = distances >= 0
+    hits = ((distances <= limits) & available).sum(axis=1)
+    score = np.where(available, distances, np.iinfo(np.int16).max).min(axis=1)
+    ok = available.any(axis=1) & ((hits >= 2) | (score <= single_threshold))
+    return ok, score
+
+HashTier = Tuple[str, Dict[str, int], Optional[int], int]
+
+def _hash_match_tiers() -> List[HashTier]:
+    """(match_type, thresholds, size tolerance, candidate limit) from the tightest tier to the widest.
+
+    A tolerance of None means the whole archive; a row is reported once, under the first tier it satisfies.
+    """
+    tiers: List[HashTier] = [
+        (
+            "hash_fast",
+            {"d": DUPLICATE_DHASH_THRESHOLD, "p": DUPLICATE_PHASH_THRESHOLD, "w": DUPLICATE_WHASH_THRESHOLD},
+            DUPLICATE_SIZE_TOLERANCE_BYTES,
+            DUPLICATE_SIZE_CANDIDATE_LIMIT,
+        ),
+        (
+            "hash_slow",
+            {
+                "d": DUPLICATE_DHASH_THRESHOLD_SLOW,
+                "p": DUPLICATE_PHASH_THRESHOLD_SLOW,
+                "w": DUPLICATE_WHASH_THRESHOLD_SLOW,
+            },
+            DUPLICATE_SIZE_TOLERANCE_BYTES_SLOW,
+            DUPLICATE_SIZE_CANDIDATE_LIMIT_SLOW,
+        ),
+    ]
+    if DUPLICATE_FULLSCAN_LIMIT > 0:
+        tiers.append(("hash_fullscan", tiers[1][1], None, DUPLICATE_FULLSCAN_LIMIT))
+    return tiers
+
+def _index_hit_order(positions: np.ndarray, file_size: int, size_tolerance: Optional[int]) -> np.ndarray:
+    if size_tolerance is None:
+        return np.arange(positions.size - 1, -1, -1)
+    sizes = image_hash_index.file_sizes[positions]
+    min_size = max(0, file_size - int(size_tolerance))
+    in_window = np.nonzero((sizes >= min_size) & (sizes <= file_size + int(size_tolerance)))[0]
+    # тот же порядок что у list_image_candidates_by_size: ближе по размеру, затем новее
+    return in_window[np.lexsort((-image_hash_index.ids[positions[in_window]], np.abs(sizes[in_window] - file_size)))]
+
+def _tiered_matches_from_index(
+    fp: Dict[str, Any],
+    tiers: List[HashTier],
+    file_size: Optional[int],
+) -> List[Dict[str, Any]]:
+    """Tiers with the same thresholds share one index search; the tight tier stays within the MIH probe budget.
+
+    A search that falls back to the linear pass only scans the size window unless an archive-wide tier needs it.
+    """
+    def limits(thresholds: Dict[str, int]) -> Tuple[int, ...]:
+        return tuple(int(thresholds.get(key, 0)) for key in _HASH_KEYS)
+
+    # без размера файла уровни с окном по размеру пропускаются
+    active = [tier for tier in tiers if tier[2] is None or file_size is not None]
+    searches: Dict[Tuple[int, ...], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+    cache: Dict[str, Any] = {}
+    emitted = np.zeros(len(image_hash_index), dtype=bool)
+    matches: List[Dict[str, Any]] = []
+    for match_type, thresholds, size_tolerance, _limit in active:
+        key = limits(thresholds)
+        if key not in searches:
+            tolerances = [tier[2] for tier in active if limits(tier[1]) == key]
+            within = None
+            if None not in tolerances:
+                widest = max(int(tol) for tol in tolerances)
+                within = np.nonzero(np.abs(image_hash_index.file_sizes - int(file_size or 0)) <= widest)[0]
+            searches[key] = image_hash_index.search(fp, thresholds, cache, within=within)
+        positions, distances, score = searches[key]
+        order = _index_hit_order(positions, file_size or 0, size_tolerance)
+        order = order[~emitted[positions[order]]]
+        emitted[positions[order]] = True
+        for local in order.tolist():
+            matches.append(
+                {
+                    "item_index": fp["item_index"],
+                    "match_type": match_type,
+                    "post_id": int(image_hash_index.post_ids[positions[local]]),
+                    "distance": int(score[local]),
+                    "details": _hash_details_from_distances(distances[local]),
+                }
+            )
+    return matches
+
+def _video_frame_hash_columns(frames: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """d/p/w of each frame as uint64 columns (n, 3) plus a presence mask."""
+    values = np.zeros((len(frames), 3), dtype=np.uint64)
+    present = np.zeros((len(frames), 3), dtype=bool)
+    for row, frame in enumerate(frames):
+        for col, key in enumerate(_HASH_KEYS):
+            value = _frame_hash_int(frame.get(key))
+            if value is None:
+                continue
+            values[row, col] = int(value) & _HASH64_MASK
+            present[row, col] = True
+    return values, present
+
+def _video_frame_match_matrix(query: "VideoFrames", cand: "VideoFrames") -> Tuple[np.ndarray, np.ndarray]:
+    """Frame-vs-frame ensemble for every query×candidate pair: (ok, rounded average distance)."""
+    dist = _popcount64(query.values[:, None, :] ^ cand.values[None, :, :]).astype(np.int32)
+    present = query.present[:, None, :] & cand.present[None, :, :]
+    available = present.sum(axis=-1)
+    thresholds = np.array(
+        [DUPLICATE_VIDEO_DHASH_THRESHOLD, DUPLICATE_VIDEO_PHASH_THRESHOLD, DUPLICATE_VIDEO_WHASH_THRESHOLD],
+        dtype=np.int32,
+    )
+    hits = (present & (dist <= thresholds)).sum(axis=-1)
+    min_dist = np.where(present, dist, 65).min(axis=-1)
+    max_dist = np.where(present, dist, -1).max(axis=-1)
+    avg_dist = np.where(present, dist, 0).sum(axis=-1) / np.maximum(available, 1)
+    ok = (available > 0) & ((hits >= 2) | (min_dist <= DUPLICATE_VIDEO_SINGLE_HASH_THRESHOLD))
+    ok &= (avg_dist <= DUPLICATE_VIDEO_FRAME_AVG_DIST_MAX) & (max_dist <= DUPLICATE_VIDEO_FRAME_MAX_DIST)
+    # np.rint, как и round(), округляет половины к чётному
+    return ok, np.rint(avg_dist).astype(np.int64)
+
+def _frames_for_storage(frames: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out = []
+    for frame in frames:
+        stored = dict(frame)
+        for key in ("d", "p", "w"):
+            value = stored.get(key)
+            signed = _hash_signed_from_hex(value) if isinstance(value, str) else None
+            if signed is not None:
+                stored[key] = signed
+        out.append(stored)
+    return out
+
+_VIDEO_FRAMES_BLOB_MAGIC = b"VF1\x00"
+_VIDEO_FRAME_RECORD = np.dtype([("t", "<i4"), ("d", "<u8"), ("p", "<u8"), ("w", "<u8")])
+
+def _pack_video_frames(frames: List[Dict[str, Any]]) -> Optional[bytes]:
+    """frame_hashes as packed (t_ms int32, d/p/w uint64) records; None if some frame does not fit losslessly."""
+    records = np.zeros(len(frames), dtype=_VIDEO_FRAME_RECORD)
+    for row, frame in enumerate(frames):
+        t_ms = frame.get("t")
+        if isinstance(t_ms, bool) or not isinstance(t_ms, (int, float)) or t_ms != int(t_ms):
+            return None
+        if not -(1 << 31) <= int(t_ms) < (1 << 31):
+            return None
+        records[row]["t"] = int(t_ms)
+        for key in _HASH_KEYS:
+            value = _frame_hash_int(frame.get(key))
+            if value is None:
+                return None
+            records[row][key] = int(value) & _HASH64_MASK
+    return _VIDEO_FRAMES_BLOB_MAGIC + records.tobytes()
+
+def _unpack_video_frames(raw: bytes) -> Optional[np.ndarray]:
+    raw = bytes(raw)
+    if not raw.startswith(_VIDEO_FRAMES_BLOB_MAGIC):
+        return None
+    body = raw[len(_VIDEO_FRAMES_BLOB_MAGIC):]
+    if len(body) % _VIDEO_FRAME_RECORD.itemsize:
+        return None
+    return np.frombuffer(body, dtype=_VIDEO_FRAME_RECORD)
+
+def _video_frames_for_db(frames: List[Dict[str, Any]]) -> Any:
+    packed = _pack_video_frames(frames)
+    if packed is not None:
+        return packed
+    return json.dumps(_frames_for_storage(frames))
 
 def _parse_video_frames(raw: Any) -> List[Dict[str, Any]]:
     if raw is None:
         return []
     if isinstance(raw, list):
         return raw
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        records = _unpack_video_frames(raw)
+        if records is None:
+            return []
+        return [
+            {"t": int(rec["t"]), **{key: _hash_signed(int(rec[key])) for key in _HASH_KEYS}}
+            for rec in records
+        ]
     if isinstance(raw, str):
         try:
             data = json.loads(raw)
@@ -4440,87 +6459,462 @@ def _parse_video_frames(raw: Any) -> List[Dict[str, Any]]:
         return data if isinstance(data, list) else []
     return []
 
-def _video_meta_score(fp: Dict[str, Any], row: aiosqlite.Row) -> float:
-    score = 0.0
-    duration_weight = DUPLICATE_VIDEO_META_WEIGHT_DURATION
-    size_weight = DUPLICATE_VIDEO_META_WEIGHT_SIZE
-    if fp.get("kind") == "album":
-        scale = max(1, int(fp.get("segments_count") or 1))
-        duration_weight = duration_weight / scale
-        size_weight = size_weight / scale
-    duration_fp = fp.get("duration_ms")
-    duration_row = row["duration_ms"]
-    if duration_fp and duration_row:
-        score += duration_weight * abs(duration_fp - duration_row) / max(duration_fp, 1)
-    else:
-        score += duration_weight
+@dataclass
+class VideoFrames:
+    """Frames ready for alignment: t in ms, d/p/w as uint64 columns with a presence mask; frames without t are dropped."""
+
+    count: int
+    times: np.ndarray
+    values: np.ndarray
+    present: np.ndarray
+
+    @classmethod
+    def from_frames(cls, frames: List[Dict[str, Any]]) -> "VideoFrames":
+        timed = [frame for frame in frames if frame.get("t") is not None]
+        values, present = _video_frame_hash_columns(timed)
+        return cls(
+            count=len(frames),
+            times=np.array([float(frame["t"]) for frame in timed], dtype=np.float64),
+            values=values,
+            present=present,
+        )
 
-    fps_fp = fp.get("fps")
-    fps_row = row["fps"]
-    if fps_fp and fps_row:
-        score += DUPLICATE_VIDEO_META_WEIGHT_FPS * abs(float(fps_fp) - float(fps_row)) / max(float(fps_fp), 1.0)
-    else:
-        score += DUPLICATE_VIDEO_META_WEIGHT_FPS
-
-    width_fp = fp.get("width")
-    height_fp = fp.get("height")
-    width_row = row["width"]
-    height_row = row["height"]
-    if width_fp and height_fp and width_row and height_row:
-        aspect_fp = float(width_fp) / float(height_fp)
-        aspect_row = float(width_row) / float(height_row)
-        score += DUPLICATE_VIDEO_META_WEIGHT_ASPECT * abs(math.log(aspect_fp / aspect_row))
-    else:
-        score += DUPLICATE_VIDEO_META_WEIGHT_ASPECT
+    @classmethod
+    def from_stored(cls, raw: Any) -> "VideoFrames":
+        records = _unpack_video_frames(raw) if isinstance(raw, (bytes, bytearray, memoryview)) else None
+        if records is None:
+            return cls.from_frames(_parse_video_frames(raw))
+        return cls(
+            count=int(records.size),
+            times=records["t"].astype(np.float64),
+            values=np.stack([records[key] for key in _HASH_KEYS], axis=1),
+            present=np.ones((records.size, 3), dtype=bool),
+        )
 
-    size_fp = fp.get("file_size")
-    size_row = row["file_size"]
-    if size_fp and size_row:
-        score += size_weight * abs(math.log(float(size_fp) / float(size_row)))
-    else:
-        score += size_weight
+    def __len__(self) -> int:
+        return int(self.times.size)
+
+class VideoFramesCache:
+    """Decoded frame_hashes by video fingerprint id; a row's frames never change, so entries are only evicted."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._items: "OrderedDict[int, VideoFrames]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def get(self, fp_id: int, raw: Any) -> VideoFrames:
+        cached = self._items.get(fp_id)
+        if cached is not None:
+            self._items.move_to_end(fp_id)
+            self.stats["hits"] += 1
+            return cached
+        self.stats["misses"] += 1
+        frames = VideoFrames.from_stored(raw)
+        if self.limit > 0:
+            self._items[fp_id] = frames
+            while len(self._items) > self.limit:
+                self._items.popitem(last=False)
+        return frames
+
+    def format_stats(self) -> str:
+        hits = self.stats["hits"]
+        lookups = hits + self.stats["misses"]
+        rate = f"{hits / lookups:.2f}" if lookups else "n/a"
+        return f"кадры видео в памяти: {len(self._items)}/{self.limit}, попаданий {hits}/{lookups} ({rate})"
+
+video_frames_cache = VideoFramesCache(DUPLICATE_VIDEO_FRAMES_CACHE_SIZE)
+
+def _positive_float(value: Any) -> float:
+    try:
+        value = float(value or 0)
+    except Exception:
+        return 0.0
+    return value if value > 0 else 0.0
+
+@dataclass
+class VideoCandidateTable:
+    """Columnar metadata of published video fingerprints (ascending id) for meta pre-ranking; 0 = unknown."""
+
+    version: int
+    ids: np.ndarray
+    post_ids: np.ndarray
+    file_sizes: np.ndarray
+    durations: np.ndarray
+    widths: np.ndarray
+    heights: np.ndarray
+    fps: np.ndarray
+
+    _COLUMNS = ("ids", "post_ids", "file_sizes", "durations", "widths", "heights", "fps")
+
+    @classmethod
+    def from_rows(cls, version: int, rows: List[aiosqlite.Row]) -> "VideoCandidateTable":
+        rows = sorted(rows, key=lambda row: int(row["id"]))
+        return cls(
+            version=version,
+            ids=np.array([int(row["id"]) for row in rows], dtype=np.int64),
+            post_ids=np.array([int(row["post_id"]) for row in rows], dtype=np.int64),
+            file_sizes=np.array([_positive_float(row["file_size"]) for row in rows], dtype=np.float64),
+            durations=np.array([_positive_float(row["duration_ms"]) for row in rows], dtype=np.float64),
+            widths=np.array([_positive_float(row["width"]) for row in rows], dtype=np.float64),
+            heights=np.array([_positive_float(row["height"]) for row in rows], dtype=np.float64),
+            fps=np.array([_positive_float(row["fps"]) for row in rows], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return int(self.ids.size)
+
+    def newest(self, limit: int) -> "VideoCandidateTable":
+        if limit <= 0 or limit >= len(self):
+            return self
+        return VideoCandidateTable(self.version, *(getattr(self, name)[-limit:] for name in self._COLUMNS))
+
+    def without_post(self, post_id: int) -> "VideoCandidateTable":
+        keep = self.post_ids != int(post_id)
+        return VideoCandidateTable(self.version, *(getattr(self, name)[keep] for name in self._COLUMNS))
+
+    def concat(self, other: "VideoCandidateTable") -> "VideoCandidateTable":
+        ids = np.concatenate([self.ids, other.ids])
+        order = np.argsort(ids, kind="stable")
+        return VideoCandidateTable(
+            self.version,
+            *(np.concatenate([getattr(self, name), getattr(other, name)])[order] for name in self._COLUMNS),
+        )
+
+    def meta_scores(self, fp: Dict[str, Any]) -> np.ndarray:
+        """Meta distance of fp to every row: duration, fps, aspect and size terms, full weight when unknown."""
+        duration_weight = DUPLICATE_VIDEO_META_WEIGHT_DURATION
+        size_weight = DUPLICATE_VIDEO_META_WEIGHT_SIZE
+        if fp.get("kind") == "album":
+            scale = max(1, int(fp.get("segments_count") or 1))
+            duration_weight = duration_weight / scale
+            size_weight = size_weight / scale
+        n = len(self)
+        duration_fp = _positive_float(fp.get("duration_ms"))
+        duration = np.full(n, duration_weight, dtype=np.float64)
+        if duration_fp:
+            known = self.durations > 0
+            duration[known] = duration_weight * np.abs(duration_fp - self.durations[known]) / max(duration_fp, 1.0)
+
+        fps_fp = _positive_float(fp.get("fps"))
+        fps = np.full(n, DUPLICATE_VIDEO_META_WEIGHT_FPS, dtype=np.float64)
+        if fps_fp:
+            known = self.fps > 0
+            fps[known] = DUPLICATE_VIDEO_META_WEIGHT_FPS * np.abs(fps_fp - self.fps[known]) / max(fps_fp, 1.0)
+
+        width_fp = _positive_float(fp.get("width"))
+        height_fp = _positive_float(fp.get("height"))
+        aspect = np.full(n, DUPLICATE_VIDEO_META_WEIGHT_ASPECT, dtype=np.float64)
+        if width_fp and height_fp:
+            known = (self.widths > 0) & (self.heights > 0)
+            aspect_row = self.widths[known] / self.heights[known]
+            aspect[known] = DUPLICATE_VIDEO_META_WEIGHT_ASPECT * np.abs(np.log((width_fp / height_fp) / aspect_row))
+
+        size_fp = _positive_float(fp.get("file_size"))
+        size = np.full(n, size_weight, dtype=np.float64)
+        if size_fp:
+            known = self.file_sizes > 0
+            size[known] = size_weight * np.abs(np.log(size_fp / self.file_sizes[known]))
+
+        return duration + fps + aspect + size
+
+    def top_k(self, fp: Dict[str, Any], k: int) -> np.ndarray:
+        """Row positions with the k lowest meta scores, best first; ties go to newer rows."""
+        scores = self.meta_scores(fp)
+        newer = -self.ids
+        if k <= 0 or k >= scores.size:
+            return np.lexsort((newer, scores))
+        part = np.argpartition(scores, k - 1)[:k]
+        kth = scores[part].max()
+        chosen = np.flatnonzero(scores < kth)
+        ties = np.flatnonzero(scores == kth)
+        ties = ties[np.argsort(newer[ties], kind="stable")][: k - chosen.size]
+        chosen = np.concatenate([chosen, ties])
+        return chosen[np.lexsort((newer[chosen], scores[chosen]))]
+
+def _video_lsh_keys(frames: VideoFrames, bands: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Band keys of every present d/p/w frame hash with the frame they came from; key = slot << bits | band value."""
+    bits = 64 // bands
+    shifts = np.arange(bands, dtype=np.uint64) * np.uint64(bits)
+    chunks = (frames.values[:, :, None] >> shifts) & np.uint64((1 << bits) - 1)
+    slots = (np.arange(3)[:, None] * bands + np.arange(bands)[None, :]).astype(np.uint64) << np.uint64(bits)
+    # полосы не длиннее 16 бит, так что ключ с номером слота помещается в uint32
+    keys = (chunks | slots).astype(np.uint32)
+    present = np.broadcast_to(frames.present[:, :, None], keys.shape)
+    frame_idx = np.broadcast_to(np.arange(keys.shape[0])[:, None, None], keys.shape)
+    return keys[present], frame_idx[present]
+
+class VideoFrameLSH:
+    """Inverted index from frame hash bands to video fingerprint ids.
+
+    Hashes within a few bits share at least one band with high probability, so a duplicate video
+    collects a vote from most of its frames regardless of its metadata. Keys and ids live in sorted
+    uint32/int32 arrays; new rows go to a small sorted tail that is merged in once it grows,
+    dropping removed ids.
+    """
+
+    def __init__(self, bands: int):
+        self.bands = bands
+        self._keys = np.zeros(0, dtype=np.uint32)
+        self._ids = np.zeros(0, dtype=np.int32)
+        self._tail_keys = np.zeros(0, dtype=np.uint32)
+        self._tail_ids = np.zeros(0, dtype=np.int32)
+        self._dead: set[int] = set()
+
+    def __len__(self) -> int:
+        return int(self._keys.size + self._tail_keys.size)
+
+    @staticmethod
+    def _sorted(keys: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        order = np.argsort(keys, kind="stable")
+        return keys[order], ids[order]
+
+    def _row_keys(self, rows: List[Tuple[int, VideoFrames]]) -> Tuple[np.ndarray, np.ndarray]:
+        keys: List[np.ndarray] = []
+        ids: List[np.ndarray] = []
+        for fp_id, frames in rows:
+            if not len(frames):
+                continue
+            row_keys = np.unique(_video_lsh_keys(frames, self.bands)[0])
+            keys.append(row_keys)
+            ids.append(np.full(row_keys.size, fp_id, dtype=np.int32))
+        if not keys:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int32)
+        return np.concatenate(keys), np.concatenate(ids)
+
+    def build(self, rows: List[Tuple[int, VideoFrames]]):
+        self._keys, self._ids = self._sorted(*self._row_keys(rows))
+        self._tail_keys = np.zeros(0, dtype=np.uint32)
+        self._tail_ids = np.zeros(0, dtype=np.int32)
+        self._dead.clear()
+
+    def add(self, rows: List[Tuple[int, VideoFrames]]):
+        readded = self._dead.intersection(int(fp_id) for fp_id, _frames in rows)
+        if readded:
+            # снятый и снова опубликованный пост возвращает те же id строк: старые ключи убираем сейчас,
+            # а из _dead id выходит, иначе слияние выкинуло бы и свежие ключи
+            stale = np.fromiter(readded, dtype=np.int32)
+            keep = ~np.isin(self._ids, stale)
+            self._keys, self._ids = self._keys[keep], self._ids[keep]
+            keep = ~np.isin(self._tail_ids, stale)
+            self._tail_keys, self._tail_ids = self._tail_keys[keep], self._tail_ids[keep]
+            self._dead.difference_update(readded)
+        keys, ids = self._row_keys(rows)
+        if keys.size:
+            self._tail_keys, self._tail_ids = self._sorted(
+                np.concatenate([self._tail_keys, keys]),
+                np.concatenate([self._tail_ids, ids]),
+            )
+        if self._tail_keys.size > max(50000, self._keys.size // 8):
+            keys = np.concatenate([self._keys, self._tail_keys])
+            ids = np.concatenate([self._ids, self._tail_ids])
+            if self._dead:
+                alive = ~np.isin(ids, np.fromiter(self._dead, dtype=np.int32))
+                keys, ids = keys[alive], ids[alive]
+                self._dead.clear()
+            self._keys, self._ids = self._sorted(keys, ids)
+            self._tail_keys = np.zeros(0, dtype=np.uint32)
+            self._tail_ids = np.zeros(0, dtype=np.int32)
+
+    def discard(self, ids: List[int]):
+        # ключи удалённых строк выкидываются при следующем слиянии, голоса за них отсекает вызывающий
+        self._dead.update(int(fp_id) for fp_id in ids)
+
+    def vote(self, frames: VideoFrames) -> Tuple[np.ndarray, np.ndarray]:
+        """(fingerprint ids, number of query frames sharing a band with them)."""
+        if not len(frames) or not len(self):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        keys, frame_idx = _video_lsh_keys(frames, self.bands)
+        hit_ids: List[np.ndarray] = []
+        hit_frames: List[np.ndarray] = []
+        for table_keys, table_ids in ((self._keys, self._ids), (self._tail_keys, self._tail_ids)):
+            if not table_keys.size:
+                continue
+            lo = np.searchsorted(table_keys, keys, side="left")
+            sizes = np.searchsorted(table_keys, keys, side="right") - lo
+            usable = (sizes > 0) & (sizes <= DUPLICATE_VIDEO_LSH_MAX_BUCKET)
+            lo, sizes = lo[usable], sizes[usable]
+            if not sizes.size:
+                continue
+            ends = np.cumsum(sizes)
+            positions = np.arange(int(ends[-1])) - np.repeat(ends - sizes - lo, sizes)
+            hit_ids.append(table_ids[positions])
+            hit_frames.append(np.repeat(frame_idx[usable], sizes))
+        if not hit_ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        pairs = np.unique(np.concatenate(hit_ids).astype(np.int64) * len(frames) + np.concatenate(hit_frames))
+        return np.unique(pairs // len(frames), return_counts=True)
+
+class VideoCandidateIndex:
+    """Resident VideoCandidateTable of all published videos, updated per post as fingerprints change."""
+
+    def __init__(self):
+        self.ready = False
+        self.version = 0
+        self._loading = False
+        self._dirty_posts: set[int] = set()
+        self.table = VideoCandidateTable.from_rows(0, [])
+        bands = DUPLICATE_VIDEO_LSH_BANDS
+        self.lsh = VideoFrameLSH(bands) if bands in {4, 8, 16} else None
+        self.stats: Dict[str, float] = {
+            "queries": 0,
+            "rows_scored": 0,
+            "latency_ms_total": 0.0,
+            "latency_ms_max": 0.0,
+            "lsh_queries": 0,
+            "lsh_voted": 0,
+            "lsh_added": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self.table)
 
-    return score
+    async def load(self, database: "Database"):
+        self._loading = True
+        self._dirty_posts.clear()
+        try:
+            rows = await database.list_video_meta_rows()
+            self.version += 1
+            self.table = VideoCandidateTable.from_rows(self.version, rows)
+            if self.lsh is not None:
+                self.lsh.build(self._lsh_rows(rows))
+            self.ready = True
+            dirty = list(self._dirty_posts)
+            self._dirty_posts.clear()
+        finally:
+            self._loading = False
+        for post_id in dirty:
+            await self.refresh_post(database, post_id)
+        logger.info(
+            "Video candidate index loaded: %s fingerprints, %s LSH keys",
+            len(self),
+            len(self.lsh) if self.lsh is not None else 0,
+        )
+
+    @staticmethod
+    def _lsh_rows(rows: List[aiosqlite.Row]) -> List[Tuple[int, VideoFrames]]:
+        return [(int(row["id"]), VideoFrames.from_stored(row["frame_hashes"])) for row in rows]
+
+    async def refresh_post(self, database: "Database", post_id: int):
+        if self._loading:
+            self._dirty_posts.add(int(post_id))
+            return
+        if not self.ready:
+            self.version += 1
+            return
+        rows = await database.list_video_meta_rows(post_id)
+        self._replace_post(int(post_id), rows)
+
+    def drop_post(self, post_id: int):
+        if self._loading:
+            self._dirty_posts.add(int(post_id))
+            return
+        if self.ready:
+            self._replace_post(int(post_id), [])
+        else:
+            self.version += 1
+
+    def _replace_post(self, post_id: int, rows: List[aiosqlite.Row]):
+        removed = self.table.ids[self.table.post_ids == post_id]
+        if not rows and not removed.size:
+            return
+        if self.lsh is not None:
+            # обновление статуса перечитывает те же строки; в LSH трогаем только реально ушедшие и новые id
+            new_ids = {int(row["id"]) for row in rows}
+            old_ids = set(removed.tolist())
+            self.lsh.discard(sorted(old_ids - new_ids))
+            self.lsh.add(self._lsh_rows([row for row in rows if int(row["id"]) not in old_ids]))
+        self.version += 1
+        table = self.table.without_post(post_id).concat(VideoCandidateTable.from_rows(self.version, rows))
+        table.version = self.version
+        self.table = table
+
+    def rank(self, table: VideoCandidateTable, fp: Dict[str, Any], k: int) -> np.ndarray:
+        """Fingerprint ids of the k best meta candidates for fp, best first."""
+        started = time.perf_counter()
+        positions = table.top_k(fp, k)
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        self.stats["queries"] += 1
+        self.stats["rows_scored"] += len(table)
+        self.stats["latency_ms_total"] += elapsed_ms
+        self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], elapsed_ms)
+        return table.ids[positions]
+
+    def candidates(self, table: VideoCandidateTable, fp: Dict[str, Any], frames: VideoFrames) -> np.ndarray:
+        """Meta top-K for fp plus the best LSH-voted fingerprints of the same table, meta order first."""
+        ranked = self.rank(table, fp, DUPLICATE_VIDEO_TOPK)
+        if self.lsh is None or not self.ready or DUPLICATE_VIDEO_LSH_TOPK <= 0 or not len(table):
+            return ranked
+        self.stats["lsh_queries"] += 1
+        ids, votes = self.lsh.vote(frames)
+        # голоса за удалённые строки и строки за пределами окна FULLSCAN_LIMIT не учитываем
+        keep = (votes >= DUPLICATE_VIDEO_LSH_MIN_VOTES) & np.isin(ids, table.ids) & ~np.isin(ids, ranked)
+        ids, votes = ids[keep], votes[keep]
+        self.stats["lsh_voted"] += int(ids.size)
+        if ids.size > DUPLICATE_VIDEO_LSH_TOPK:
+            ids = ids[np.lexsort((-ids, -votes))[:DUPLICATE_VIDEO_LSH_TOPK]]
+        self.stats["lsh_added"] += int(ids.size)
+        return np.concatenate([ranked, ids])
+
+    def format_stats(self) -> str:
+        stats = self.stats
+        queries = max(1, int(stats["queries"]))
+        lsh = f"{len(self.lsh)} ключей" if self.lsh is not None else "выключен"
+        return (
+            f"видео-индекс: {len(self)} отпечатков, готов={self.ready}\n"
+            f"предранжирование: {int(stats['queries'])} запросов, строк {int(stats['rows_scored'])}, "
+            f"avg {stats['latency_ms_total'] / queries:.2f} ms, max {stats['latency_ms_max']:.2f} ms\n"
+            f"LSH по кадрам: {lsh}, запросов {int(stats['lsh_queries'])}, "
+            f"проголосовало {int(stats['lsh_voted'])}, добавлено {int(stats['lsh_added'])}"
+        )
+
+video_candidate_index = VideoCandidateIndex()
+
+_video_candidate_cache: Dict[str, Any] = {"version": None, "table": None}
+
+async def get_video_candidate_table() -> Optional[VideoCandidateTable]:
+    """Newest DUPLICATE_VIDEO_FULLSCAN_LIMIT published videos; read from the resident index once it is loaded."""
+    if DUPLICATE_VIDEO_FULLSCAN_LIMIT <= 0:
+        return None
+    if video_candidate_index.ready:
+        return video_candidate_index.table.newest(DUPLICATE_VIDEO_FULLSCAN_LIMIT)
+    version = video_candidate_index.version
+    if _video_candidate_cache["version"] == version and _video_candidate_cache["table"] is not None:
+        return _video_candidate_cache["table"]
+    rows = await db.list_video_candidates(DUPLICATE_VIDEO_FULLSCAN_LIMIT)
+    table = VideoCandidateTable.from_rows(version, rows)
+    _video_candidate_cache["version"] = version
+    _video_candidate_cache["table"] = table
+    return table
 
 def _video_match_frames(
-    fp_frames: List[Dict[str, Any]],
-    row_frames: List[Dict[str, Any]],
+    fp_frames: Union[List[Dict[str, Any]], VideoFrames],
+    row_frames: Union[List[Dict[str, Any]], VideoFrames],
     duration_fp: Optional[int],
     duration_row: Optional[int],
     fp_kind: Optional[str] = None,
     row_kind: Optional[str] = None,
 ) -> Optional[Tuple[int, int, float, int, float, int]]:
-    if not fp_frames or not row_frames:
+    """Best time alignment as (matched, total, shift, bins, avg, worst).
+
+    Frame distances are computed once as a query×candidate matrix and time windows for all shifts as
+    one shift×query×candidate array; each shift then greedily takes, for each query frame in order, the
+    best-scoring unused candidate frame within the time tolerance.
+    """
+    query = fp_frames if isinstance(fp_frames, VideoFrames) else VideoFrames.from_frames(fp_frames or [])
+    cand = row_frames if isinstance(row_frames, VideoFrames) else VideoFrames.from_frames(row_frames or [])
+    if not query.count or not cand.count:
         return None
-    total = len(fp_frames)
+    total = query.count
     min_required = max(DUPLICATE_VIDEO_MATCH_MIN, int(math.ceil(total * DUPLICATE_VIDEO_MATCH_RATIO)))
     if total < DUPLICATE_VIDEO_MATCH_MIN:
         return None
     use_absolute = fp_kind == "album" or row_kind == "album"
-    q_frames = []
-    for frame in fp_frames:
-        t_ms = frame.get("t")
-        if t_ms is None:
-            continue
-        if use_absolute:
-            q_frames.append((float(t_ms) / 1000.0, frame))
-        else:
-            if not duration_fp:
-                return None
-            q_frames.append((float(t_ms) / float(duration_fp), frame))
-    c_frames = []
-    for frame in row_frames:
-        t_ms = frame.get("t")
-        if t_ms is None:
-            continue
-        if use_absolute:
-            c_frames.append((float(t_ms) / 1000.0, frame))
-        else:
-            if not duration_row:
-                return None
-            c_frames.append((float(t_ms) / float(duration_row), frame))
-    if not q_frames or not c_frames:
+    if not len(query) or not len(cand):
         return None
+    if not use_absolute and (not duration_fp or not duration_row):
+        return None
+    q_times = query.times / (1000.0 if use_absolute else float(duration_fp))
+    c_times = cand.times / (1000.0 if use_absolute else float(duration_row))
     if use_absolute:
         time_tol = DUPLICATE_VIDEO_TIME_TOLERANCE_SECONDS
     else:
@@ -4532,121 +6926,159 @@ def _video_match_frames(
         )
         time_tol = min(DUPLICATE_VIDEO_TIME_TOLERANCE, abs_rel)
     bins_count = max(1, DUPLICATE_VIDEO_TIME_BINS)
-    best = None
-    best_key = None
     shifts = DUPLICATE_VIDEO_TIME_SHIFTS_SECONDS if use_absolute else DUPLICATE_VIDEO_TIME_SHIFTS
     shifts = list(shifts or [0.0])
     if use_absolute:
-        for q_time, _q_frame in q_frames:
-            for c_time, _c_frame in c_frames:
+        for q_time in q_times.tolist():
+            for c_time in c_times.tolist():
                 shifts.append(c_time - q_time)
         shifts = sorted(set(shifts), key=lambda value: abs(value))
         if DUPLICATE_VIDEO_TIME_SHIFT_LIMIT > 0:
-            shifts = shifts[:DUPLICATE_VIDEO_TIME_SHIFT_LIMIT]
-    for shift in shifts:
-        used: set[int] = set()
-        matched = 0
-        bins: set[int] = set()
-        score_sum = 0.0
-        score_worst = 0
-        for q_time, q_frame in q_frames:
-            best_idx = None
-            best_pick = None
-            for idx, (c_time, c_frame) in enumerate(c_frames):
-                if idx in used:
-                    continue
-                diff = abs((q_time + shift) - c_time)
-                if diff > time_tol:
-                    continue
-                ok, _details, frame_score = _video_frame_match(q_frame, c_frame)
-                if not ok:
-                    continue
-                if frame_score is None:
-                    continue
-                pick_key = (frame_score, diff)
-                if best_pick is None or pick_key < best_pick:
-                    best_pick = pick_key
-                    best_idx = idx
-            if best_idx is not None:
-                used.add(best_idx)
-                matched += 1
-                best_frame_score = int(best_pick[0]) if best_pick is not None else 0
-                score_sum += best_frame_score
-                if best_frame_score > score_worst:
-                    score_worst = best_frame_score
-                if use_absolute and duration_fp:
-                    rel = q_time / max((duration_fp / 1000.0), 0.001)
-                    bin_idx = min(bins_count - 1, max(0, int(rel * bins_count)))
-                else:
-                    bin_idx = min(bins_count - 1, max(0, int(q_time * bins_count)))
-                bins.add(bin_idx)
-        ratio = matched / max(1, total)
-        if matched < min_required or ratio < DUPLICATE_VIDEO_MATCH_RATIO:
+            shifts = shifts[:DUPLICATE_VIDEO_TIME_SHIFT_LIMIT]
+
+    pair_ok, pair_score = _video_frame_match_matrix(query, cand)
+    if use_absolute and duration_fp:
+        q_rel = q_times / max((duration_fp / 1000.0), 0.001)
+    else:
+        q_rel = q_times
+    q_bins = [min(bins_count - 1, max(0, int(rel * bins_count))) for rel in q_rel.tolist()]
+    shift_values = np.array(shifts, dtype=np.float64)
+    diff = np.abs((q_times[None, :] + shift_values[:, None])[:, :, None] - c_times[None, None, :])
+    allowed = pair_ok[None, :, :] & (diff <= time_tol)
+    shift_idx, q_idx, c_idx = np.nonzero(allowed)
+    pair_scores = pair_score[q_idx, c_idx]
+    # допустимых пар мало: жадный выбор идёт по ним в порядке (сдвиг, кадр запроса, score, diff, кадр кандидата)
+    order = np.lexsort((c_idx, diff[shift_idx, q_idx, c_idx], pair_scores, q_idx, shift_idx))
+    matched = [0] * len(shifts)
+    score_sum = [0] * len(shifts)
+    score_worst = [0] * len(shifts)
+    bins: List[set[int]] = [set() for _ in shifts]
+    used: set[int] = set()
+    current_shift = -1
+    last_query = -1
+    for shift_pos, query_pos, cand_pos, frame_score in zip(
+        shift_idx[order].tolist(),
+        q_idx[order].tolist(),
+        c_idx[order].tolist(),
+        pair_scores[order].tolist(),
+    ):
+        if shift_pos != current_shift:
+            current_shift = shift_pos
+            last_query = -1
+            used = set()
+        if query_pos == last_query or cand_pos in used:
+            continue
+        last_query = query_pos
+        used.add(cand_pos)
+        matched[shift_pos] += 1
+        score_sum[shift_pos] += frame_score
+        score_worst[shift_pos] = max(score_worst[shift_pos], frame_score)
+        bins[shift_pos].add(q_bins[query_pos])
+
+    best = None
+    best_key = None
+    for idx, shift in enumerate(shifts):
+        shift_matched = matched[idx]
+        ratio = shift_matched / max(1, total)
+        if shift_matched < min_required or ratio < DUPLICATE_VIDEO_MATCH_RATIO:
             continue
-        if total >= 4 and len(bins) < 2:
+        if total >= 4 and len(bins[idx]) < 2:
             continue
-        if matched <= 0:
+        if shift_matched <= 0:
             continue
-        avg_score = score_sum / float(matched)
+        avg_score = score_sum[idx] / float(shift_matched)
         if avg_score > DUPLICATE_VIDEO_FRAME_AVG_DIST_MAX:
             continue
-        if score_worst > DUPLICATE_VIDEO_FRAME_MAX_DIST:
+        if score_worst[idx] > DUPLICATE_VIDEO_FRAME_MAX_DIST:
             continue
-        key = (matched, len(bins), -avg_score, -abs(shift))
+        key = (shift_matched, len(bins[idx]), -avg_score, -abs(shift))
         if best_key is None or key > best_key:
             best_key = key
-            best = (matched, total, float(shift), len(bins), float(avg_score), int(score_worst))
+            best = (shift_matched, total, float(shift), len(bins[idx]), float(avg_score), int(score_worst[idx]))
     return best
 
-async def _collect_matches_from_candidates(
+async def _tiered_matches_without_index(
     fp: Dict[str, Any],
-    candidates: List[aiosqlite.Row],
-    thresholds: Dict[str, int],
-    match_type: str,
+    tiers: List[HashTier],
+    file_size: Optional[int],
+    snapshot: Optional[ImageCandidateSnapshot],
 ) -> List[Dict[str, Any]]:
+    """Fallback while the hash index is not loaded: one size-window query serves every windowed tier."""
     matches: List[Dict[str, Any]] = []
-    for row in candidates:
-        dist_d = _hash_distance_hex(fp.get("dhash"), row["dhash"])
-        dist_p = _hash_distance_hex(fp.get("phash"), row["phash"])
-        dist_w = _hash_distance_hex(fp.get("whash"), row["whash"])
+    emitted: set[int] = set()
+    distances_by_id: Dict[int, Tuple[Optional[int], Optional[int], Optional[int]]] = {}
+
+    def take(row: Any, match_type: str, thresholds: Dict[str, int]):
+        row_id = int(row["id"])
+        if row_id in emitted:
+            return
+        if row_id not in distances_by_id:
+            distances_by_id[row_id] = _row_hash_distances(fp, row)
+        dist_d, dist_p, dist_w = distances_by_id[row_id]
         ok, score, details = _match_ensemble(
             {"d": dist_d, "p": dist_p, "w": dist_w},
             thresholds,
             DUPLICATE_SINGLE_HASH_THRESHOLD,
         )
-        if ok:
-            matches.append(
-                {
-                    "item_index": fp["item_index"],
-                    "match_type": match_type,
-                    "post_id": row["post_id"],
-                    "distance": score if score is not None else 0,
-                    "details": details,
-                }
-            )
+        if not ok:
+            return
+        emitted.add(row_id)
+        matches.append(
+            {
+                "item_index": fp["item_index"],
+                "match_type": match_type,
+                "post_id": row["post_id"],
+                "distance": score if score is not None else 0,
+                "details": details,
+            }
+        )
+
+    windowed = [tier for tier in tiers if tier[2] is not None]
+    rows: List[aiosqlite.Row] = []
+    if windowed and file_size is not None:
+        tolerance = max(int(tier[2]) for tier in windowed)
+        limit = max(int(tier[3]) for tier in windowed)
+        # окна симметричны вокруг размера, а выдача отсортирована по близости: узкое окно — префикс широкого
+        rows = await db.list_image_candidates_by_size(file_size, max(0, file_size - tolerance), file_size + tolerance, limit)
+    for match_type, thresholds, size_tolerance, limit in tiers:
+        if size_tolerance is not None:
+            for row in rows[: max(0, int(limit))]:
+                if abs(int(row["file_size"]) - file_size) > int(size_tolerance):
+                    break
+                take(row, match_type, thresholds)
+        elif snapshot is not None:
+            distances = snapshot.distances(fp)
+            ok, score = _match_ensemble_vectorized(distances, thresholds, DUPLICATE_SINGLE_HASH_THRESHOLD)
+            for pos in np.nonzero(ok)[0].tolist():
+                row_id = int(snapshot.ids[pos])
+                if row_id in emitted:
+                    continue
+                emitted.add(row_id)
+                matches.append(
+                    {
+                        "item_index": fp["item_index"],
+                        "match_type": match_type,
+                        "post_id": int(snapshot.post_ids[pos]),
+                        "distance": int(score[pos]),
+                        "details": _hash_details_from_distances(distances[pos]),
+                    }
+                )
+        else:
+            for row in await db.list_published_fingerprints(int(limit)):
+                take(row, match_type, thresholds)
     return matches
 
-async def _find_matches_for_fingerprint(
-    fp: Dict[str, Any],
-    *,
-    size_tolerance_bytes: int,
-    candidate_limit: int,
-    thresholds: Dict[str, int],
-    match_type: str,
+async def detect_duplicate_images_deep(
+    fingerprints: List[Dict[str, Any]],
+    snapshot: Optional[ImageCandidateSnapshot] = None,
 ) -> List[Dict[str, Any]]:
-    try:
-        file_size = int(fp["file_size"])
-    except Exception:
-        return []
-
-    min_size = max(0, file_size - int(size_tolerance_bytes))
-    max_size = file_size + int(size_tolerance_bytes)
-    candidates = await db.list_image_candidates_by_size(file_size, min_size, max_size, int(candidate_limit))
-    return await _collect_matches_from_candidates(fp, candidates, thresholds, match_type)
+    """Deep stage: perceptual hashes against the size windows and the whole archive.
 
-async def detect_duplicate_images_deep(fingerprints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Deep stage: size prefilter + perceptual dHash, with a slow fallback (wider window)."""
+    Every candidate is reported once, labelled by the tightest tier it satisfies
+    (hash_fast, hash_slow, hash_fullscan); matches keep the order the separate searches produced.
+    """
     matches: List[Dict[str, Any]] = []
+    tiers = _hash_match_tiers()
     for fp in fingerprints:
         file_unique_id = fp.get("file_unique_id")
         if file_unique_id:
@@ -4662,53 +7094,46 @@ async def detect_duplicate_images_deep(fingerprints: List[Dict[str, Any]]) -> Li
                     }
                 )
 
-        thresholds_fast = {"d": DUPLICATE_DHASH_THRESHOLD, "p": DUPLICATE_PHASH_THRESHOLD, "w": DUPLICATE_WHASH_THRESHOLD}
-        thresholds_slow = {
-            "d": DUPLICATE_DHASH_THRESHOLD_SLOW,
-            "p": DUPLICATE_PHASH_THRESHOLD_SLOW,
-            "w": DUPLICATE_WHASH_THRESHOLD_SLOW,
-        }
-
-        fast_matches = await _find_matches_for_fingerprint(
-            fp,
-            size_tolerance_bytes=DUPLICATE_SIZE_TOLERANCE_BYTES,
-            candidate_limit=DUPLICATE_SIZE_CANDIDATE_LIMIT,
-            thresholds=thresholds_fast,
-            match_type="hash_fast",
-        )
-        matches.extend(fast_matches)
-
-        slow_matches = await _find_matches_for_fingerprint(
-            fp,
-            size_tolerance_bytes=DUPLICATE_SIZE_TOLERANCE_BYTES_SLOW,
-            candidate_limit=DUPLICATE_SIZE_CANDIDATE_LIMIT_SLOW,
-            thresholds=thresholds_slow,
-            match_type="hash_slow",
-        )
-        matches.extend(slow_matches)
-
-        if DUPLICATE_FULLSCAN_LIMIT > 0:
-            candidates = await db.list_published_fingerprints(DUPLICATE_FULLSCAN_LIMIT)
-            matches.extend(await _collect_matches_from_candidates(fp, candidates, thresholds_slow, "hash_fullscan"))
+        try:
+            file_size: Optional[int] = int(fp["file_size"])
+        except Exception:
+            file_size = None
+        if image_hash_index.ready:
+            matches.extend(_tiered_matches_from_index(fp, tiers, file_size))
+        else:
+            matches.extend(await _tiered_matches_without_index(fp, tiers, file_size, snapshot))
 
     return matches
 
-async def detect_duplicate_videos_deep(fingerprints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Deep stage for video: compare frame hashes with time alignment."""
+async def detect_duplicate_videos_deep(
+    fingerprints: List[Dict[str, Any]],
+    exclude_post_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Deep stage for video: compare frame hashes with time alignment; exclude_post_id never becomes a candidate."""
     matches: List[Dict[str, Any]] = []
     if not fingerprints:
         return matches
-    candidates_pool: List[aiosqlite.Row] = []
-    if DUPLICATE_VIDEO_FULLSCAN_LIMIT > 0:
-        candidates_pool = await db.list_video_candidates(DUPLICATE_VIDEO_FULLSCAN_LIMIT)
-    if not candidates_pool:
+    table = await get_video_candidate_table()
+    if table is not None and exclude_post_id is not None:
+        table = table.without_post(exclude_post_id)
+    if table is None or not len(table):
         return matches
-    for fp in fingerprints:
-        fp_matches: List[Dict[str, Any]] = []
+    queries = [VideoFrames.from_frames(fp.get("frames") or []) for fp in fingerprints]
+    ranked = [
+        video_candidate_index.candidates(table, fp, query_frames)
+        for fp, query_frames in zip(fingerprints, queries)
+    ]
+    wanted = np.unique(np.concatenate(ranked)).tolist()
+    rows_by_id = {int(row["id"]): row for row in await db.list_video_fingerprints_by_ids(wanted)}
+    for fp, query_frames, fp_ids in zip(fingerprints, queries, ranked):
+        fp_matches: List[Tuple[Tuple[int, float, int], Dict[str, Any]]] = []
+        query_audio = _unpack_audio_hash(fp.get("audio_hash"))
         file_unique_id = fp.get("file_unique_id")
         if file_unique_id:
             rows = await db.list_videos_by_unique_id(str(file_unique_id))
             for row in rows:
+                if exclude_post_id is not None and int(row["post_id"]) == int(exclude_post_id):
+                    continue
                 matches.append(
                     {
                         "item_index": fp["item_index"],
@@ -4718,17 +7143,30 @@ async def detect_duplicate_videos_deep(fingerprints: List[Dict[str, Any]]) -> Li
                         "details": "точная копия",
                     }
                 )
-        scored: List[Tuple[float, aiosqlite.Row]] = []
-        for row in candidates_pool:
-            scored.append((_video_meta_score(fp, row), row))
-        scored.sort(key=lambda item: item[0])
-        if DUPLICATE_VIDEO_TOPK > 0:
-            scored = scored[:DUPLICATE_VIDEO_TOPK]
-        for _score, row in scored:
-            row_frames = _parse_video_frames(row["frame_hashes"])
+        candidates = [rows_by_id[int(fp_id)] for fp_id in fp_ids.tolist() if int(fp_id) in rows_by_id]
+        query_sorted = _audio_sort(query_audio) if query_audio is not None else None
+        audio_by_id = {
+            int(row["id"]): _video_audio_same_clip(
+                query_audio,
+                row["audio_hash"],
+                fp.get("duration_ms"),
+                row["duration_ms"],
+                query_sorted,
+            )
+            for row in candidates
+        }
+        # кандидатов с тем же звуком по всей длине сверяем первыми (лучший BER раньше): если совпавшие по кадрам
+        # и звуку заполнят лимит совпадений, остальных не выравниваем; сам по себе звук совпадением не считается
+        candidates.sort(key=lambda row: (audio_by_id[int(row["id"])] is None, audio_by_id[int(row["id"])] or 0.0))
+        audio_confirmed = 0
+        for row in candidates:
+            if 0 < DUPLICATE_VIDEO_MAX_MATCHES_PER_ITEM <= audio_confirmed:
+                break
+            audio_ber = audio_by_id[int(row["id"])]
+            fp_id = int(row["id"])
             match_info = _video_match_frames(
-                fp.get("frames") or [],
-                row_frames,
+                query_frames,
+                video_frames_cache.get(int(fp_id), row["frame_hashes"]),
                 fp.get("duration_ms"),
                 row["duration_ms"],
                 fp.get("kind"),
@@ -4736,6 +7174,8 @@ async def detect_duplicate_videos_deep(fingerprints: List[Dict[str, Any]]) -> Li
             )
             if not match_info:
                 continue
+            if audio_ber is not None:
+                audio_confirmed += 1
             matched, total, shift, bins, avg_score, worst_score = match_info
             ratio = matched / max(1, total)
             ratio_penalty = max(0, int(round((1.0 - ratio) * 70.0)))
@@ -4746,19 +7186,25 @@ async def detect_duplicate_videos_deep(fingerprints: List[Dict[str, Any]]) -> Li
                 details = f"{details},hm={worst_score}"
             if abs(shift) > 0.001:
                 details = f"{details},s={shift:.2f}"
+            if audio_ber is not None:
+                details = f"{details},a={audio_ber:.2f}"
             fp_matches.append(
-                {
-                    "item_index": fp["item_index"],
-                    "match_type": "video_deep",
-                    "post_id": row["post_id"],
-                    "distance": distance,
-                    "details": details,
-                }
+                (
+                    (distance, 1.0 if audio_ber is None else audio_ber, int(row["post_id"])),
+                    {
+                        "item_index": fp["item_index"],
+                        "match_type": "video_deep",
+                        "post_id": row["post_id"],
+                        "distance": distance,
+                        "details": details,
+                    },
+                )
             )
-        fp_matches.sort(key=lambda item: (int(item.get("distance", 0)), int(item.get("post_id", 0))))
+        # при равной дистанции по кадрам выше тот, у кого совпал звук
+        fp_matches.sort(key=lambda item: item[0])
         if DUPLICATE_VIDEO_MAX_MATCHES_PER_ITEM > 0:
             fp_matches = fp_matches[:DUPLICATE_VIDEO_MAX_MATCHES_PER_ITEM]
-        matches.extend(fp_matches)
+        matches.extend(match for _, match in fp_matches)
     return matches
 
 def _draft_content_from_media_json(media_json: str) -> Optional[DraftContent]:
@@ -4776,8 +7222,8 @@ def _draft_content_from_media_json(media_json: str) -> Optional[DraftContent]:
 
 async def _get_orb_features_for_post(
     post_id: int,
-    cache: Dict[int, List[Tuple[List[Any], np.ndarray]]],
-) -> List[Tuple[List[Any], np.ndarray]]:
+    cache: Dict[int, List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]],
+) -> List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
     cached = cache.get(post_id)
     if cached is not None:
         return cached
@@ -4789,37 +7235,45 @@ async def _get_orb_features_for_post(
     if not content:
         cache[post_id] = []
         return []
-    feats: List[Tuple[List[Any], np.ndarray]] = []
-    for item in content.items:
+    feats: List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]] = []
+    for idx, item in enumerate(content.items):
         if not _is_image_item(item):
             continue
-        file_id = item.get("file_id") or item.get("hash_file_id")
-        if not file_id:
-            continue
-        buf = io.BytesIO()
-        try:
-            await bot.download(file_id, destination=buf)
-        except Exception:
-            continue
-        raw = buf.getvalue()
-        if not raw:
-            continue
-        img_info = _load_image_gray(raw, 0.0)
-        if not img_info:
-            continue
-        img_gray, _w, _h = img_info
-        features = _orb_features_from_gray(img_gray)
-        if features:
-            feats.append(features)
+        item_index = int(item.get("item_index") if item.get("item_index") is not None else idx)
+        cache_key = (int(post_id), item_index, "orb", DUPLICATE_ORB_FEATURE_VERSION)
+        features = feature_cache.get(cache_key)
+        if features is None:
+            features = _deserialize_orb_features(
+                await db.get_image_feature_cache(post_id, item_index, "orb", DUPLICATE_ORB_FEATURE_VERSION)
+            )
+            if features:
+                feature_cache.put(cache_key, features)
+        if features is None:
+            # в кеше БД нет — качаем один раз и сохраняем, дальше только локальный матчинг
+            file_id = item.get("file_id") or item.get("hash_file_id")
+            if not file_id:
+                continue
+            raw = await _download_duplicate_image_bytes(str(file_id), _item_unique_id(item, file_id))
+            if not raw:
+                continue
+            features = await mnemosyne_workers.run(_orb_features_job, DecodedImage(raw))
+            if not features:
+                continue
+            try:
+                if await _store_feature_cache(post_id, item_index, "orb", features):
+                    feature_cache.put(cache_key, features)
+            except Exception as e:
+                logger.debug("Failed to cache orb features for post %s: %s", post_id, e)
+        feats.append(features)
     cache[post_id] = feats
     return feats
 
 async def _get_sift_features_for_post(
     post_id: int,
-    cache: Dict[int, List[Tuple[List[Any], np.ndarray, Tuple[int, int]]]],
+    cache: Dict[int, List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]],
     *,
     asift: bool = False,
-) -> List[Tuple[List[Any], np.ndarray, Tuple[int, int]]]:
+) -> List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
     cached = cache.get(post_id)
     if cached is not None:
         return cached
@@ -4831,33 +7285,34 @@ async def _get_sift_features_for_post(
     if not content:
         cache[post_id] = []
         return []
-    feats: List[Tuple[List[Any], np.ndarray, Tuple[int, int]]] = []
+    feats: List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]] = []
     for idx, item in enumerate(content.items):
         if not _is_image_item(item):
             continue
         item_index = int(item.get("item_index") if item.get("item_index") is not None else idx)
         algo = "asift" if asift else "sift"
-        cached_row = await db.get_image_feature_cache(
-            post_id,
-            item_index,
-            algo,
-            DUPLICATE_SIFT_FEATURE_VERSION,
-        )
-        cached_features = _deserialize_sift_features(cached_row)
+        cache_key = (int(post_id), item_index, algo, DUPLICATE_SIFT_FEATURE_VERSION)
+        cached_features = feature_cache.get(cache_key)
+        if cached_features is None:
+            cached_row = await db.get_image_feature_cache(
+                post_id,
+                item_index,
+                algo,
+                DUPLICATE_SIFT_FEATURE_VERSION,
+            )
+            cached_features = _deserialize_sift_features(cached_row)
+            if cached_features:
+                feature_cache.put(cache_key, cached_features)
         if cached_features:
             feats.append(cached_features)
             continue
         file_id = item.get("file_id") or item.get("hash_file_id")
         if not file_id:
             continue
-        raw = await _download_duplicate_image_bytes(str(file_id))
+        raw = await _download_duplicate_image_bytes(str(file_id), _item_unique_id(item, file_id))
         if not raw:
             continue
-        img_info = _load_image_gray(raw, 0.0)
-        if not img_info:
-            continue
-        img_gray, _w, _h = img_info
-        features = _asift_features_from_gray(img_gray) if asift else _sift_features_from_gray(img_gray)
+        features = await _extract_sift_features(DecodedImage(raw), asift=asift)
         if features:
             feats.append(features)
             serialized = _serialize_sift_features(features)
@@ -4874,6 +7329,7 @@ async def _get_sift_features_for_post(
                         keypoints_json,
                         descriptors,
                     )
+                    feature_cache.put(cache_key, features)
                 except Exception as e:
                     logger.debug("Failed to cache %s features for post %s: %s", algo, post_id, e)
     cache[post_id] = feats
@@ -4881,41 +7337,53 @@ async def _get_sift_features_for_post(
 
 def _rank_geometry_candidates(
     fp: Dict[str, Any],
-    candidates_pool: List[aiosqlite.Row],
+    snapshot: ImageCandidateSnapshot,
 ) -> List[Tuple[int, int, Optional[str]]]:
-    scored_hash: List[Tuple[int, int]] = []
-    scored_size: List[Tuple[float, int]] = []
-    details_by_post: Dict[int, Optional[str]] = {}
-    score_by_post: Dict[int, int] = {}
-    for row in candidates_pool:
-        _d, _p, _w, details, score = _hash_distance_details(fp, row)
-        post_id = int(row["post_id"])
-        if score is not None:
-            prev = score_by_post.get(post_id)
-            if prev is None or score < prev:
-                details_by_post[post_id] = details
-                score_by_post[post_id] = score
-            scored_hash.append((score, post_id))
-        size_score = _size_similarity_score(fp, row)
-        if size_score is not None:
-            scored_size.append((size_score, post_id))
-    scored_hash.sort(key=lambda item: (item[0], item[1]))
-    scored_size.sort(key=lambda item: (item[0], item[1]))
+    distances = snapshot.distances(fp)
+    available = distances >= 0
+    has_score = available.any(axis=1)
+    scores = np.where(available, distances, np.iinfo(np.int16).max).min(axis=1).astype(np.int64)
+    post_ids = snapshot.post_ids
     selected: List[Tuple[int, int, Optional[str]]] = []
     seen: set[int] = set()
-    for score, post_id in scored_hash[: max(0, DUPLICATE_SIFT_TOPK)]:
-        if post_id in seen:
-            continue
-        seen.add(post_id)
-        selected.append((score, post_id, details_by_post.get(post_id)))
-    for size_score, post_id in scored_size[: max(0, DUPLICATE_SIFT_TOPK_SIZE)]:
-        if post_id in seen:
-            continue
-        seen.add(post_id)
-        score = score_by_post.get(post_id)
-        if score is None:
-            score = 1000 + int(round(size_score * 100.0))
-        selected.append((score, post_id, details_by_post.get(post_id)))
+    score_by_post: Dict[int, int] = {}
+    details_by_post: Dict[int, Optional[str]] = {}
+
+    def post_best(post_id: int) -> Optional[Tuple[int, Optional[str]]]:
+        # минимальный скор поста; при равенстве берётся первая строка снимка (самая новая)
+        if post_id not in score_by_post:
+            rows = np.nonzero((post_ids == post_id) & has_score)[0]
+            if not rows.size:
+                return None
+            best = rows[np.argmin(scores[rows])]
+            score_by_post[post_id] = int(scores[best])
+            details_by_post[post_id] = _hash_details_from_distances(distances[best])
+        return score_by_post[post_id], details_by_post[post_id]
+
+    hash_rows = np.nonzero(has_score)[0]
+    if hash_rows.size and DUPLICATE_SIFT_TOPK > 0:
+        order = hash_rows[np.lexsort((post_ids[hash_rows], scores[hash_rows]))][:DUPLICATE_SIFT_TOPK]
+        for pos in order:
+            post_id = int(post_ids[pos])
+            if post_id in seen:
+                continue
+            seen.add(post_id)
+            best = post_best(post_id)
+            selected.append((int(scores[pos]), post_id, best[1] if best else None))
+    size_scores = snapshot.size_scores(fp)
+    size_rows = np.nonzero(~np.isnan(size_scores))[0]
+    if size_rows.size and DUPLICATE_SIFT_TOPK_SIZE > 0:
+        order = size_rows[np.lexsort((post_ids[size_rows], size_scores[size_rows]))][:DUPLICATE_SIFT_TOPK_SIZE]
+        for pos in order:
+            post_id = int(post_ids[pos])
+            if post_id in seen:
+                continue
+            seen.add(post_id)
+            best = post_best(post_id)
+            if best is None:
+                selected.append((1000 + int(round(float(size_scores[pos]) * 100.0)), post_id, None))
+            else:
+                selected.append((best[0], post_id, best[1]))
     return selected
 
 def _geometry_detail_part(kind: str, metrics: Dict[str, Any]) -> str:
@@ -4936,43 +7404,13 @@ def _geometry_distance(metrics: Dict[str, Any], hash_score: int) -> int:
     hash_part = min(max(hash_score, 0), 64) // 8
     return max(0, rmse_part + ratio_part + coverage_part + hash_part)
 
-def _best_sift_metrics(
-    query_features: Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]],
-    candidate_features: List[Tuple[List[Any], np.ndarray, Tuple[int, int]]],
-) -> Optional[Dict[str, Any]]:
-    if not query_features or not candidate_features:
-        return None
-    best: Optional[Dict[str, Any]] = None
-    for cand_features in candidate_features:
-        metrics = _sift_match_metrics(query_features, cand_features)
-        if metrics is None:
-            continue
-        if best is None:
-            best = metrics
-            continue
-        best_key = (
-            int(best["inliers"]),
-            float(best["inlier_ratio"]),
-            max(float(best["coverage_a"]), float(best["coverage_b"])),
-            -float(best["rmse"]),
-        )
-        metrics_key = (
-            int(metrics["inliers"]),
-            float(metrics["inlier_ratio"]),
-            max(float(metrics["coverage_a"]), float(metrics["coverage_b"])),
-            -float(metrics["rmse"]),
-        )
-        if metrics_key > best_key:
-            best = metrics
-    return best
-
 async def _store_feature_cache(
     post_id: int,
     item_index: int,
     algo: str,
-    features: Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]],
+    features: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]],
 ) -> bool:
-    serialized = _serialize_sift_features(features)
+    serialized = _serialize_orb_features(features) if algo == "orb" else _serialize_sift_features(features)
     if not serialized:
         return False
     keypoints_json, descriptors, width, height = serialized
@@ -4980,7 +7418,7 @@ async def _store_feature_cache(
         post_id,
         item_index,
         algo,
-        DUPLICATE_SIFT_FEATURE_VERSION,
+        _feature_cache_version(algo),
         width,
         height,
         keypoints_json,
@@ -4988,11 +7426,19 @@ async def _store_feature_cache(
     )
     return True
 
+async def _extract_cache_features(
+    image: DecodedImage,
+    algo: str,
+) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    if algo == "orb":
+        return await mnemosyne_workers.run(_orb_features_job, image.job_view(DUPLICATE_ORB_MAX_DIM))
+    return await _extract_sift_features(image, asift=algo == "asift")
+
 async def _cache_features_for_content(
     post_id: int,
     content: DraftContent,
     *,
-    include_asift: bool = False,
+    algos: Tuple[str, ...] = ("sift",),
     force: bool = False,
 ) -> Tuple[int, int, int]:
     cached = 0
@@ -5003,118 +7449,169 @@ async def _cache_features_for_content(
             skipped += 1
             continue
         item_index = int(item.get("item_index") if item.get("item_index") is not None else idx)
-        existing_sift = None
-        existing_asift = None
+        missing = list(algos)
         if not force:
-            existing_sift = await db.get_image_feature_cache(
-                post_id,
-                item_index,
-                "sift",
-                DUPLICATE_SIFT_FEATURE_VERSION,
-            )
-            if include_asift:
-                existing_asift = await db.get_image_feature_cache(
-                    post_id,
-                    item_index,
-                    "asift",
-                    DUPLICATE_SIFT_FEATURE_VERSION,
-                )
-            if existing_sift and (not include_asift or existing_asift):
+            missing = [
+                algo
+                for algo in algos
+                if not await db.get_image_feature_cache(post_id, item_index, algo, _feature_cache_version(algo))
+            ]
+            if not missing:
                 skipped += 1
                 continue
         file_id = item.get("file_id") or item.get("hash_file_id")
         if not file_id:
             skipped += 1
             continue
-        raw = await _download_duplicate_image_bytes(str(file_id))
+        raw = await _download_duplicate_image_bytes(str(file_id), _item_unique_id(item, file_id))
         if not raw:
             errors += 1
             continue
-        img_info = _load_image_gray(raw, 0.0)
-        if not img_info:
-            errors += 1
-            continue
-        img_gray, _w, _h = img_info
+        image = DecodedImage(raw)
         try:
-            if not existing_sift and await _store_feature_cache(post_id, item_index, "sift", _sift_features_from_gray(img_gray)):
-                cached += 1
-            elif not existing_sift:
-                skipped += 1
-            if include_asift and not existing_asift:
-                if await _store_feature_cache(post_id, item_index, "asift", _asift_features_from_gray(img_gray)):
+            for algo in missing:
+                if await _store_feature_cache(post_id, item_index, algo, await _extract_cache_features(image, algo)):
                     cached += 1
+                elif algo == missing[0]:
+                    skipped += 1
         except Exception as e:
             errors += 1
             logger.debug("Feature cache failed for post %s item %s: %s", post_id, item_index, e)
     return cached, skipped, errors
 
+async def _verify_sift_candidates(
+    query_sift: Tuple[np.ndarray, np.ndarray, Tuple[int, int]],
+    selected: List[Tuple[int, int, Optional[str]]],
+    sift_cache: Dict[int, List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]],
+    deadline: Optional[float],
+) -> List[Optional[Dict[str, Any]]]:
+    """SIFT metrics for a prefix of the ranked candidates (None = no match or not ready in time).
+
+    Candidate features are fetched concurrently, up to DUPLICATE_GEOMETRY_CONCURRENCY at a time, until
+    all arrive or the shared deadline passes; pending fetches are cancelled then. Everything that arrived
+    is matched in one batch, so the KD-tree is built once per check. The returned list ends at the last
+    rank that arrived, or at the one where DUPLICATE_GEOMETRY_MAX_MATCHES_PER_ITEM candidates have passed.
+    """
+    slots = asyncio.Semaphore(max(1, DUPLICATE_GEOMETRY_CONCURRENCY))
+
+    async def fetch(post_id: int) -> List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+        async with slots:
+            return await _get_sift_features_for_post(post_id, sift_cache, asift=False)
+
+    tasks = [asyncio.ensure_future(fetch(post_id)) for _, post_id, _ in selected]
+    try:
+        if tasks:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait(tasks, timeout=timeout)
+        # не дождавшиеся дедлайна кандидаты идут пустыми
+        arrived = [rank for rank, task in enumerate(tasks) if task.done()]
+        cand_sifts = [task.result() if task.done() else [] for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if not arrived:
+        return []
+    results = await mnemosyne_workers.run(_batched_sift_metrics, query_sift, cand_sifts[: arrived[-1] + 1])
+    if DUPLICATE_GEOMETRY_MAX_MATCHES_PER_ITEM > 0:
+        passed = 0
+        for rank, metrics in enumerate(results):
+            passed += metrics is not None
+            if passed >= DUPLICATE_GEOMETRY_MAX_MATCHES_PER_ITEM:
+                return results[: rank + 1]
+    return results
+
 async def annotate_matches_with_geometry(
     fingerprints: List[Dict[str, Any]],
     matches: List[Dict[str, Any]],
+    snapshot: Optional[ImageCandidateSnapshot] = None,
+    *,
+    kinds: Tuple[str, ...] = ("sift", "asift"),
+    timeout: Optional[float] = None,
+    skip_items: Optional[set[int]] = None,
 ) -> List[Dict[str, Any]]:
+    """Verify hash candidates with SIFT and, for the top ranks SIFT rejected, ASIFT.
+
+    kinds limits the pass to one of them (the staged pipeline runs SIFT and ASIFT as separate stages);
+    items in skip_items are already settled and are not verified again.
+    """
     if not DUPLICATE_GEOMETRY_ENABLED or DUPLICATE_SIFT_TOPK <= 0:
         return matches
     if not fingerprints:
         return matches
-    candidates_pool: List[aiosqlite.Row] = []
-    if DUPLICATE_FULLSCAN_LIMIT > 0:
-        candidates_pool = await db.list_published_fingerprints(DUPLICATE_FULLSCAN_LIMIT)
-    if not candidates_pool:
+    if snapshot is None:
+        snapshot = await get_image_candidate_snapshot()
+    if snapshot is None or not len(snapshot):
         return matches
-    deadline = (
-        time.monotonic() + DUPLICATE_GEOMETRY_TIMEOUT_SECONDS
-        if DUPLICATE_GEOMETRY_TIMEOUT_SECONDS > 0
-        else None
-    )
+    if timeout is None:
+        timeout = DUPLICATE_GEOMETRY_TIMEOUT_SECONDS
+    deadline = time.monotonic() + timeout if timeout > 0 else None
     fp_by_idx = {fp["item_index"]: fp for fp in fingerprints}
     exact_items = {
         int(m.get("item_index", -1))
         for m in matches
-        if m.get("match_type") == "unique_id"
+        if m.get("match_type") in {"unique_id", "byte_hash"}
     }
-    sift_cache: Dict[int, List[Tuple[List[Any], np.ndarray, Tuple[int, int]]]] = {}
-    asift_cache: Dict[int, List[Tuple[List[Any], np.ndarray, Tuple[int, int]]]] = {}
+    if skip_items:
+        exact_items |= skip_items
+    sift_cache: Dict[int, List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]] = {}
+    asift_cache: Dict[int, List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]] = {}
     for item_idx, fp in fp_by_idx.items():
         if deadline is not None and time.monotonic() >= deadline:
             break
         if int(item_idx) in exact_items:
             continue
-        selected = _rank_geometry_candidates(fp, candidates_pool)
+        selected = _rank_geometry_candidates(fp, snapshot)
         if not selected:
             continue
-        query_sift = fp.get("sift_features")
-        if query_sift is None:
-            img_gray = fp.get("image_gray")
-            if img_gray is not None:
-                query_sift = _sift_features_from_gray(img_gray)
-                if query_sift is not None:
-                    fp["sift_features"] = query_sift
-        if query_sift is None:
-            continue
-        query_asift: Optional[Tuple[List[Any], np.ndarray, Tuple[int, int]]] = None
+        if "sift" in kinds:
+            query_sift = fp.get("sift_features")
+            if query_sift is None:
+                image = await _fingerprint_image(fp)
+                if image is not None:
+                    query_sift = await _extract_sift_features(image)
+                    if query_sift is not None:
+                        fp["sift_features"] = query_sift
+            if query_sift is None:
+                continue
+            sift_metrics = await _verify_sift_candidates(query_sift, selected, sift_cache, deadline)
+            selected = selected[: len(sift_metrics)]
+        else:
+            selected = selected[: max(0, DUPLICATE_ASIFT_TOPK)]
+            sift_metrics = [None] * len(selected)
+        query_asift: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]] = None
+        asift_metrics: Dict[int, Optional[Dict[str, Any]]] = {}
+
+        def wants_asift(rank: int) -> bool:
+            return (
+                sift_metrics[rank] is None
+                and "asift" in kinds
+                and DUPLICATE_ASIFT_ENABLED
+                and rank < max(0, DUPLICATE_ASIFT_TOPK)
+                and selected[rank][0] <= DUPLICATE_ASIFT_MAX_HASH_SCORE
+            )
+
         verified_count = 0
         for rank, (hash_score, post_id, hash_details) in enumerate(selected):
             if deadline is not None and time.monotonic() >= deadline:
                 break
             best_kind = "sift_geometry"
-            best_metrics: Optional[Dict[str, Any]] = None
-            cand_sifts = await _get_sift_features_for_post(post_id, sift_cache, asift=False)
-            best_metrics = _best_sift_metrics(query_sift, cand_sifts)
-            if (
-                best_metrics is None
-                and DUPLICATE_ASIFT_ENABLED
-                and rank < max(0, DUPLICATE_ASIFT_TOPK)
-                and hash_score <= DUPLICATE_ASIFT_MAX_HASH_SCORE
-            ):
-                if query_asift is None:
-                    img_gray = fp.get("image_gray")
-                    if img_gray is not None:
-                        query_asift = _asift_features_from_gray(img_gray)
-                cand_asifts = await _get_sift_features_for_post(post_id, asift_cache, asift=True)
-                asift_metrics = _best_sift_metrics(query_asift, cand_asifts)
-                if asift_metrics is not None:
+            best_metrics = sift_metrics[rank]
+            if wants_asift(rank):
+                if rank not in asift_metrics:
+                    if query_asift is None:
+                        image = await _fingerprint_image(fp)
+                        if image is not None:
+                            query_asift = await _extract_sift_features(image, asift=True)
+                    ranks = [r for r in range(rank, len(selected)) if wants_asift(r)]
+                    cand_asifts = [
+                        await _get_sift_features_for_post(selected[r][1], asift_cache, asift=True) for r in ranks
+                    ]
+                    batch = await mnemosyne_workers.run(_batched_sift_metrics, query_asift, cand_asifts)
+                    asift_metrics.update(zip(ranks, batch))
+                if asift_metrics.get(rank) is not None:
                     best_kind = "asift_geometry"
-                    best_metrics = asift_metrics
+                    best_metrics = asift_metrics[rank]
             if best_metrics is None:
                 continue
             verified_count += 1
@@ -5127,7 +7624,7 @@ async def annotate_matches_with_geometry(
                     continue
                 if int(m.get("post_id", -1)) != post_id:
                     continue
-                if m.get("match_type") == "unique_id":
+                if m.get("match_type") in {"unique_id", "byte_hash"}:
                     updated = True
                     break
                 m["match_type"] = best_kind
@@ -5165,66 +7662,81 @@ async def annotate_matches_with_geometry(
 async def annotate_matches_with_orb(
     fingerprints: List[Dict[str, Any]],
     matches: List[Dict[str, Any]],
+    snapshot: Optional[ImageCandidateSnapshot] = None,
+    *,
+    timeout: Optional[float] = None,
 ) -> List[Dict[str, Any]]:
+    """ORB with rotated/cropped query variants against hash and size neighbours; the last, cheapest-to-skip stage."""
     if DUPLICATE_ORB_TOPK <= 0:
         return matches
     if not fingerprints:
         return matches
-    candidates_pool: List[aiosqlite.Row] = []
-    if DUPLICATE_FULLSCAN_LIMIT > 0:
-        candidates_pool = await db.list_published_fingerprints(DUPLICATE_FULLSCAN_LIMIT)
+    if snapshot is None:
+        snapshot = await get_image_candidate_snapshot()
+    if snapshot is None:
+        return matches
+    deadline = time.monotonic() + timeout if timeout is not None and timeout > 0 else None
     fp_by_idx = {fp["item_index"]: fp for fp in fingerprints}
-    cache: Dict[int, List[Tuple[List[Any], np.ndarray]]] = {}
+    cache: Dict[int, List[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]] = {}
     for item_idx, fp in fp_by_idx.items():
+        if deadline is not None and time.monotonic() >= deadline:
+            break
         orb_variants = fp.get("orb_variants")
         if not orb_variants:
             orb_kps = fp.get("orb_kps")
             orb_desc = fp.get("orb_desc")
             if orb_desc is not None and orb_kps:
                 orb_variants = [(orb_kps, orb_desc)]
+        if not orb_variants:
+            image = await _fingerprint_image(fp)
+            if image is not None:
+                orb_variants = await mnemosyne_workers.run(
+                    _orb_variants_job, image.job_view(DUPLICATE_ORB_MAX_DIM)
+                )
+                if orb_variants:
+                    fp["orb_variants"] = orb_variants
         if not orb_variants:
             continue
-        scored: List[Tuple[int, int]] = []
-        scored_size: List[Tuple[float, int]] = []
-        details_by_post: Dict[int, Optional[str]] = {}
-        score_by_post: Dict[int, int] = {}
-        for row in candidates_pool:
-            _d, _p, _w, details, score = _hash_distance_details(fp, row)
-            if score is None:
-                continue
-            post_id = int(row["post_id"])
-            details_by_post[post_id] = details
-            score_by_post[post_id] = score
-            scored.append((score, post_id))
-            size_score = _size_similarity_score(fp, row)
-            if size_score is not None:
-                scored_size.append((size_score, post_id))
-        if not scored:
+        distances = snapshot.distances(fp)
+        available = distances >= 0
+        scored_rows = np.nonzero(available.any(axis=1))[0]
+        if not scored_rows.size:
             continue
-        scored.sort(key=lambda item: (item[0], item[1]))
-        scored_size.sort(key=lambda item: (item[0], item[1]))
+        scores = np.where(available, distances, np.iinfo(np.int16).max).min(axis=1).astype(np.int64)
+        post_ids = snapshot.post_ids
+
+        def last_row(post_id: int) -> int:
+            # как раньше: для поста берутся скор и детали последней строки в порядке снимка
+            return int(scored_rows[post_ids[scored_rows] == post_id][-1])
+
         selected: List[Tuple[int, int, Optional[str]]] = []
         seen: set[int] = set()
-        for score, post_id in scored[:DUPLICATE_ORB_TOPK]:
+        order = scored_rows[np.lexsort((post_ids[scored_rows], scores[scored_rows]))][:DUPLICATE_ORB_TOPK]
+        for pos in order:
+            post_id = int(post_ids[pos])
             if post_id in seen:
                 continue
             seen.add(post_id)
-            selected.append((score, post_id, details_by_post.get(post_id)))
-        for _s, post_id in scored_size[:DUPLICATE_ORB_TOPK_SIZE]:
+            selected.append((int(scores[pos]), post_id, _hash_details_from_distances(distances[last_row(post_id)])))
+        size_scores = snapshot.size_scores(fp)[scored_rows]
+        size_rows = scored_rows[~np.isnan(size_scores)]
+        size_scores = size_scores[~np.isnan(size_scores)]
+        for pos in size_rows[np.lexsort((post_ids[size_rows], size_scores))][:DUPLICATE_ORB_TOPK_SIZE]:
+            post_id = int(post_ids[pos])
             if post_id in seen:
                 continue
             seen.add(post_id)
-            score = score_by_post.get(post_id)
-            if score is None:
-                continue
-            selected.append((score, post_id, details_by_post.get(post_id)))
+            last = last_row(post_id)
+            selected.append((int(scores[last]), post_id, _hash_details_from_distances(distances[last])))
         for score, post_id, details in selected:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
             cand_feats = await _get_orb_features_for_post(post_id, cache)
             if not cand_feats:
                 continue
             best = None
             best_key = None
-            for cand_kps, cand_desc in cand_feats:
+            for cand_kps, cand_desc, _ in cand_feats:
                 for var_kps, var_desc in orb_variants:
                     result = _orb_match_metrics(var_kps, var_desc, cand_kps, cand_desc)
                     if result is None:
@@ -5294,39 +7806,256 @@ async def annotate_matches_with_orb(
             )
     return matches
 
-async def compute_duplicate_result_deep_images(
+DUPLICATE_STAGES = ("unique_id", "hash", "video", "sift", "asift", "orb")
+DUPLICATE_STAGE_LABELS = {
+    "unique_id": "проверяю точные совпадения",
+    "hash": "сравниваю с опубликованными постами",
+    "video": "сверяю кадры и звук видео",
+    "sift": "перепроверяю самые похожие варианты",
+    "asift": "проверяю сильно искажённые варианты",
+    "orb": "ищу повёрнутые и обрезанные копии",
+}
+
+@dataclass
+class DuplicateScanUpdate:
+    stage: str
+    skipped: bool
+    image_fps: List[Dict[str, Any]]
+    video_fps: List[Dict[str, Any]]
+    matches: List[Dict[str, Any]]
+
+def _settled_items(matches: List[Dict[str, Any]]) -> set[int]:
+    # элементы, для которых уже есть уверенное совпадение: дорогие стадии их пропускают
+    settled: set[int] = set()
+    for m in matches:
+        match_type = str(m.get("match_type") or "")
+        if match_type in {"unique_id", "byte_hash", "sift_geometry", "asift_geometry"} or match_type.startswith("video"):
+            settled.add(int(m.get("item_index", -1)))
+    return settled
+
+async def _run_duplicate_stage(stage: str, coro: Any, budget: float, fallback: Any) -> Any:
+    try:
+        if budget > 0:
+            return await asyncio.wait_for(coro, timeout=budget)
+        return await coro
+    except asyncio.TimeoutError:
+        logger.warning("Duplicate stage %s ran out of its %.0fs budget", stage, budget)
+        return fallback
+
+async def iter_duplicate_stages(
     content: DraftContent,
-) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    fingerprints = await compute_image_fingerprints(content)
-    matches = await detect_duplicate_images_deep(fingerprints)
-    if fingerprints:
+    fast_matches: Optional[List[Dict[str, Any]]] = None,
+    exclude_post_id: Optional[int] = None,
+) -> AsyncIterator[DuplicateScanUpdate]:
+    """Mnemosyne check as stages (see DUPLICATE_STAGES), yielding the accumulated result after each one.
+
+    Each stage has its own time budget. SIFT, ASIFT and ORB skip items that already have an exact, video or
+    geometry match, so a confident hit ends the expensive part early. fast_matches are results of the
+    unique_id stage the caller already ran. exclude_post_id (a post re-checked while its own fingerprints
+    are still indexed) is dropped from every stage's matches and candidates.
+    """
+    image_fps: List[Dict[str, Any]] = []
+    video_fps: List[Dict[str, Any]] = []
+    exact_matches: List[Dict[str, Any]] = []
+    image_matches: List[Dict[str, Any]] = []
+    video_matches: List[Dict[str, Any]] = []
+    has_images = content_has_images(content)
+    has_videos = content_has_videos(content)
+    snapshot: Optional[ImageCandidateSnapshot] = None
+
+    def update(stage: str, skipped: bool = False) -> DuplicateScanUpdate:
+        matches = exact_matches + filter_duplicate_matches(image_matches) + video_matches
+        return DuplicateScanUpdate(stage, skipped, image_fps, video_fps, matches)
+
+    def foreign(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # совпадение поста с самим собой иначе закрыло бы элемент для видео и геометрии
+        if exclude_post_id is None:
+            return matches
+        return [m for m in matches if int(m.get("post_id", -1)) != int(exclude_post_id)]
+
+    if fast_matches is None:
+        try:
+            if has_images:
+                exact_matches.extend(foreign(await detect_duplicate_images_fast(content)))
+            if has_videos:
+                exact_matches.extend(foreign(await detect_duplicate_videos_fast(content)))
+        except Exception as e:
+            logger.warning("Fast duplicate check failed: %s", e)
+    else:
+        exact_matches.extend(foreign(fast_matches))
+    yield update("unique_id")
+
+    if has_images:
+        # один снимок кандидатов на всю проверку, общий для хешей и геометрии
+        snapshot = await get_image_candidate_snapshot()
+        if snapshot is not None and exclude_post_id is not None:
+            snapshot = snapshot.without_post(exclude_post_id)
+
+        # отпечатки сохраняются вместе с постом, поэтому бюджет стадии ограничивает только сверку:
+        # истёкший бюджет не должен оставить опубликованный пост без отпечатков
+        image_fps = await compute_image_fingerprints(content)
+
+        async def hash_stage() -> List[Dict[str, Any]]:
+            exact_matches.extend(foreign(await detect_duplicate_bytes(image_fps)))
+            return foreign(await detect_duplicate_images_deep(image_fps, snapshot))
+
+        image_matches = await _run_duplicate_stage("hash", hash_stage(), DUPLICATE_STAGE_HASH_SECONDS, [])
+    yield update("hash", skipped=not has_images)
+
+    if has_videos:
+        video_fps = await compute_video_fingerprints(content)
+
+        async def video_stage() -> List[Dict[str, Any]]:
+            exact_matches.extend(foreign(await detect_duplicate_bytes(video_fps, video=True)))
+            settled = _settled_items(exact_matches)
+            pending = [fp for fp in video_fps if fp["item_index"] not in settled]
+            return await detect_duplicate_videos_deep(pending, exclude_post_id)
+
+        video_matches = await _run_duplicate_stage("video", video_stage(), DUPLICATE_STAGE_VIDEO_SECONDS, [])
+    yield update("video", skipped=not has_videos)
+
+    for stage, timeout in (
+        ("sift", DUPLICATE_GEOMETRY_TIMEOUT_SECONDS),
+        ("asift", DUPLICATE_STAGE_ASIFT_SECONDS),
+        ("orb", DUPLICATE_STAGE_ORB_SECONDS),
+    ):
+        settled = _settled_items(exact_matches + image_matches)
+        pending = [fp for fp in image_fps if fp["item_index"] not in settled]
+        if not pending or (stage == "orb" and DUPLICATE_ORB_TOPK <= 0):
+            yield update(stage, skipped=True)
+            continue
         try:
-            matches = await annotate_matches_with_geometry(fingerprints, matches)
+            if stage == "orb":
+                image_matches = await annotate_matches_with_orb(pending, image_matches, snapshot, timeout=timeout)
+            else:
+                image_matches = await annotate_matches_with_geometry(
+                    pending,
+                    image_matches,
+                    snapshot,
+                    kinds=(stage,),
+                    timeout=timeout,
+                )
         except Exception as e:
-            logger.warning("Image geometry verification failed: %s", e)
-    matches = filter_duplicate_matches(matches)
-    return fingerprints, matches
+            logger.warning("Image geometry verification (%s) failed: %s", stage, e)
+        yield update(stage)
 
-async def compute_duplicate_result_deep_videos(
-    content: DraftContent,
-) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    fingerprints = await compute_video_fingerprints(content)
-    matches = await detect_duplicate_videos_deep(fingerprints)
-    return fingerprints, matches
+DuplicateResult = Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]
+
+# декодированные картинки и ORB в кеше не держим; SIFT запроса (~136 байт на точку, массивы только для чтения)
+# и file_id остаются, чтобы публикация из кеша сохранила те же строки image_feature_cache, что и без него
+_RESULT_CACHE_DROP_KEYS = ("image", "orb_variants")
+
+def _copy_duplicate_result(result: DuplicateResult) -> DuplicateResult:
+    image_fps, video_fps, matches = result
+    return (
+        [{k: v for k, v in fp.items() if k not in _RESULT_CACHE_DROP_KEYS} for fp in image_fps],
+        [dict(fp) for fp in video_fps],
+        [dict(m) for m in matches],
+    )
+
+class DuplicateResultCache:
+    """Finished deep checks keyed by the items' file_unique_ids and the image/video index versions.
+
+    A resubmitted or reposted file gets the stored fingerprints and matches back while nothing was added to
+    or removed from the archive. Identical checks running at once share one computation (single flight),
+    which keeps running even if every caller is cancelled, so a quick cancel-and-resend still hits.
+    """
+
+    def __init__(self, ttl: float, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple[Any, ...], Tuple[float, DuplicateResult]]" = OrderedDict()
+        self._inflight: Dict[Tuple[Any, ...], asyncio.Task] = {}
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    @staticmethod
+    def key(content: DraftContent) -> Optional[Tuple[Any, ...]]:
+        unique_ids = tuple(item.get("file_unique_id") for item in content.items)
+        if not unique_ids or not all(unique_ids):
+            return None
+        return (content.kind, unique_ids, image_hash_index.version, video_candidate_index.version)
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[DuplicateResult]:
+        cached = self._items.get(key)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            self._items.pop(key, None)
+            return None
+        self._items.move_to_end(key)
+        return _copy_duplicate_result(cached[1])
+
+    def put(self, key: Tuple[Any, ...], result: DuplicateResult) -> None:
+        self._items[key] = (time.monotonic(), _copy_duplicate_result(result))
+        self._items.move_to_end(key)
+        while len(self._items) > max(1, self.max_items):
+            self._items.popitem(last=False)
+
+    async def run(self, key: Tuple[Any, ...], compute: Any) -> Tuple[DuplicateResult, bool]:
+        """Result for key and whether it came from the cache or a concurrent identical check."""
+        cached = self.get(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached, True
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return _copy_duplicate_result(await asyncio.shield(task)), True
+        self.stats["misses"] += 1
+        task = asyncio.create_task(compute())
+        self._inflight[key] = task
+
+        def finished(done: asyncio.Task) -> None:
+            if self._inflight.get(key) is done:
+                self._inflight.pop(key, None)
+            if not done.cancelled() and done.exception() is None:
+                self.put(key, done.result())
+
+        task.add_done_callback(finished)
+        return await asyncio.shield(task), False
+
+    def format_stats(self) -> str:
+        hits = self.stats["hits"] + self.stats["coalesced"]
+        lookups = hits + self.stats["misses"]
+        rate = f"{hits / lookups:.2f}" if lookups else "n/a"
+        return (
+            f"Кеш результатов проверок: {len(self._items)} шт., попаданий {self.stats['hits']}, "
+            f"склеено одновременных {self.stats['coalesced']}, промахов {self.stats['misses']} ({rate})"
+        )
+
+duplicate_result_cache = DuplicateResultCache(DUPLICATE_RESULT_CACHE_TTL_SECONDS, DUPLICATE_RESULT_CACHE_SIZE)
 
 async def compute_duplicate_result_deep(
     content: DraftContent,
-) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
-    image_fps: List[Dict[str, Any]] = []
-    video_fps: List[Dict[str, Any]] = []
-    matches: List[Dict[str, Any]] = []
-    if content_has_images(content):
-        image_fps, image_matches = await compute_duplicate_result_deep_images(content)
-        matches.extend(image_matches)
-    if content_has_videos(content):
-        video_fps, video_matches = await compute_duplicate_result_deep_videos(content)
-        matches.extend(video_matches)
-    return image_fps, video_fps, matches
+    *,
+    fast_matches: Optional[List[Dict[str, Any]]] = None,
+    progress: Optional[Dict[str, Any]] = None,
+    exclude_post_id: Optional[int] = None,
+) -> DuplicateResult:
+    """Run every stage of iter_duplicate_stages; progress, if given, tracks the latest stage and matches.
+
+    Goes through duplicate_result_cache when every item has a file_unique_id and no post is excluded.
+    """
+
+    async def compute() -> DuplicateResult:
+        result: DuplicateResult = ([], [], [])
+        async for update in iter_duplicate_stages(content, fast_matches, exclude_post_id):
+            result = (update.image_fps, update.video_fps, update.matches)
+            if progress is not None:
+                done = list(progress.get("done") or [])
+                done.append(update.stage)
+                progress["done"] = done
+                progress["matches"] = update.matches
+        return result
+
+    # без себя результат отличается от обычной проверки тех же файлов, в общий кеш его не кладём
+    cacheable = DUPLICATE_RESULT_CACHE_TTL_SECONDS > 0 and exclude_post_id is None
+    key = DuplicateResultCache.key(content) if cacheable else None
+    if key is None:
+        return await compute()
+    result, shared = await duplicate_result_cache.run(key, compute)
+    if shared and progress is not None:
+        progress["done"] = list(DUPLICATE_STAGES)
+        progress["matches"] = result[2]
+    return result
 
 def _parse_hash_distances(details: Optional[str]) -> Dict[str, int]:
     if not details:
@@ -5353,17 +8082,17 @@ def filter_duplicate_matches(matches: List[Dict[str, Any]]) -> List[Dict[str, An
     filtered: List[Dict[str, Any]] = []
     for match in matches:
         match_type = match.get("match_type")
-        if match_type == "unique_id":
+        if match_type in {"unique_id", "byte_hash"}:
             filtered.append(match)
             continue
         if match_type and str(match_type).startswith("video"):
             filtered.append(match)
             continue
-        if match_type in {"sift_geometry", "asift_geometry"}:
+        if match_type in {"sift_geometry", "asift_geometry", "orb_fallback"}:
             filtered.append(match)
             continue
         details = match.get("details") or ""
-        if "sift=" in details or "asift=" in details:
+        if "sift=" in details or "asift=" in details or "orb=" in details:
             filtered.append(match)
             continue
     return filtered
@@ -5507,27 +8236,35 @@ def _submit_confirm_base_text(
         return ADMIN_SUBMIT_CONFIRM_TEXT
     return ADMIN_SUBMIT_CONFIRM_NO_SCAN_TEXT
 
-def _submit_scan_progress_bar(elapsed: float) -> Tuple[str, int]:
+def _submit_scan_progress_bar(elapsed: float, stages_done: int = 0) -> Tuple[str, int]:
     expected = max(3.0, SUBMIT_DUPLICATE_SCAN_EXPECTED_SECONDS)
-    progress = min(0.94, max(0.05, elapsed / expected))
+    # пройденные стадии задают коридор, время двигает полосу внутри текущей
+    lower = stages_done / len(DUPLICATE_STAGES)
+    upper = (stages_done + 1) / len(DUPLICATE_STAGES) - 0.02
+    progress = min(0.94, max(0.05, min(upper, max(lower, elapsed / expected))))
     width = 18
     filled = int(round(width * progress))
     filled = max(1, min(width - 1, filled))
     bar = "[" + "#" * filled + "." * (width - filled) + "]"
     return bar, int(progress * 100)
 
-def _format_submit_duplicate_scan_progress(started_at: float, fast_matches: List[Dict[str, Any]]) -> str:
+def _format_submit_duplicate_scan_progress(
+    started_at: float,
+    fast_matches: List[Dict[str, Any]],
+    progress: Optional[Dict[str, Any]] = None,
+    duplicate_block: Optional[str] = None,
+) -> str:
     elapsed = max(0.0, time.monotonic() - started_at)
-    bar, percent = _submit_scan_progress_bar(elapsed)
-    if elapsed < 2:
-        step = "проверяю точные совпадения"
-    elif elapsed < 6:
-        step = "сравниваю с опубликованными постами"
-    else:
-        step = "перепроверяю самые похожие варианты"
+    done = list((progress or {}).get("done") or [])
+    bar, percent = _submit_scan_progress_bar(elapsed, len(done))
+    # подпись — стадия, которая идёт сейчас, а не прошедшее время
+    step = DUPLICATE_STAGE_LABELS[DUPLICATE_STAGES[min(len(done), len(DUPLICATE_STAGES) - 1)]]
+    found = _duplicate_post_ids_from_matches(list(fast_matches) + list((progress or {}).get("matches") or []))
     fast_line = ""
-    if fast_matches:
-        fast_line = f"\nУже вижу возможное совпадение: {len(fast_matches)}."
+    if found:
+        fast_line = f"\nУже вижу возможное совпадение: {len(found)}."
+    if duplicate_block:
+        fast_line = f"{fast_line}\n\n{duplicate_block}"
     return (
         "Проверка повторок выполняется.\n\n"
         "Пожалуйста, подождите: ищу похожие опубликованные посты. "
@@ -5541,11 +8278,20 @@ async def _animate_submit_duplicate_scan(
     message: Message,
     deep_task: asyncio.Task,
     fast_matches: List[Dict[str, Any]],
+    progress: Optional[Dict[str, Any]] = None,
+    session: Optional[Dict[str, Any]] = None,
 ) -> None:
+    """Live progress of a running check; a session from admin_duplicate_sessions gets early hits as they come."""
     started_at = time.monotonic()
     last_text = ""
     while not deep_task.done():
-        text = _format_submit_duplicate_scan_progress(started_at, fast_matches)
+        duplicate_block = None
+        if session is not None:
+            # совпадения промежуточных стадий уже отфильтрованы — это уверенные попадания
+            early = list(fast_matches) + list((progress or {}).get("matches") or [])
+            duplicate_block = _build_admin_duplicate_block(early, admin_view=bool(session.get("admin_view")))
+            session["duplicate_block"] = duplicate_block
+        text = _format_submit_duplicate_scan_progress(started_at, fast_matches, progress, duplicate_block)
         if text != last_text:
             try:
                 await bot.edit_message_text(text, chat_id=message.chat.id, message_id=message.message_id)
@@ -5993,6 +8739,10 @@ def _debug_split_text(text: str, *, limit: int = 3500) -> List[str]:
     return chunks
 
 def _feature_keypoint_count(row: aiosqlite.Row) -> int:
+    if not row["keypoints_json"]:
+        # бинарный формат: заголовок и по 8 + 128 байт на точку
+        desc_size = _ORB_DESCRIPTOR_SIZE if row["algo"] == "orb" else _SIFT_DESCRIPTOR_SIZE
+        return max(0, (int(row["descriptor_bytes"] or 0) - 8) // (8 + desc_size))
     try:
         raw = json.loads(row["keypoints_json"] or "[]")
         return len(raw) if isinstance(raw, list) else 0
@@ -6154,8 +8904,11 @@ async def _format_post_debug_info(
             if first_frame:
                 parts = []
                 for src, dst in (("t", "t"), ("d", "dhash"), ("p", "phash"), ("w", "whash")):
-                    if _debug_has_value(first_frame.get(src)):
-                        parts.append(f"{dst}={escape(str(first_frame.get(src)))}")
+                    value = first_frame.get(src)
+                    if src != "t" and isinstance(value, int):
+                        value = _hash_hex_from_signed(value)
+                    if _debug_has_value(value):
+                        parts.append(f"{dst}={escape(str(value))}")
                 if parts:
                     lines.append("первый кадр: " + ", ".join(parts))
 
@@ -6617,18 +9370,21 @@ async def backfill_dups(message: Message, command: CommandObject):
         need_video_fps = has_videos
         if not force:
             if has_images and await db.has_image_fingerprints(row["id"]):
-                need_image_fps = False
+                # старые отпечатки без байтового хеша пересчитываем целиком
+                need_image_fps = await db.has_image_fingerprints_without_sha(row["id"])
             if has_videos and await db.has_video_fingerprints(row["id"]):
-                need_video_fps = False
+                # старые отпечатки без звука или байтового хеша пересчитываем целиком
+                need_video_fps = (
+                    DUPLICATE_AUDIO_MAX_SECONDS > 0 and await db.has_video_fingerprints_without_audio(row["id"])
+                ) or await db.has_video_fingerprints_without_sha(row["id"])
             if not need_image_fps and not need_video_fps:
                 skipped += 1
                 continue
 
         try:
-            if force:
-                await db.delete_image_fingerprints(row["id"])
-                await db.delete_video_fingerprints(row["id"])
-            image_fps, video_fps, matches = await compute_duplicate_result_deep(content)
+            # старые отпечатки удаляем только после успешного пересчёта: при ошибке или пустом результате пост
+            # остаётся в индексе как был, а сам себя в проверке не видит
+            image_fps, video_fps, matches = await compute_duplicate_result_deep(content, exclude_post_id=row["id"])
             if not image_fps and not video_fps:
                 no_media += 1
                 continue
@@ -6636,9 +9392,11 @@ async def backfill_dups(message: Message, command: CommandObject):
             await db.set_post_duplicate_info(row["id"], dup_info)
             saved_any = False
             if image_fps and (force or need_image_fps):
+                await db.delete_image_fingerprints(row["id"])
                 await db.add_image_fingerprints(row["id"], image_fps)
                 saved_any = True
             if video_fps and (force or need_video_fps):
+                await db.delete_video_fingerprints(row["id"])
                 await db.add_video_fingerprints(row["id"], video_fps)
                 saved_any = True
             if not saved_any and not force:
@@ -6667,7 +9425,7 @@ async def backfill_features(message: Message, command: CommandObject):
         return
     parts = (command.args or "").split()
     if not parts:
-        await message.answer("Формат: /backfillfeatures <кол-во постов> [force] [asift]")
+        await message.answer("Формат: /backfillfeatures <кол-во постов> [force] [asift|orb]")
         return
     try:
         requested = int(parts[0])
@@ -6679,6 +9437,9 @@ async def backfill_features(message: Message, command: CommandObject):
         return
     force = any(p.lower() in {"force", "f", "-f", "rebuild"} for p in parts[1:])
     include_asift = any(p.lower() in {"asift", "affine", "full"} for p in parts[1:])
+    orb_mode = any(p.lower() == "orb" for p in parts[1:])
+    # orb — отдельный режим: только ORB, SIFT/ASIFT не трогаем
+    algos: Tuple[str, ...] = ("orb",) if orb_mode else (("sift", "asift") if include_asift else ("sift",))
     limit = min(requested, DUPLICATE_BACKFILL_MAX_POSTS)
     if limit != requested:
         await message.answer(f"Ограничиваю бэкфилл до {limit} постов.")
@@ -6686,11 +9447,10 @@ async def backfill_features(message: Message, command: CommandObject):
     if force:
         rows = await db.list_recent_posts(limit)
     else:
-        algo = "asift" if include_asift else "sift"
         rows = await db.list_recent_image_posts_without_feature_cache(
             limit,
-            algo,
-            DUPLICATE_SIFT_FEATURE_VERSION,
+            algos[-1],
+            _feature_cache_version(algos[-1]),
         )
     if not rows:
         await message.answer("Нет постов без feature-cache для бэкфилла.")
@@ -6698,7 +9458,7 @@ async def backfill_features(message: Message, command: CommandObject):
 
     total = len(rows)
     rows = list(reversed(rows))
-    mode_parts = ["форс" if force else "обычный", "asift" if include_asift else "sift"]
+    mode_parts = ["форс" if force else "обычный", algos[-1]]
     mode_label = ", ".join(mode_parts)
     status_msg = await message.answer(f"Бэкфилл признаков ({mode_label}): найдено {total} постов, начинаю...")
 
@@ -6719,11 +9479,11 @@ async def backfill_features(message: Message, command: CommandObject):
             continue
         try:
             if force:
-                await db.delete_image_feature_cache(row["id"])
+                await db.delete_image_feature_cache(row["id"], ["orb"] if orb_mode else ["sift", "asift"])
             cached_one, skipped_one, errors_one = await _cache_features_for_content(
                 row["id"],
                 content,
-                include_asift=include_asift,
+                algos=algos,
                 force=force,
             )
             cached += cached_one
@@ -7071,6 +9831,29 @@ async def bot_now(message: Message):
     now = datetime.now(TZ)
     await message.answer(now.strftime("Текущее время бота (TZ %z): %d/%m/%Y %H:%M:%S"))
 
+@dp.message(Command(commands=["dupstats"]))
+async def duplicate_stats(message: Message):
+    if not await is_super_admin(message.from_user.id):
+        return
+    if message.chat.type != "private":
+        return
+    await message.answer(
+        "Мнемосина:\n" + image_hash_index.format_stats()
+        + "\n\n" + video_candidate_index.format_stats()
+        + "\n" + video_frames_cache.format_stats()
+        + "\n\n" + feature_cache.format_stats()
+        + "\n" + duplicate_result_cache.format_stats()
+        + "\n\n" + mnemosyne_workers.format_stats()
+    )
+
+@dp.message(Command(commands=["mediacache"]))
+async def media_cache_stats(message: Message):
+    if not await is_super_admin(message.from_user.id):
+        return
+    if message.chat.type != "private":
+        return
+    await message.answer(media_cache.format_stats())
+
 @dp.message(Command(commands=["catpost"]))
 async def cat_post(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
@@ -7510,8 +10293,10 @@ async def superadmin_help(message: Message):
         "/broadcast текст или ответом - рассылка всем пользователям.\n"
         "/ban_hashtag tag, /unban_hashtag tag - бан/разбан по хэштегу.\n"
         "/backfilldups N [force] - бэкфилл отпечатков и дублей для последних N постов.\n"
-        "/backfillfeatures N [force] [asift] - прогреть SIFT/ASIFT feature-cache.\n"
-        "/backfillchannel N [force] - импорт постов из канала (если нет в БД) + отпечатки.",
+        "/backfillfeatures N [force] [asift|orb] - прогреть SIFT/ASIFT или ORB feature-cache.\n"
+        "/backfillchannel N [force] - импорт постов из канала (если нет в БД) + отпечатки.\n"
+        "/dupstats - счётчики индекса Мнемосины (recall/латентность).\n"
+        "/mediacache - размер и попадания дискового кеша медиа.",
     )
 
 @dp.message(Command(commands=["top"]))
@@ -8214,13 +10999,41 @@ async def capture_content(message: Message, state: FSMContext, album: Optional[L
         except Exception as e:
             logger.warning("Fast duplicate video precheck failed: %s", e)
 
-        deep_task = asyncio.create_task(compute_duplicate_result_deep(content))
+        scan_progress: Dict[str, Any] = {}
+        deep_task = asyncio.create_task(
+            compute_duplicate_result_deep(content, fast_matches=fast_matches, progress=scan_progress)
+        )
         control_message = await _send_submit_control_message(
             message,
             _format_submit_duplicate_scan_progress(time.monotonic(), fast_matches),
         )
-        progress_task = asyncio.create_task(_animate_submit_duplicate_scan(control_message, deep_task, fast_matches))
-        deep_done = True
+        # сессия заводится на время проверки: в "progress" пройденные стадии, в duplicate_block ранние совпадения
+        session: Dict[str, Any] = {
+            "user_id": message.from_user.id,
+            "chat_id": message.chat.id,
+            "message_id": control_message.message_id,
+            "draft_raw": draft_raw,
+            "base_text": "",
+            "duplicate_block": "",
+            "reply_markup": None,
+            "rendered_text": "",
+            "rendered_has_markup": False,
+            "fast_matches": fast_matches,
+            "admin_view": is_admin_sender,
+            "progress": scan_progress,
+            "deep_task": deep_task,
+            "deep_done": False,
+            "deep_failed": False,
+            "deep_result": None,
+            "post_id": None,
+            "saved_to_db": False,
+            "confirmed": False,
+            "lock": asyncio.Lock(),
+        }
+        admin_duplicate_sessions[token] = session
+        progress_task = asyncio.create_task(
+            _animate_submit_duplicate_scan(control_message, deep_task, fast_matches, scan_progress, session)
+        )
         deep_failed = False
         deep_result: Optional[Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]] = None
 
@@ -8228,6 +11041,7 @@ async def capture_content(message: Message, state: FSMContext, album: Optional[L
             deep_result = await deep_task
         except asyncio.CancelledError:
             progress_task.cancel()
+            admin_duplicate_sessions.pop(token, None)
             raise
         except Exception as e:
             deep_failed = True
@@ -8243,28 +11057,24 @@ async def capture_content(message: Message, state: FSMContext, album: Optional[L
         duplicate_block = _build_admin_duplicate_block(merged_matches, admin_view=is_admin_sender)
         base_text = _submit_confirm_base_text(duplicate_block, scan_failed=deep_failed, media_checked=True)
         rendered_text = _compose_admin_submit_message(base_text, duplicate_block)
-        confirm_message = await _edit_submit_control_to_confirm(control_message, rendered_text, confirm_markup)
-        admin_duplicate_sessions[token] = {
-            "user_id": message.from_user.id,
-            "chat_id": message.chat.id,
-            "message_id": confirm_message.message_id,
-            "draft_raw": draft_raw,
-            "base_text": base_text,
-            "duplicate_block": duplicate_block,
-            "reply_markup": confirm_markup,
-            "rendered_text": rendered_text,
-            "rendered_has_markup": True,
-            "fast_matches": fast_matches,
-            "admin_view": is_admin_sender,
-            "deep_task": deep_task,
-            "deep_done": deep_done,
-            "deep_failed": deep_failed,
-            "deep_result": deep_result,
-            "post_id": None,
-            "saved_to_db": False,
-            "confirmed": False,
-            "lock": asyncio.Lock(),
-        }
+        try:
+            confirm_message = await _edit_submit_control_to_confirm(control_message, rendered_text, confirm_markup)
+        except BaseException:
+            admin_duplicate_sessions.pop(token, None)
+            raise
+        session.update(
+            {
+                "message_id": confirm_message.message_id,
+                "base_text": base_text,
+                "duplicate_block": duplicate_block,
+                "reply_markup": confirm_markup,
+                "rendered_text": rendered_text,
+                "rendered_has_markup": True,
+                "deep_done": True,
+                "deep_failed": deep_failed,
+                "deep_result": deep_result,
+            }
+        )
         await state.update_data(admin_duplicate_session_token=token)
         return
 
@@ -8386,7 +11196,7 @@ async def confirm_send(callback: CallbackQuery, state: FSMContext):
                 with contextlib.suppress(Exception):
                     await db.set_post_duplicate_info(post_id, dup_info)
     elif content_has_images(content) or content_has_videos(content):
-        deep_task = asyncio.create_task(compute_duplicate_result_deep(content))
+        deep_task = asyncio.create_task(compute_duplicate_result_deep(content, fast_matches=dup_fast_matches))
         try:
             image_fps, video_fps, dup_deep_matches = await asyncio.wait_for(
                 asyncio.shield(deep_task), timeout=max(0.1, DUPLICATE_SYNC_TIMEOUT_SECONDS)
@@ -8783,13 +11593,19 @@ async def remember_last_admin_message(message: Message):
 
 async def main():
     await db.connect()
+    await image_hash_index.load(db)
+    await video_candidate_index.load(db)
+    await asyncio.to_thread(media_cache.load)
+    workers_warm_up = asyncio.create_task(mnemosyne_workers.warm_up())
     scheduler = asyncio.create_task(scheduler_loop())
     try:
         await dp.start_polling(bot)
     finally:
         scheduler.cancel()
+        workers_warm_up.cancel()
         with contextlib.suppress(Exception):
             await scheduler
+        mnemosyne_workers.shutdown()
         await db.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# bot.py читает токен при импорте; для тестов хватит фиктивного
+os.environ.setdefault("BOT_TOKEN", "123456:ABCdefGhIJKlmNoPQRstuVWXyz")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,123 @@
+"""Hashes of the 320px PhotoSize and of the draft-decoded level against archive rows hashed from the full-size original."""
+
+import io
+import pickle
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageOps
+
+import bot
+
+_LANCZOS = Image.Resampling.LANCZOS if hasattr(Image, "Resampling") else Image.LANCZOS
+_BICUBIC = Image.Resampling.BICUBIC if hasattr(Image, "Resampling") else Image.BICUBIC
+_SHAPES = [(1280, 960), (2560, 1920), (1080, 1350), (1600, 900)]
+
+
+def _photo(seed: int, width: int, height: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=(height // 48 + 2, width // 48 + 2, 3))
+    img = Image.fromarray(((base - base.min()) / np.ptp(base) * 255).astype(np.uint8)).resize((width, height), _BICUBIC)
+    draw = ImageDraw.Draw(img)
+    for _ in range(30):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(width // 80, width // 6))
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(int(v) for v in rng.integers(0, 255, 3)))
+    # зерно матрицы, иначе dhash на ровных заливках слишком стабилен
+    arr = np.asarray(img, dtype=np.int16) + rng.integers(-8, 8, (height, width, 3), dtype=np.int16)
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+
+def _meme(seed: int, width: int, height: int) -> Image.Image:
+    # светлый фон с текстом — самый неудобный случай для dhash
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGB", (width, height), tuple(int(v) for v in rng.integers(200, 256, 3)))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=max(12, height // 18))
+    for line in range(int(rng.integers(3, 10))):
+        text = "".join(chr(int(c)) for c in rng.integers(65, 90, int(rng.integers(6, 25))))
+        draw.text((int(rng.integers(10, width // 5)), 20 + line * height // 11), text, fill=(0, 0, 0), font=font)
+    if seed % 2:
+        img.paste(_photo(seed, width // 2, height // 3), (width // 4, height - height // 3 - 10))
+    return img
+
+
+def _jpeg(img: Image.Image, side: int = 0, quality: int = 87) -> bytes:
+    img = img.copy()
+    if side:
+        img.thumbnail((side, side), _LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _reference_hashes(raw: bytes) -> Tuple[int, int, int]:
+    # так хешировались строки архива: полный декод оригинала и размытие с исходным радиусом
+    with Image.open(io.BytesIO(raw)) as img:
+        gray = ImageOps.exif_transpose(img).convert("L")
+    gray = gray.filter(ImageFilter.GaussianBlur(radius=bot.DUPLICATE_GAUSSIAN_BLUR_RADIUS))
+    return bot._perceptual_hashes_batch(
+        [gray],
+        hash_size=bot.DUPLICATE_IMAGE_HASH_SIZE,
+        highfreq_size=bot.DUPLICATE_PHASH_HIGHFREQ_SIZE,
+        image_size=bot.DUPLICATE_WHASH_IMAGE_SIZE,
+    )[0]
+
+
+def _hashes(raw: bytes) -> Tuple[int, int, int]:
+    hashed = bot._image_hashes(bot.DecodedImage(raw))
+    return tuple(int(hashed[key], 16) for key in ("dhash", "phash", "whash"))
+
+
+def _images() -> List[Image.Image]:
+    imgs = []
+    for seed in range(24):
+        width, height = _SHAPES[seed % len(_SHAPES)]
+        imgs.append(_photo(seed, width, height) if seed % 3 else _meme(seed, width, height))
+    return imgs
+
+
+def _assert_within_fast_tier(pairs: List[Tuple[Tuple[int, int, int], Tuple[int, int, int]]]) -> None:
+    thresholds = bot._hash_match_tiers()[0][1]
+    for stored, query in pairs:
+        distances = {key: bin(a ^ b).count("1") for key, a, b in zip("dpw", stored, query)}
+        # каждый хеш по отдельности, а не только ансамбль: запас до порога должен оставаться
+        assert all(distances[key] <= thresholds[key] for key in distances), distances
+        assert bot._match_ensemble(distances, thresholds, bot.DUPLICATE_SINGLE_HASH_THRESHOLD)[0]
+
+
+@pytest.fixture(scope="module")
+def images() -> List[Image.Image]:
+    return _images()
+
+
+def test_photo_size_hashes_match_original(images):
+    side = bot.DUPLICATE_HASH_PHOTO_SIDE
+    assert side > 0
+    # Telegram пережимает превью заметно сильнее оригинала
+    _assert_within_fast_tier(
+        [(_reference_hashes(_jpeg(img)), _hashes(_jpeg(img, side, quality=80))) for img in images]
+    )
+
+
+def test_draft_level_hashes_match_full_decode(images):
+    assert bot.DUPLICATE_HASH_DECODE_DIM > 0
+    raws = [_jpeg(img) for img in images]
+    _assert_within_fast_tier([(_reference_hashes(raw), _hashes(raw)) for raw in raws])
+
+
+def test_job_view_carries_one_level(images):
+    raw = _jpeg(images[1])
+    image = bot.DecodedImage(raw)
+    sent = image.job_view(bot.DUPLICATE_HASH_DECODE_DIM)
+    assert sent.raw == raw and not sent._levels
+    hashed = bot._image_hashes(pickle.loads(pickle.dumps(sent)))
+    returned = pickle.loads(pickle.dumps(hashed["image"]))
+    # обратно едет только уровень для хешей, без байтов
+    assert not returned.raw and list(returned._levels) == [bot.DUPLICATE_HASH_DECODE_DIM]
+    image.adopt(returned)
+    assert image.size == images[1].size
+    again = image.job_view(bot.DUPLICATE_HASH_DECODE_DIM)
+    assert not again.raw
+    assert bot._image_hashes(again)["dhash"] == hashed["dhash"]
@@ -0,0 +1,208 @@
+"""Tiered perceptual-hash search against a brute-force pass over a fixture archive."""
+
+import asyncio
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+import bot
+
+_KEYS = ("dhash", "phash", "whash")
+
+
+def _flip(rng: random.Random, value: int, bits: int) -> int:
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+def _archive(rng: random.Random) -> Tuple[List[Dict[str, Any]], List[Tuple[int, str, List[Dict[str, Any]]]]]:
+    """Queries and (post_id, status, fingerprints) clustered around them at various distances."""
+    queries = []
+    for index in range(5):
+        base = [rng.getrandbits(64) for _ in _KEYS]
+        queries.append(
+            {
+                "item_index": index,
+                "kind": "photo",
+                # у последнего запроса размера нет: остаётся только поиск по всему архиву
+                "file_size": None if index == 4 else 100000 + index * 30000,
+                **{key: f"{value:016x}" for key, value in zip(_KEYS, base)},
+            }
+        )
+    posts = []
+    for post_id in range(1, 600):
+        fingerprints = []
+        for item_index in range(1 + (post_id % 3 == 0)):
+            query = rng.choice(queries)
+            hashes = [_flip(rng, int(query[key], 16), min(40, int(rng.expovariate(1 / 12)))) for key in _KEYS]
+            size = (query["file_size"] or 150000) + int(rng.gauss(0, 40000))
+            fingerprints.append(
+                {
+                    "item_index": item_index,
+                    "kind": "photo",
+                    "file_size": max(1, size),
+                    "width": 800,
+                    "height": 600,
+                    "dhash": f"{hashes[0]:016x}",
+                    "phash": f"{hashes[1]:016x}" if post_id % 17 else None,
+                    "whash": f"{hashes[2]:016x}",
+                }
+            )
+        posts.append((post_id, "pending" if post_id % 11 == 0 else "published", fingerprints))
+    return queries, posts
+
+
+def _reference_matches(query: Dict[str, Any], rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Each tier scans the published rows on its own; a row is reported under the first tier it passes."""
+    file_size = query["file_size"]
+    reported = set()
+    matches = []
+    for match_type, thresholds, size_tolerance, _limit in bot._hash_match_tiers():
+        if size_tolerance is None:
+            candidates = sorted(rows, key=lambda row: -row["id"])
+        elif file_size is None:
+            continue
+        else:
+            candidates = sorted(
+                (row for row in rows if abs(row["file_size"] - file_size) <= size_tolerance),
+                key=lambda row: (abs(row["file_size"] - file_size), -row["id"]),
+            )
+        for row in candidates:
+            distances = {
+                key[0]: bin(int(query[key], 16) ^ int(row[key], 16)).count("1") if row[key] else None for key in _KEYS
+            }
+            ok, score, details = bot._match_ensemble(distances, thresholds, bot.DUPLICATE_SINGLE_HASH_THRESHOLD)
+            if not ok or row["id"] in reported:
+                continue
+            reported.add(row["id"])
+            matches.append(
+                {
+                    "item_index": query["item_index"],
+                    "match_type": match_type,
+                    "post_id": row["post_id"],
+                    "distance": score,
+                    "details": details,
+                }
+            )
+    return matches
+
+
+async def _fill(database: bot.Database) -> Tuple[List[Dict[str, Any]], List[Tuple[int, str, List[Dict[str, Any]]]]]:
+    await database.db.execute("PRAGMA foreign_keys=OFF")
+    queries, posts = _archive(random.Random(7))
+    for post_id, status, fingerprints in posts:
+        await database.db.execute(
+            "INSERT INTO posts(id, user_id, status) VALUES (?, 1, ?)",
+            (post_id, status),
+        )
+        await database.add_image_fingerprints(post_id, fingerprints)
+    await database.db.commit()
+    return queries, posts
+
+
+async def _run(tmp_path, mode: str) -> Tuple[List[List[Dict[str, Any]]], List[List[Dict[str, Any]]], Dict[str, Any]]:
+    database = bot.Database(str(tmp_path / "tiers.db"))
+    await database.connect()
+    bot.db = database
+    try:
+        queries, posts = await _fill(database)
+        cur = await database.db.execute(
+            """
+            SELECT f.id, f.post_id, f.file_size, f.dhash, f.phash, f.whash
+            FROM image_fingerprints f JOIN posts p ON p.id = f.post_id
+            WHERE p.status='published'
+            """
+        )
+        rows = [dict(row) for row in await cur.fetchall()]
+        expected = [_reference_matches(query, rows) for query in queries]
+
+        snapshot: Optional[bot.ImageCandidateSnapshot] = None
+        if mode == "index":
+            await bot.image_hash_index.load(database)
+        elif mode == "snapshot":
+            snapshot = await bot.get_image_candidate_snapshot()
+        found = [await bot.detect_duplicate_images_deep([query], snapshot) for query in queries]
+        return found, expected, dict(bot.image_hash_index.stats)
+    finally:
+        await database.close()
+
+
+@pytest.fixture
+def tiers_env(monkeypatch):
+    monkeypatch.setattr(bot, "image_hash_index", bot.ImageHashIndex())
+    monkeypatch.setattr(bot, "_candidate_snapshot_cache", {"version": None, "snapshot": None})
+    # _run подменяет bot.db на базу из tmp_path, monkeypatch вернёт прежнюю
+    monkeypatch.setattr(bot, "db", bot.db)
+    monkeypatch.setattr(bot, "DUPLICATE_MIH_RECALL_SAMPLE_RATE", 0.0)
+    # без индекса лимиты кандидатов не должны ничего отрезать, иначе перебор не с чем сравнивать
+    monkeypatch.setattr(bot, "DUPLICATE_SIZE_CANDIDATE_LIMIT", 100000)
+    monkeypatch.setattr(bot, "DUPLICATE_SIZE_CANDIDATE_LIMIT_SLOW", 100000)
+    monkeypatch.setattr(bot, "DUPLICATE_FULLSCAN_LIMIT", 100000)
+    return monkeypatch
+
+
+@pytest.mark.parametrize("fullscan", [True, False])
+@pytest.mark.parametrize("mode", ["index", "snapshot", "database"])
+def test_tiers_match_brute_force(tmp_path, tiers_env, mode, fullscan):
+    if not fullscan:
+        tiers_env.setattr(bot, "DUPLICATE_FULLSCAN_LIMIT", 0)
+    found, expected, _stats = asyncio.run(_run(tmp_path, mode))
+    assert sum(len(matches) for matches in expected) > 100
+    for got, want in zip(found, expected):
+        assert got == want
+
+
+def test_index_uses_mih_for_the_tight_tier(tmp_path, tiers_env):
+    found, expected, stats = asyncio.run(_run(tmp_path, "index"))
+    assert found == expected
+    sized_queries = 4
+    assert stats["mih_queries"] == sized_queries
+    # медленные пороги не влезают в пробы MIH: на каждый запрос один линейный проход
+    assert stats["linear_queries"] == sized_queries + 1
+
+
+def test_linear_pass_stays_in_the_size_window_without_fullscan(tmp_path, tiers_env):
+    tiers_env.setattr(bot, "DUPLICATE_FULLSCAN_LIMIT", 0)
+    found, expected, stats = asyncio.run(_run(tmp_path, "index"))
+    assert found == expected
+    assert stats["mih_queries"] == stats["linear_queries"] == 4
+    assert stats["rows_scanned"] < stats["linear_queries"] * len(bot.image_hash_index)
+
+
+async def _unready_versions(tmp_path) -> List[Tuple[str, bool]]:
+    """(step, snapshot survived) for status changes while the index is not loaded."""
+    database = bot.Database(str(tmp_path / "unready.db"))
+    await database.connect()
+    bot.db = database
+    try:
+        await _fill(database)
+        steps = [
+            ("pending -> rejected", lambda: database.set_post_status(11, "rejected")),
+            ("published -> published", lambda: database.set_post_status(1, "published")),
+            ("drop rejected", lambda: database.delete_image_fingerprints(11)),
+            ("pending -> published", lambda: database.set_post_status(22, "published")),
+            ("published -> rejected", lambda: database.set_post_status(2, "rejected")),
+            ("drop published", lambda: database.delete_image_fingerprints(3)),
+        ]
+        survived = []
+        for name, step in steps:
+            snapshot = await bot.get_image_candidate_snapshot()
+            await step()
+            survived.append((name, await bot.get_image_candidate_snapshot() is snapshot))
+        return survived
+    finally:
+        await database.close()
+
+
+def test_unready_snapshot_survives_status_changes_without_row_changes(tmp_path, tiers_env):
+    assert not bot.image_hash_index.ready
+    assert asyncio.run(_unready_versions(tmp_path)) == [
+        ("pending -> rejected", True),
+        ("published -> published", True),
+        ("drop rejected", True),
+        ("pending -> published", False),
+        ("published -> rejected", False),
+        ("drop published", False),
+    ]
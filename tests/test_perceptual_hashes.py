@@ -0,0 +1,102 @@
+"""Batched dhash/phash/whash against the per-image helpers they replaced."""
+
+from typing import List
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import bot
+
+_RESAMPLE = Image.Resampling.BILINEAR if hasattr(Image, "Resampling") else Image.BILINEAR
+
+
+def _bits_to_hex(bits: List[int]) -> str:
+    value = 0
+    for b in bits:
+        value = (value << 1) | (1 if b else 0)
+    return f"{value:0{(len(bits) + 3) // 4}x}"
+
+
+def _median_bits(flat: np.ndarray) -> List[int]:
+    median = np.median(flat[1:]) if flat.size > 1 else flat[0]
+    return [1 if v > median else 0 for v in flat]
+
+
+def _reference_dhash(img: Image.Image, hash_size: int) -> str:
+    pixels = np.asarray(img.resize((hash_size + 1, hash_size), resample=_RESAMPLE).convert("L"), dtype=np.uint8)
+    return _bits_to_hex(
+        [1 if pixels[row, col] > pixels[row, col + 1] else 0 for row in range(hash_size) for col in range(hash_size)]
+    )
+
+
+def _reference_phash(img: Image.Image, hash_size: int, highfreq_size: int) -> str:
+    pixels = np.asarray(img.resize((highfreq_size, highfreq_size), resample=_RESAMPLE), dtype=np.float32)
+    mat = bot._dct_matrix(highfreq_size)
+    dct = mat @ pixels @ mat.T
+    return _bits_to_hex(_median_bits(dct[:hash_size, :hash_size].flatten()))
+
+
+def _reference_haar_step(arr: np.ndarray) -> np.ndarray:
+    rows, cols = arr.shape
+    temp = np.zeros_like(arr, dtype=np.float32)
+    temp[:, : cols // 2] = (arr[:, 0::2] + arr[:, 1::2]) * 0.5
+    temp[:, cols // 2 :] = (arr[:, 0::2] - arr[:, 1::2]) * 0.5
+    out = np.zeros_like(arr, dtype=np.float32)
+    out[: rows // 2, :] = (temp[0::2, :] + temp[1::2, :]) * 0.5
+    out[rows // 2 :, :] = (temp[0::2, :] - temp[1::2, :]) * 0.5
+    return out
+
+
+def _reference_whash(img: Image.Image, hash_size: int, image_size: int) -> str:
+    pixels = np.asarray(img.resize((image_size, image_size), resample=_RESAMPLE), dtype=np.float32)
+    coeffs = _reference_haar_step(_reference_haar_step(pixels))
+    return _bits_to_hex(_median_bits(coeffs[:hash_size, :hash_size].flatten()))
+
+
+def _random_grays(seed: int, count: int) -> List[Image.Image]:
+    rng = np.random.default_rng(seed)
+    imgs = []
+    for idx in range(count):
+        width, height = int(rng.integers(16, 700)), int(rng.integers(16, 700))
+        if idx % 7 == 0:
+            # ровные кадры: все коэффициенты на медиане
+            pixels = np.full((height, width), int(rng.integers(0, 256)), dtype=np.uint8)
+        elif idx % 3 == 0:
+            # плавные градиенты с шумом ближе к настоящим кадрам, чем белый шум
+            yy, xx = np.mgrid[0:height, 0:width]
+            base = 128 + 90 * np.sin(xx / rng.uniform(5, 80)) * np.cos(yy / rng.uniform(5, 80))
+            pixels = np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+        else:
+            pixels = rng.integers(0, 256, (height, width), dtype=np.uint8)
+        imgs.append(Image.fromarray(pixels, mode="L"))
+    return imgs
+
+
+@pytest.mark.parametrize(
+    "hash_size,highfreq_size,image_size",
+    [(8, 32, 32), (6, 32, 32), (16, 64, 64), (8, 32, 64)],
+)
+def test_batch_matches_per_image_helpers(hash_size, highfreq_size, image_size):
+    imgs = _random_grays(hash_size * 1000 + image_size, 60)
+    batched = bot._perceptual_hashes_batch(
+        imgs,
+        hash_size=hash_size,
+        highfreq_size=highfreq_size,
+        image_size=image_size,
+    )
+    bit_count = hash_size * hash_size
+    for img, (d, p, w) in zip(imgs, batched):
+        assert bot._hash_hex(d, bit_count) == _reference_dhash(img, hash_size)
+        assert bot._hash_hex(p, bit_count) == _reference_phash(img, hash_size, highfreq_size)
+        assert bot._hash_hex(w, bit_count) == _reference_whash(img, hash_size, image_size)
+
+
+def test_frame_hashes_match_signed_reference():
+    imgs = _random_grays(5, 40)
+    for img, frame in zip(imgs, bot._frame_hashes_batch(imgs)):
+        assert frame == {
+            "d": bot._hash_signed_from_hex(_reference_dhash(img, 8)),
+            "p": bot._hash_signed_from_hex(_reference_phash(img, 8, 32)),
+            "w": bot._hash_signed_from_hex(_reference_whash(img, 8, 32)),
+        }
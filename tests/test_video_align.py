@@ -0,0 +1,236 @@
+"""Matrix frame alignment against the per-pair loop it replaced."""
+
+import math
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+import bot
+
+
+def _reference_frame_match(frame_a: Dict[str, Any], frame_b: Dict[str, Any]) -> Tuple[bool, Optional[int]]:
+    distances = {
+        key: bot._distance64(bot._frame_hash_int(frame_a.get(key)), bot._frame_hash_int(frame_b.get(key)))
+        for key in ("d", "p", "w")
+    }
+    thresholds = {
+        "d": bot.DUPLICATE_VIDEO_DHASH_THRESHOLD,
+        "p": bot.DUPLICATE_VIDEO_PHASH_THRESHOLD,
+        "w": bot.DUPLICATE_VIDEO_WHASH_THRESHOLD,
+    }
+    available = [d for d in distances.values() if d is not None]
+    if not available:
+        return False, None
+    hits = sum(1 for key, dist in distances.items() if dist is not None and dist <= thresholds[key])
+    if hits < 2 and min(available) > bot.DUPLICATE_VIDEO_SINGLE_HASH_THRESHOLD:
+        return False, None
+    avg_dist = sum(available) / len(available)
+    if avg_dist > bot.DUPLICATE_VIDEO_FRAME_AVG_DIST_MAX or max(available) > bot.DUPLICATE_VIDEO_FRAME_MAX_DIST:
+        return False, None
+    return True, int(round(avg_dist))
+
+
+def _reference_match_frames(
+    fp_frames: List[Dict[str, Any]],
+    row_frames: List[Dict[str, Any]],
+    duration_fp: Optional[int],
+    duration_row: Optional[int],
+    fp_kind: Optional[str] = None,
+    row_kind: Optional[str] = None,
+) -> Optional[Tuple[int, int, float, int, float, int]]:
+    """_video_match_frames before the matrix engine, kept verbatim in behaviour."""
+    if not fp_frames or not row_frames:
+        return None
+    total = len(fp_frames)
+    min_required = max(bot.DUPLICATE_VIDEO_MATCH_MIN, int(math.ceil(total * bot.DUPLICATE_VIDEO_MATCH_RATIO)))
+    if total < bot.DUPLICATE_VIDEO_MATCH_MIN:
+        return None
+    use_absolute = fp_kind == "album" or row_kind == "album"
+
+    def timeline(frames: List[Dict[str, Any]], duration: Optional[int]) -> Optional[List[Tuple[float, Dict[str, Any]]]]:
+        out = []
+        for frame in frames:
+            t_ms = frame.get("t")
+            if t_ms is None:
+                continue
+            if use_absolute:
+                out.append((float(t_ms) / 1000.0, frame))
+            else:
+                if not duration:
+                    return None
+                out.append((float(t_ms) / float(duration), frame))
+        return out
+
+    q_frames = timeline(fp_frames, duration_fp)
+    if q_frames is None:
+        return None
+    c_frames = timeline(row_frames, duration_row)
+    if not q_frames or not c_frames:
+        return None
+    if use_absolute:
+        time_tol = bot.DUPLICATE_VIDEO_TIME_TOLERANCE_SECONDS
+    else:
+        duration_s = min(duration_fp, duration_row) / 1000.0 if duration_fp and duration_row else 0.0
+        abs_rel = (
+            bot.DUPLICATE_VIDEO_TIME_TOLERANCE_SECONDS / duration_s
+            if duration_s > 0
+            else bot.DUPLICATE_VIDEO_TIME_TOLERANCE
+        )
+        time_tol = min(bot.DUPLICATE_VIDEO_TIME_TOLERANCE, abs_rel)
+    bins_count = max(1, bot.DUPLICATE_VIDEO_TIME_BINS)
+    shifts = bot.DUPLICATE_VIDEO_TIME_SHIFTS_SECONDS if use_absolute else bot.DUPLICATE_VIDEO_TIME_SHIFTS
+    shifts = list(shifts or [0.0])
+    if use_absolute:
+        for q_time, _q_frame in q_frames:
+            for c_time, _c_frame in c_frames:
+                shifts.append(c_time - q_time)
+        shifts = sorted(set(shifts), key=lambda value: abs(value))
+        if bot.DUPLICATE_VIDEO_TIME_SHIFT_LIMIT > 0:
+            shifts = shifts[: bot.DUPLICATE_VIDEO_TIME_SHIFT_LIMIT]
+    best = None
+    best_key = None
+    for shift in shifts:
+        used: set[int] = set()
+        matched = 0
+        bins: set[int] = set()
+        score_sum = 0.0
+        score_worst = 0
+        for q_time, q_frame in q_frames:
+            best_idx = None
+            best_pick = None
+            for idx, (c_time, c_frame) in enumerate(c_frames):
+                if idx in used:
+                    continue
+                diff = abs((q_time + shift) - c_time)
+                if diff > time_tol:
+                    continue
+                ok, frame_score = _reference_frame_match(q_frame, c_frame)
+                if not ok or frame_score is None:
+                    continue
+                pick_key = (frame_score, diff)
+                if best_pick is None or pick_key < best_pick:
+                    best_pick = pick_key
+                    best_idx = idx
+            if best_idx is not None:
+                used.add(best_idx)
+                matched += 1
+                frame_score = int(best_pick[0])
+                score_sum += frame_score
+                score_worst = max(score_worst, frame_score)
+                if use_absolute and duration_fp:
+                    rel = q_time / max((duration_fp / 1000.0), 0.001)
+                else:
+                    rel = q_time
+                bins.add(min(bins_count - 1, max(0, int(rel * bins_count))))
+        ratio = matched / max(1, total)
+        if matched < min_required or ratio < bot.DUPLICATE_VIDEO_MATCH_RATIO:
+            continue
+        if total >= 4 and len(bins) < 2:
+            continue
+        if matched <= 0:
+            continue
+        avg_score = score_sum / float(matched)
+        if avg_score > bot.DUPLICATE_VIDEO_FRAME_AVG_DIST_MAX or score_worst > bot.DUPLICATE_VIDEO_FRAME_MAX_DIST:
+            continue
+        key = (matched, len(bins), -avg_score, -abs(shift))
+        if best_key is None or key > best_key:
+            best_key = key
+            best = (matched, total, float(shift), len(bins), float(avg_score), int(score_worst))
+    return best
+
+
+def _hash(rng: random.Random, base: int, flips: int) -> Any:
+    value = base
+    for _ in range(flips):
+        value ^= 1 << rng.randrange(64)
+    form = rng.random()
+    if form < 0.05:
+        return None
+    if form < 0.15:
+        return format(value, "016x")
+    # в базе кадры лежат знаковыми int64
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _video(rng: random.Random, count: int, duration: int, base: List[Dict[str, int]], flips: Tuple[int, int]):
+    frames = []
+    for i in range(count):
+        if rng.random() < 0.7:
+            t = round(duration * (i + 0.5) / count / 100) * 100
+        else:
+            t = rng.randrange(0, max(1, duration))
+        if rng.random() < 0.03:
+            t = None
+        src = base[i % len(base)]
+        frame: Dict[str, Any] = {"t": t}
+        for key in ("d", "p", "w"):
+            frame[key] = _hash(rng, src[key], rng.randint(*flips))
+        frames.append(frame)
+    return frames
+
+
+def _base(rng: random.Random, count: int) -> List[Dict[str, int]]:
+    return [{key: rng.getrandbits(64) for key in ("d", "p", "w")} for _ in range(max(1, count))]
+
+
+def _assert_same(expected, actual):
+    assert actual == expected
+    if expected is not None:
+        assert [type(x) for x in actual] == [type(x) for x in expected]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_reference_on_mixed_pairs(seed):
+    rng = random.Random(seed)
+    for _ in range(300):
+        n_q = rng.choice([0, 2, 3, 5, 8, 12, 16])
+        n_c = rng.choice([0, 3, 8, 12, 16, 20])
+        dur_q = rng.choice([None, 0, 8000, 30000, 30500, 120000])
+        dur_c = rng.choice([dur_q, 30000, 31000, None])
+        base = _base(rng, n_q)
+        query = _video(rng, n_q, dur_q or 30000, base, (0, 0))
+        cand = _video(rng, n_c, dur_c or 30000, base, rng.choice([(0, 3), (0, 12), (5, 25), (20, 40)]))
+        kinds = rng.choice([("video", "video"), ("album", "video"), ("video", "album"), ("album", "album"), (None, None)])
+        _assert_same(
+            _reference_match_frames(query, cand, dur_q, dur_c, *kinds),
+            bot._video_match_frames(query, cand, dur_q, dur_c, *kinds),
+        )
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_reference_on_near_duplicates(seed):
+    rng = random.Random(100 + seed)
+    matched = 0
+    for _ in range(300):
+        n_q = rng.choice([3, 5, 8, 12, 16])
+        n_c = rng.choice([3, 8, 12, 16, 20])
+        dur_q = rng.choice([8000, 30000, 30500])
+        dur_c = rng.choice([dur_q, dur_q + 300])
+        base = _base(rng, rng.choice([1, 2, n_q]))
+        query = _video(rng, n_q, dur_q, base, (0, 1))
+        cand = _video(rng, n_c, dur_c, base, rng.choice([(0, 2), (0, 8), (3, 16)]))
+        kinds = rng.choice([("video", "video"), ("album", "video"), ("album", "album")])
+        expected = _reference_match_frames(query, cand, dur_q, dur_c, *kinds)
+        _assert_same(expected, bot._video_match_frames(query, cand, dur_q, dur_c, *kinds))
+        matched += expected is not None
+    # набор должен проверять и совпавшие пары, а не только отказы
+    assert matched > 50
+
+
+def test_accepts_precomputed_frames():
+    rng = random.Random(0)
+    base = _base(rng, 16)
+    query = _video(rng, 16, 30000, base, (0, 0))
+    cand = _video(rng, 16, 30000, base, (0, 2))
+    expected = _reference_match_frames(query, cand, 30000, 30000, "video", "video")
+    assert expected is not None
+    actual = bot._video_match_frames(
+        bot.VideoFrames.from_frames(query),
+        bot.VideoFrames.from_frames(cand),
+        30000,
+        30000,
+        "video",
+        "video",
+    )
+    _assert_same(expected, actual)
@@ -0,0 +1,61 @@
+"""Frame LSH bookkeeping across discard, re-add and tail merges."""
+
+import random
+
+import numpy as np
+
+import bot
+
+
+def _frames(rng: random.Random, count: int = 8) -> bot.VideoFrames:
+    return bot.VideoFrames.from_frames(
+        [
+            {"t": idx * 1000, "d": rng.getrandbits(63), "p": rng.getrandbits(63), "w": rng.getrandbits(63)}
+            for idx in range(count)
+        ]
+    )
+
+
+def _votes(lsh: bot.VideoFrameLSH, frames: bot.VideoFrames) -> dict:
+    ids, votes = lsh.vote(frames)
+    return dict(zip(ids.tolist(), votes.tolist()))
+
+
+def _force_merge(lsh: bot.VideoFrameLSH, rng: random.Random, first_id: int) -> None:
+    # слияние хвоста начинается после 50000 ключей
+    fp_id = first_id
+    lsh.add([(fp_id, _frames(rng))])
+    while lsh._tail_keys.size:
+        fp_id += 1
+        lsh.add([(fp_id, _frames(rng))])
+
+
+def test_readded_id_survives_merge():
+    rng = random.Random(0)
+    rows = [(fp_id, _frames(rng)) for fp_id in range(1, 50)]
+    lsh = bot.VideoFrameLSH(8)
+    lsh.build(rows)
+    target = rows[4]
+
+    lsh.discard([target[0]])
+    lsh.add([target])
+    assert _votes(lsh, target[1])[target[0]] == len(target[1])
+
+    _force_merge(lsh, rng, 1000)
+    assert not lsh._dead
+    assert _votes(lsh, target[1])[target[0]] == len(target[1])
+    # старые ключи строки не задублированы
+    assert int(np.count_nonzero(lsh._ids == target[0])) == np.unique(bot._video_lsh_keys(target[1], 8)[0]).size
+
+
+def test_discarded_id_dropped_on_merge():
+    rng = random.Random(1)
+    rows = [(fp_id, _frames(rng)) for fp_id in range(1, 50)]
+    lsh = bot.VideoFrameLSH(8)
+    lsh.build(rows)
+    target = rows[7]
+
+    lsh.discard([target[0]])
+    _force_merge(lsh, rng, 1000)
+    assert target[0] not in _votes(lsh, target[1])
+    assert not np.any(lsh._ids == target[0])